@@ -0,0 +1,367 @@
+"""
+Daily adherence rollup.
+
+`daily_adherence` holds one row per (patient, medication, date) with scheduled,
+taken and missed dose counts. It is kept up to date incrementally:
+
+- recording an intake counts a scheduled + taken dose (a late intake for a dose
+  that was already reported missed moves it from missed to taken);
+- the missed-dose checker counts a scheduled + missed dose when it claims a miss.
+
+Days are UTC dates, like `taken_at`: an intake counts on the UTC date it was
+taken, a scheduled dose on the UTC date of its (local) scheduled time.
+
+The backfill command rebuilds the rollup for a date range from the medication
+schedules and the intake history (including archived intakes):
+
+    python -m adherence backfill --start 2024-01-01 --end 2024-12-31
+"""
+import argparse
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import case, delete, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+load_dotenv()
+
+from database import DailyAdherence, Medication, MedicationIntake, MissedDoseNotification, get_db, init_db
+from dose_timer import DAY_NAMES, day_times, parse_time
+from intake_archive import iter_archived_between
+
+BACKFILL_CHUNK_SIZE = 5000
+
+
+# --------------------
+# Days
+# --------------------
+def utc_day(local_time: datetime) -> date:
+    """Rollup day of a naive local time, such as a dose's scheduled_at."""
+    return local_time.astimezone(timezone.utc).date()
+
+
+def local_day(utc_time: datetime) -> date:
+    """Local date of a naive UTC time, such as an intake's taken_at."""
+    return utc_time.replace(tzinfo=timezone.utc).astimezone().date()
+
+
+def utc_today() -> date:
+    return datetime.utcnow().date()
+
+
+def utc_bounds(day: date) -> Tuple[datetime, datetime]:
+    """Naive UTC start and end of a local calendar day, to compare with taken_at."""
+    start, end = (datetime.combine(d, time.min).astimezone(timezone.utc) for d in (day, day + timedelta(days=1)))
+    return start.replace(tzinfo=None), end.replace(tzinfo=None)
+
+
+# --------------------
+# Incremental updates
+# --------------------
+def increments_statement(dialect_name: str):
+    """Upsert adding counts to rollup rows; execute with a list of rows (patient_id, medication_id, date and counts)."""
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    stmt = dialect.insert(DailyAdherence)
+    return stmt.on_conflict_do_update(
+        index_elements=["patient_id", "medication_id", "date"],
+        set_={
+            "scheduled": DailyAdherence.scheduled + stmt.excluded.scheduled,
+            "taken": DailyAdherence.taken + stmt.excluded.taken,
+            "missed": DailyAdherence.missed + stmt.excluded.missed,
+        },
+    )
+
+
+def increment_statement(
+    dialect_name: str,
+    patient_id: int,
+    medication_id: int,
+    day: date,
+    scheduled: int = 0,
+    taken: int = 0,
+    missed: int = 0,
+):
+    """Upsert adding the given counts to one rollup row. Works with sync and async sessions."""
+    return increments_statement(dialect_name).values(
+        patient_id=patient_id,
+        medication_id=medication_id,
+        date=day,
+        scheduled=scheduled,
+        taken=taken,
+        missed=missed,
+    )
+
+
+def count_missed_doses(db: Session, doses: Iterable) -> None:
+    """Count claimed missed doses (anything with medication_id, patient_id and scheduled_at)."""
+    counts: Dict[Tuple[int, int, date], int] = defaultdict(int)
+    for dose in doses:
+        counts[(dose.patient_id, dose.medication_id, utc_day(dose.scheduled_at))] += 1
+    if counts:
+        db.execute(increments_statement(db.get_bind().dialect.name), [
+            {"patient_id": patient_id, "medication_id": medication_id, "date": day,
+             "scheduled": missed, "taken": 0, "missed": missed}
+            for (patient_id, medication_id, day), missed in counts.items()
+        ])
+    db.commit()
+
+
+async def count_intake(
+    db: AsyncSession, intake_id: int, patient_id: int, medication_id: int, scheduled_time: str, status: str,
+    taken_at: datetime,
+) -> None:
+    """Count one just-inserted (flushed) intake; see `count_intakes`."""
+    await count_intakes(db, patient_id, [(intake_id, medication_id, scheduled_time, status, taken_at)])
+
+
+async def count_intakes(
+    db: AsyncSession, patient_id: int, intakes: Iterable[Tuple[int, int, str, str, datetime]],
+) -> None:
+    """
+    Count just-inserted (flushed) intakes of one patient, given as (intake_id,
+    medication_id, scheduled_time, status, taken_at), in the caller's transaction.
+
+    `taken_at` is naive UTC, as stored. Only the first intake recorded for a
+    dose on that UTC day counts; a late intake for a dose already counted as
+    missed moves it to taken. Runs two queries and one (executemany) upsert,
+    however many intakes there are.
+    """
+    first: Dict[Tuple[int, str, date], Tuple[int, str, datetime]] = {}
+    for intake_id, medication_id, scheduled_time, status, taken_at in sorted(intakes):
+        first.setdefault((medication_id, scheduled_time, taken_at.date()), (intake_id, status, taken_at))
+    if not first:
+        return
+
+    medication_ids = {medication_id for medication_id, _, _ in first}
+    days = [day for _, _, day in first]
+    window_start = datetime.combine(min(days), time.min)
+    window_end = datetime.combine(max(days) + timedelta(days=1), time.min)
+    earliest: Dict[Tuple[int, str, date], int] = {}
+    for intake_id, medication_id, scheduled_time, taken_at in await db.execute(
+        select(MedicationIntake.id, MedicationIntake.medication_id, MedicationIntake.scheduled_time, MedicationIntake.taken_at)
+        .where(
+            MedicationIntake.patient_id == patient_id,
+            MedicationIntake.medication_id.in_(medication_ids),
+            MedicationIntake.taken_at >= window_start,
+            MedicationIntake.taken_at < window_end,
+        )
+    ):
+        key = (medication_id, scheduled_time, taken_at.date())
+        earliest[key] = min(earliest.get(key, intake_id), intake_id)
+
+    # Notifications are keyed by the local day of the schedule
+    local_days = [local_day(taken_at) for _, _, taken_at in first.values()]
+    missed = set(
+        tuple(row) for row in await db.execute(
+            select(
+                MissedDoseNotification.medication_id,
+                MissedDoseNotification.scheduled_time,
+                MissedDoseNotification.scheduled_date,
+            ).where(
+                MissedDoseNotification.patient_id == patient_id,
+                MissedDoseNotification.medication_id.in_(medication_ids),
+                MissedDoseNotification.scheduled_date >= min(local_days),
+                MissedDoseNotification.scheduled_date <= max(local_days),
+            )
+        )
+    )
+
+    counts: Dict[Tuple[int, date], Dict[str, int]] = defaultdict(lambda: {"scheduled": 0, "taken": 0, "missed": 0})
+    for (medication_id, scheduled_time, day), (intake_id, status, taken_at) in first.items():
+        if earliest.get((medication_id, scheduled_time, day), intake_id) < intake_id:
+            continue
+        row = counts[(medication_id, day)]
+        taken = status == "taken"
+        if (medication_id, scheduled_time, local_day(taken_at)) in missed:
+            if taken:
+                row["taken"] += 1
+                row["missed"] -= 1
+        else:
+            row["scheduled"] += 1
+            row["taken" if taken else "missed"] += 1
+
+    values = [
+        {"patient_id": patient_id, "medication_id": medication_id, "date": day, **row}
+        for (medication_id, day), row in counts.items() if any(row.values())
+    ]
+    if values:
+        await db.execute(increments_statement(db.get_bind().dialect.name), values)
+
+
+# --------------------
+# Reporting
+# --------------------
+def summary_query(patient_id: int, start: date, end: date):
+    """Per-medication totals over [start, end], with the medication name."""
+    return (
+        select(
+            DailyAdherence.medication_id,
+            func.coalesce(Medication.name, "Unknown").label("medication_name"),
+            func.sum(DailyAdherence.scheduled).label("scheduled"),
+            func.sum(DailyAdherence.taken).label("taken"),
+            func.sum(DailyAdherence.missed).label("missed"),
+        )
+        # Deleted medications keep their history
+        .outerjoin(Medication, Medication.id == DailyAdherence.medication_id)
+        .where(
+            DailyAdherence.patient_id == patient_id,
+            DailyAdherence.date >= start,
+            DailyAdherence.date <= end,
+        )
+        .group_by(DailyAdherence.medication_id, Medication.name)
+        .order_by(Medication.name, DailyAdherence.medication_id)
+    )
+
+
+def adherence_percentage(scheduled: int, taken: int) -> Optional[float]:
+    if not scheduled:
+        return None
+    return round(min(taken, scheduled) / scheduled * 100, 1)
+
+
+# --------------------
+# Backfill
+# --------------------
+def backfill(db: Session, start: date, end: date, today: Optional[date] = None) -> int:
+    """
+    Rebuild the rollup for [start, end] in one transaction.
+
+    Past days: scheduled counts come from the current schedules of active
+    medications, within their start and end dates, and taken counts from
+    distinct (medication, scheduled_time) intakes; every other scheduled dose
+    counts as missed. Today (and later, in UTC) only holds what the
+    incremental path would have counted so far: recorded intakes plus doses the
+    checker already reported missed.
+    """
+    today = today or utc_today()
+
+    taken: Dict[Tuple[int, int, date], Tuple[int, int]] = {}
+    intake_day = func.date(MedicationIntake.taken_at)
+    rows = db.execute(
+        select(
+            MedicationIntake.patient_id,
+            MedicationIntake.medication_id,
+            intake_day.label("day"),
+            func.count(func.distinct(case((MedicationIntake.status == "taken", MedicationIntake.scheduled_time)))),
+            func.count(func.distinct(case((MedicationIntake.status != "taken", MedicationIntake.scheduled_time)))),
+        )
+        .where(
+            MedicationIntake.taken_at >= datetime.combine(start, time.min),
+            MedicationIntake.taken_at < datetime.combine(end + timedelta(days=1), time.min),
+        )
+        .group_by(MedicationIntake.patient_id, MedicationIntake.medication_id, intake_day)
+    )
+    for patient_id, medication_id, day, taken_count, other_count in rows:
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        taken[(patient_id, medication_id, day)] = (taken_count, other_count)
+
+    # Archiving moves whole days, so a day's intakes are either all hot or all archived
+    archived: Dict[Tuple[int, int, date], Tuple[set, set]] = defaultdict(lambda: (set(), set()))
+    for intake in iter_archived_between(
+        db, datetime.combine(start, time.min), datetime.combine(end + timedelta(days=1), time.min)
+    ):
+        taken_times, other_times = archived[(intake["patient_id"], intake["medication_id"], intake["taken_at"].date())]
+        (taken_times if intake["status"] == "taken" else other_times).add(intake["scheduled_time"])
+    for key, (taken_times, other_times) in archived.items():
+        hot_taken, hot_other = taken.get(key, (0, 0))
+        taken[key] = (hot_taken + len(taken_times), hot_other + len(other_times))
+
+    counts: Dict[Tuple[int, int, date], Dict[str, int]] = defaultdict(lambda: {"scheduled": 0, "taken": 0, "missed": 0})
+    # Only doses the checker would have counted: active medications, between their start and end dates
+    medications = db.execute(
+        select(Medication.id, Medication.patient_id, Medication.schedule, Medication.start_date, Medication.end_date)
+        .where(
+            Medication.is_active == True,
+            or_(Medication.start_date.is_(None), Medication.start_date < datetime.combine(end + timedelta(days=1), time.min)),
+            or_(Medication.end_date.is_(None), Medication.end_date >= datetime.combine(start, time.min)),
+        )
+    )
+    for medication_id, patient_id, schedule, start_date, end_date in medications:
+        times_per_weekday = [[parsed for parsed, _ in day_times(schedule, day_name)] for day_name in DAY_NAMES]
+        first = max(start, start_date.date()) if start_date else start
+        last = min(end, today - timedelta(days=1))
+        if end_date:
+            last = min(last, end_date.date())
+        # Schedules are local times; a dose counts on the UTC day of its scheduled time
+        schedule_day = first - timedelta(days=1)
+        while schedule_day <= last + timedelta(days=1):
+            for parsed in times_per_weekday[schedule_day.weekday()]:
+                day = utc_day(datetime.combine(schedule_day, parsed))
+                if first <= day <= last:
+                    counts[(patient_id, medication_id, day)]["scheduled"] += 1
+            schedule_day += timedelta(days=1)
+
+    for key, (taken_count, other_count) in taken.items():
+        counts[key]["taken"] = taken_count
+        counts[key]["scheduled"] = max(counts[key]["scheduled"], taken_count + other_count)
+
+    for (_, _, day), row in counts.items():
+        row["missed"] = row["scheduled"] - row["taken"]
+
+    # Reported misses today that no intake has made up for yet
+    if start <= today <= end:
+        intake_recorded = (
+            select(MedicationIntake.id)
+            .where(
+                MedicationIntake.patient_id == MissedDoseNotification.patient_id,
+                MedicationIntake.medication_id == MissedDoseNotification.medication_id,
+                MedicationIntake.scheduled_time == MissedDoseNotification.scheduled_time,
+                MedicationIntake.taken_at >= datetime.combine(today, time.min),
+            )
+            .exists()
+        )
+        # Notifications are keyed by local schedule day, which may be a day either side of today in UTC
+        reported = db.execute(
+            select(
+                MissedDoseNotification.patient_id, MissedDoseNotification.medication_id,
+                MissedDoseNotification.scheduled_date, MissedDoseNotification.scheduled_time,
+            )
+            .where(
+                MissedDoseNotification.scheduled_date >= today - timedelta(days=1),
+                MissedDoseNotification.scheduled_date <= today + timedelta(days=1),
+                ~intake_recorded,
+            )
+        )
+        for patient_id, medication_id, scheduled_date, scheduled_time in reported:
+            parsed = parse_time(scheduled_time)
+            if parsed is None or utc_day(datetime.combine(scheduled_date, parsed)) != today:
+                continue
+            row = counts[(patient_id, medication_id, today)]
+            row["scheduled"] += 1
+            row["missed"] += 1
+
+    db.execute(delete(DailyAdherence).where(DailyAdherence.date >= start, DailyAdherence.date <= end))
+    values = [
+        {"patient_id": patient_id, "medication_id": medication_id, "date": day, **row}
+        for (patient_id, medication_id, day), row in counts.items()
+    ]
+    for i in range(0, len(values), BACKFILL_CHUNK_SIZE):
+        db.execute(DailyAdherence.__table__.insert(), values[i:i + BACKFILL_CHUNK_SIZE])
+    db.commit()
+    return len(values)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Daily adherence rollup maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser("backfill", help="Rebuild the rollup from medication_intakes")
+    backfill_parser.add_argument("--start", type=date.fromisoformat, default=utc_today() - timedelta(days=90))
+    backfill_parser.add_argument("--end", type=date.fromisoformat, default=utc_today())
+    args = parser.parse_args()
+
+    init_db()
+    db = next(get_db())
+    try:
+        rows = backfill(db, args.start, args.end)
+        print(f"Rebuilt {rows} daily adherence rows for {args.start} to {args.end}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
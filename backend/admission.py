@@ -0,0 +1,175 @@
+"""
+Admission control for the CPU-heavy authentication endpoints.
+
+Login runs bcrypt and the 2FA endpoints verify TOTP codes. Before doing that
+work a request must get a token from the bucket of its client IP and from the
+bucket of the username it is for, and a login must find a free password
+verification slot. Requests that don't are rejected straight away with 429
+and a Retry-After header, so a burst of attempts can't starve the medication
+endpoints on the same worker.
+
+Buckets live in this process only; with several workers each enforces its own
+limits.
+
+Behind a reverse proxy every request comes from the proxy's address, so the
+client IP is taken from X-Forwarded-For when the peer is listed in
+FORWARDED_ALLOW_IPS (the variable uvicorn's --proxy-headers also reads).
+"""
+import ipaddress
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, status
+
+import metrics
+
+AUTH_IP_RATE_PER_MINUTE = float(os.getenv("AUTH_IP_RATE_PER_MINUTE", "60"))
+AUTH_USERNAME_RATE_PER_MINUTE = float(os.getenv("AUTH_USERNAME_RATE_PER_MINUTE", "10"))
+PASSWORD_VERIFY_MAX_IN_FLIGHT = int(os.getenv("PASSWORD_VERIFY_MAX_IN_FLIGHT", "16"))
+RATE_LIMIT_MAX_KEYS = 100000
+# Comma-separated proxy addresses or networks whose X-Forwarded-For is believed; "*" trusts any peer
+FORWARDED_ALLOW_IPS = [ip.strip() for ip in os.getenv("FORWARDED_ALLOW_IPS", "").split(",") if ip.strip()]
+
+
+def is_trusted_proxy(address: str, trusted: List[str]) -> bool:
+    if "*" in trusted:
+        return True
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in ipaddress.ip_network(network, strict=False) for network in trusted)
+
+
+def forwarded_client_ip(
+    peer: Optional[str], forwarded_for: Optional[str], trusted: Optional[List[str]] = None,
+) -> Optional[str]:
+    """
+    The address to rate limit: the peer, or if the peer is a trusted proxy
+    (FORWARDED_ALLOW_IPS by default), the right-most X-Forwarded-For entry that
+    isn't one (entries left of it are whatever the client chose to send).
+    """
+    trusted = FORWARDED_ALLOW_IPS if trusted is None else trusted
+    if not peer or not forwarded_for or not is_trusted_proxy(peer, trusted):
+        return peer
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop, trusted):
+            return hop
+    return hops[0] if hops else peer
+
+
+class RateLimiter:
+    """
+    Token buckets per key: `rate_per_minute` tokens a minute, holding at most a
+    minute's worth. Bounded LRU; an evicted key starts again with a full bucket.
+    """
+
+    def __init__(self, rate_per_minute: float, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(rate_per_minute, 1.0)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str) -> Optional[float]:
+        """Take a token for `key`. Returns None if allowed, else the seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.capacity, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return None
+            return (1 - bucket[0]) / self.rate if self.rate > 0 else 60.0
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def too_many_requests(retry_after: float, detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionController:
+    """Per-IP and per-username rate limits plus a cap on concurrent password verifications."""
+
+    def __init__(
+        self,
+        ip_rate_per_minute: float = AUTH_IP_RATE_PER_MINUTE,
+        username_rate_per_minute: float = AUTH_USERNAME_RATE_PER_MINUTE,
+        max_in_flight: int = PASSWORD_VERIFY_MAX_IN_FLIGHT,
+    ):
+        self.by_ip = RateLimiter(ip_rate_per_minute)
+        self.by_username = RateLimiter(username_rate_per_minute)
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0  # only touched on the event loop
+        self._stats = {"admitted": 0, "shed_ip": 0, "shed_username": 0, "shed_concurrency": 0}
+
+    def admit(self, client_ip: Optional[str], username: Optional[str]) -> None:
+        """Take a token from both buckets or raise 429."""
+        retry_after = self.by_ip.acquire(client_ip or "unknown")
+        if retry_after is not None:
+            self._stats["shed_ip"] += 1
+            raise too_many_requests(retry_after, "Too many attempts from this address, try again later")
+
+        if username:
+            retry_after = self.by_username.acquire(username.strip().lower())
+            if retry_after is not None:
+                self._stats["shed_username"] += 1
+                raise too_many_requests(retry_after, "Too many attempts for this account, try again later")
+
+        self._stats["admitted"] += 1
+
+    @asynccontextmanager
+    async def password_verification(self):
+        """Hold a verification slot for the duration of the block, or raise 429 if all are taken."""
+        if self.in_flight >= self.max_in_flight:
+            self._stats["shed_concurrency"] += 1
+            raise too_many_requests(1, "Server busy, try again shortly")
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def stats(self) -> Dict[str, int]:
+        stats = dict(self._stats)
+        stats["in_flight"] = self.in_flight
+        stats["tracked_ips"] = len(self.by_ip)
+        stats["tracked_usernames"] = len(self.by_username)
+        return stats
+
+
+auth_admission = AdmissionController()
+
+metrics.registry.callback(
+    "auth_requests_admitted_total", "counter", "Login and 2FA requests let through admission control.",
+    lambda: [((), auth_admission.stats()["admitted"])],
+)
+metrics.registry.callback(
+    "auth_requests_shed_total", "counter", "Login and 2FA requests rejected with 429, by reason.",
+    lambda: [((reason,), auth_admission.stats()[f"shed_{reason}"]) for reason in ("ip", "username", "concurrency")],
+    ("reason",),
+)
+metrics.registry.callback(
+    "password_verifications_in_flight", "gauge", "Logins currently holding a password verification slot.",
+    lambda: [((), auth_admission.in_flight)],
+)
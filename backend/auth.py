@@ -1,14 +1,24 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, Union  # ← Make sure Dict and Any are here!
+from typing import Optional, Dict, Any, Tuple, Union  # ← Make sure Dict and Any are here!
+import os
+import threading
+import time
 
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 import pyotp
 
-from database import get_db, User
+from database import AsyncSessionLocal, get_async_db, User
+import metrics
 
 # --------------------
 # Security configuration
@@ -16,9 +26,88 @@ from database import get_db, User
 SECRET_KEY = "your-secret-key-change-this-in-production"  # Change this in production!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 120
+PRINCIPAL_CACHE_TTL_SECONDS = 60
+PRINCIPAL_CACHE_MAX_ENTRIES = 10000
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt cost; hashes made with another cost are re-hashed on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads for password hashing (bcrypt releases the GIL while hashing)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/login", auto_error=False)
+
+
+# --------------------
+# Principal cache
+# --------------------
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as seen by the endpoints."""
+    id: int
+    username: str
+    role_name: str
+    is_2fa_enabled: bool
+
+
+class PrincipalCache:
+    """
+    Bounded LRU cache of resolved principals with a TTL, keyed by token subject.
+
+    Entries are dropped explicitly when a user changes; the TTL bounds how long
+    other worker processes can serve a stale entry.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # username -> (expires_at, principal)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, username: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[username]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, principal: Principal) -> None:
+        with self._lock:
+            self._entries[principal.username] = (time.monotonic() + self.ttl_seconds, principal)
+            self._entries.move_to_end(principal.username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._entries.pop(username, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL_SECONDS)
 
 
 # --------------------
@@ -55,6 +144,26 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def run_password_job(fn, *args):
+    """Run a bcrypt call on the password pool so it doesn't block the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(password_executor, fn, *args)
+
+
+def _timed_verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    with metrics.Timer(metrics.password_verify_duration):
+        return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password off the event loop. Returns (valid, new_hash); new_hash is set when the cost changed."""
+    return await run_password_job(_timed_verify_and_update, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password off the event loop."""
+    return await run_password_job(pwd_context.hash, password)
+
+
 # --------------------
 # JWT helpers
 # --------------------
@@ -89,27 +198,57 @@ def verify_2fa_token(token: str) -> Dict[str, Any]:
 # --------------------
 # Auth helpers
 # --------------------
-def authenticate_user(db: Session, username: str, password: str) -> Union[User, bool]:
+async def load_user(db: AsyncSession, username: str) -> Optional[User]:
+    """Load a user with its role, which async sessions cannot lazy-load."""
+    result = await db.execute(select(User).options(joinedload(User.role)).where(User.username == username))
+    return result.scalars().first()
+
+
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Union[User, bool]:
     """Authenticate a user by username and password."""
-    user = db.query(User).filter(User.username == username).first()
+    user = await load_user(db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+
+    valid, new_hash = await verify_password_async(password, user.hashed_password)
+    if not valid:
         return False
+
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
-) -> User:
+    db: AsyncSession = Depends(get_async_db),
+) -> Principal:
     """Get the current authenticated user from JWT token."""
+    return await resolve_principal(db, token)
+
+
+async def get_event_stream_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    access_token: Optional[str] = Query(None),
+) -> Principal:
+    """Like get_current_user, but also accepts ?access_token= since EventSource cannot send headers."""
+    # Own short-lived session: a request-scoped one would stay open for the whole stream
+    async with AsyncSessionLocal() as db:
+        return await resolve_principal(db, token or access_token)
+
+
+async def resolve_principal(db: AsyncSession, token: Optional[str]) -> Principal:
+    """Resolve a JWT access token to a Principal, from the cache when possible."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+    if not token:
+        raise credentials_exception
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: Optional[str] = payload.get("sub")
@@ -118,8 +257,19 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = db.query(User).filter(User.username == username).first()
+    principal = principal_cache.get(username)
+    if principal is not None:
+        return principal
+
+    user = await load_user(db, username)
     if user is None:
         raise credentials_exception
 
-    return user  # fixed: Python comment uses #
+    principal = Principal(
+        id=user.id,
+        username=user.username,
+        role_name=user.role.name,
+        is_2fa_enabled=user.is_2fa_enabled,
+    )
+    principal_cache.put(principal)
+    return principal
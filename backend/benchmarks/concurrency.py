@@ -0,0 +1,127 @@
+"""
+Request throughput under parallel load: blocking sync sessions vs the async data-access path.
+
+Both variants serve GET /api/patients/{id}/medications against the same SQLite
+file. The "sync" variant is the pre-async handler (an async def endpoint
+querying through database.get_db), mounted under /bench/sync for comparison.
+--io-latency-ms adds a sleep to every statement inside the thread that runs
+it, standing in for disk or network latency; that is where the blocking
+variant serializes. Keep --concurrency at or below the sync pool size (DB_POOL_SIZE + DB_MAX_OVERFLOW):
+beyond it the sync variant can deadlock the threadpool on connection checkout.
+
+Run from the backend directory:
+
+    python -m benchmarks.concurrency --concurrency 1 5 10 --io-latency-ms 2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time as timer
+from typing import List
+
+import httpx
+from fastapi import Depends
+from sqlalchemy import event
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def drive(client: httpx.AsyncClient, path: str, headers: dict, total: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one():
+        async with semaphore:
+            started = timer.perf_counter()
+            response = await client.get(path, headers=headers)
+            latencies.append(timer.perf_counter() - started)
+            response.raise_for_status()
+
+    started = timer.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = timer.perf_counter() - started
+    return total / elapsed, statistics.median(latencies), percentile(latencies, 95)
+
+
+async def run(args):
+    import main
+    from database import Medication, User, async_engine, engine, get_db
+    from sqlalchemy.orm import Session
+
+    @main.app.get("/bench/sync/patients/{patient_id}/medications", response_model=List[main.MedicationResponse])
+    async def sync_patient_medications(
+        patient_id: int,
+        db: Session = Depends(get_db),
+        current_user: main.Principal = Depends(main.get_current_user),
+    ):
+        patient = db.query(User).filter(User.id == patient_id).first()
+        return db.query(Medication).filter(Medication.patient_id == patient.id).all()
+
+    await main.startup_event()
+    try:
+        def add_latency(_statement):
+            timer.sleep(args.io_latency_ms / 1000)
+
+        # The sqlite3 trace callback runs in the thread executing the statement:
+        # the event loop for the sync engine, aiosqlite's worker for the async one.
+        @event.listens_for(engine, "connect")
+        def trace_sync(dbapi_connection, _record):
+            dbapi_connection.set_trace_callback(add_latency)
+
+        @event.listens_for(async_engine.sync_engine, "connect")
+        def trace_async(dbapi_connection, _record):
+            dbapi_connection.run_async(lambda conn: conn._execute(conn._conn.set_trace_callback, add_latency))
+
+        if args.io_latency_ms:
+            engine.dispose()
+            await async_engine.dispose()
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            login = await client.post("/api/login", data={"username": "mantelzorger1", "password": "password123"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            patient_id = (await client.get("/api/patients", headers=headers)).json()[0]["id"]
+            for i in range(args.medications):
+                await client.post(
+                    f"/api/patients/{patient_id}/medications",
+                    json={"name": f"med{i}", "dosage": "10mg", "schedule": {}},
+                    headers=headers,
+                )
+
+            variants = {
+                "sync": f"/bench/sync/patients/{patient_id}/medications",
+                "async": f"/api/patients/{patient_id}/medications",
+            }
+            print(f"{'variant':>8} {'conc':>5} {'req/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+            for concurrency in args.concurrency:
+                for name, path in variants.items():
+                    rps, p50, p95 = await drive(client, path, headers, args.requests, concurrency)
+                    print(f"{name:>8} {concurrency:>5} {rps:>9.1f} {p50 * 1000:>9.2f} {p95 * 1000:>9.2f}")
+    finally:
+        await main.shutdown_event()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--medications", type=int, default=20)
+    parser.add_argument("--io-latency-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    # database.py uses a relative SQLite path, so run against a scratch directory
+    sys.path.insert(0, os.getcwd())
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ["EMAIL_ADDRESS"] = ""
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,208 @@
+"""
+Synthetic dataset: caregivers, patients, medications with varied schedules and
+months of intake history, written with bulk inserts.
+
+Every generated user has the same password (one bcrypt hash is computed and
+shared). Point DATABASE_URL at a scratch database, then run from the backend
+directory:
+
+    python -m benchmarks.dataset --caregivers 20 --patients-per-caregiver 5 --history-days 90
+"""
+import argparse
+import random
+import time as timer
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+load_dotenv()
+
+from adherence import backfill
+from auth import get_password_hash
+from database import Medication, MedicationIntake, Role, ScheduleSlot, User, get_db, init_db
+from dose_timer import DAY_NAMES, day_times
+from schedule_slots import slot_rows
+
+INSERT_CHUNK_SIZE = 10000
+MEDICATION_NAMES = [
+    "Metformine", "Lisinopril", "Atorvastatine", "Omeprazol", "Amlodipine", "Levothyroxine",
+    "Paracetamol", "Bisoprolol", "Furosemide", "Clopidogrel", "Simvastatine", "Pantoprazol",
+]
+DOSAGES = ["5mg", "10mg", "20mg", "40mg", "500mg", "1 tablet", "2 tabletten"]
+WEEKDAYS = DAY_NAMES[:5]
+
+
+@dataclass
+class DatasetSpec:
+    caregivers: int = 20
+    patients_per_caregiver: int = 5
+    medications_per_patient: int = 4
+    history_days: int = 90
+    due_now_fraction: float = 0.1  # medications with a dose whose grace period just ran out
+    password: str = "password123"
+    seed: int = 42
+
+
+@dataclass
+class DatasetSummary:
+    caregivers: int
+    patients: int
+    medications: int
+    schedule_slots: int
+    intakes: int
+    seconds: float
+
+
+def random_schedule(rng: random.Random, extra_time: Optional[str] = None, extra_day: Optional[str] = None) -> dict:
+    """One of the schedule shapes caregivers use: daily, weekdays only or alternate days, 1-4 times a day."""
+    times = sorted({f"{rng.choice([7, 8, 9, 12, 13, 17, 18, 20, 21, 22]):02d}:{rng.choice([0, 0, 15, 30, 45]):02d}"
+                    for _ in range(rng.choice([1, 1, 2, 2, 3, 4]))})
+    shape = rng.choice(["daily", "daily", "weekdays", "alternate"])
+    days = {"daily": DAY_NAMES, "weekdays": WEEKDAYS, "alternate": DAY_NAMES[::2]}[shape]
+    schedule = {day: {"enabled": day in days, "times": list(times)} for day in DAY_NAMES}
+    if extra_time and extra_day:
+        day = schedule[extra_day]
+        day["enabled"] = True
+        day["times"] = sorted(set(day["times"]) | {extra_time})
+    return schedule
+
+
+def _chunks(rows: Iterator[dict], size: int = INSERT_CHUNK_SIZE) -> Iterator[List[dict]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _role_ids(db: Session) -> Dict[str, int]:
+    roles = {name: role_id for role_id, name in db.execute(select(Role.id, Role.name))}
+    for name in ("mantelzorger", "patient", "zorgverlener"):
+        if name not in roles:
+            roles[name] = db.execute(insert(Role).values(name=name).returning(Role.id)).scalar()
+    return roles
+
+
+def generate(db: Session, spec: DatasetSpec, now: Optional[datetime] = None, prefix: str = "synth") -> DatasetSummary:
+    """Insert the dataset described by `spec` and commit. Usernames are `{prefix}_cg{n}` and `{prefix}_pt{n}`."""
+    started = timer.perf_counter()
+    rng = random.Random(spec.seed)
+    now = now or datetime.now()
+    roles = _role_ids(db)
+    hashed_password = get_password_hash(spec.password)
+
+    caregiver_ids = [row.id for row in db.execute(
+        insert(User).returning(User.id, sort_by_parameter_order=True),
+        [{"username": f"{prefix}_cg{i}", "email": f"{prefix}_cg{i}@example.com", "hashed_password": hashed_password,
+          "role_id": roles["mantelzorger"], "created_at": now} for i in range(spec.caregivers)],
+    )]
+    patient_rows = [
+        {"username": f"{prefix}_pt{c * spec.patients_per_caregiver + p}", "hashed_password": hashed_password,
+         "role_id": roles["patient"], "caregiver_id": caregiver_id, "created_at": now}
+        for c, caregiver_id in enumerate(caregiver_ids)
+        for p in range(spec.patients_per_caregiver)
+    ]
+    patient_ids = [row.id for row in db.execute(
+        insert(User).returning(User.id, sort_by_parameter_order=True), patient_rows,
+    )] if patient_rows else []
+
+    # Doses at this time today are 7 minutes late: inside the missed-dose checker's alert window
+    due_time = (now - timedelta(minutes=7)).strftime("%H:%M")
+    today_name = DAY_NAMES[now.weekday()]
+    start_date = datetime.combine(now.date() - timedelta(days=spec.history_days), time.min)
+    medication_rows = []
+    for patient_id in patient_ids:
+        for _ in range(spec.medications_per_patient):
+            due_now = rng.random() < spec.due_now_fraction
+            medication_rows.append({
+                "patient_id": patient_id,
+                "name": rng.choice(MEDICATION_NAMES),
+                "dosage": rng.choice(DOSAGES),
+                "schedule": random_schedule(rng, due_time if due_now else None, today_name if due_now else None),
+                "start_date": start_date,
+                "notes": rng.choice([None, None, "Met eten innemen", "Niet samen met melk"]),
+                "is_active": rng.random() > 0.05,
+            })
+    medication_ids = [row.id for row in db.execute(
+        insert(Medication).returning(Medication.id, sort_by_parameter_order=True), medication_rows,
+    )] if medication_rows else []
+
+    slot_count = 0
+    slots = (row for medication_id, med in zip(medication_ids, medication_rows)
+             for row in slot_rows(medication_id, med["schedule"]))
+    for chunk in _chunks(slots):
+        db.execute(insert(ScheduleSlot), chunk)
+        slot_count += len(chunk)
+
+    adherence = {patient_id: rng.uniform(0.6, 0.98) for patient_id in patient_ids}
+
+    def intakes() -> Iterator[dict]:
+        for medication_id, med in zip(medication_ids, medication_rows):
+            if not med["is_active"]:
+                continue
+            patient_id = med["patient_id"]
+            for offset in range(spec.history_days, 0, -1):
+                day: date = now.date() - timedelta(days=offset)
+                for scheduled, time_str in day_times(med["schedule"], DAY_NAMES[day.weekday()]):
+                    if rng.random() > adherence[patient_id]:
+                        continue  # missed
+                    yield {
+                        "medication_id": medication_id,
+                        "patient_id": patient_id,
+                        "scheduled_time": time_str,
+                        "taken_at": datetime.combine(day, scheduled) + timedelta(minutes=rng.randint(-10, 40)),
+                        "status": "taken" if rng.random() > 0.03 else "skipped",
+                    }
+
+    intake_count = 0
+    for chunk in _chunks(intakes()):
+        db.execute(insert(MedicationIntake), chunk)
+        intake_count += len(chunk)
+
+    db.commit()
+    return DatasetSummary(
+        caregivers=len(caregiver_ids),
+        patients=len(patient_ids),
+        medications=len(medication_ids),
+        schedule_slots=slot_count,
+        intakes=intake_count,
+        seconds=timer.perf_counter() - started,
+    )
+
+
+def main() -> None:
+    defaults = DatasetSpec()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--caregivers", type=int, default=defaults.caregivers)
+    parser.add_argument("--patients-per-caregiver", type=int, default=defaults.patients_per_caregiver)
+    parser.add_argument("--medications-per-patient", type=int, default=defaults.medications_per_patient)
+    parser.add_argument("--history-days", type=int, default=defaults.history_days)
+    parser.add_argument("--due-now-fraction", type=float, default=defaults.due_now_fraction)
+    parser.add_argument("--password", default=defaults.password)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--prefix", default="synth", help="username prefix; must be new for every run")
+    args = parser.parse_args()
+    prefix = args.prefix
+    spec = DatasetSpec(**{key: value for key, value in vars(args).items() if key != "prefix"})
+
+    init_db()
+    db = next(get_db())
+    try:
+        summary = generate(db, spec, prefix=prefix)
+        today = date.today()
+        backfill(db, today - timedelta(days=spec.history_days), today)
+    finally:
+        db.close()
+    for key, value in asdict(summary).items():
+        print(f"{key:>15}: {value:.2f}" if isinstance(value, float) else f"{key:>15}: {value}")
+
+
+if __name__ == "__main__":
+    main()
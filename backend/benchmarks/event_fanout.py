@@ -0,0 +1,99 @@
+"""
+Fan-out latency and per-connection memory of the SSE event broker.
+
+Opens N idle subscriptions that consume through the same `EventBroker.stream`
+generator the /api/events endpoint uses, spread over a number of patients,
+then publishes events for random patients and measures the time from publish
+to the frame being produced for each subscriber.
+
+Run from the backend directory:
+
+    python -m benchmarks.event_fanout --connections 1000 5000 --patients 200
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time as timer
+import tracemalloc
+from typing import Dict, List
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def measure(connections: int, args):
+    from events import Event, EventBroker
+
+    broker = EventBroker(max_queue=args.queue_size)
+    published_at: Dict[int, float] = {}
+    latencies: List[float] = []
+
+    async def consume(sub):
+        async for frame in broker.stream(sub, keepalive=3600):
+            if frame.startswith("id: "):
+                event_id = int(frame[4:frame.index("\n")])
+                latencies.append(timer.perf_counter() - published_at[event_id])
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    consumers = []
+    for i in range(connections):
+        # Each caregiver follows a handful of patients
+        patients = random.sample(range(args.patients), args.patients_per_caregiver)
+        consumers.append(asyncio.create_task(consume(broker.subscribe(i, patients))))
+    await asyncio.sleep(0)  # let every consumer reach its first await
+    per_connection = (tracemalloc.get_traced_memory()[0] - before) / connections
+    tracemalloc.stop()
+
+    for _ in range(args.events):
+        event = Event("intake_recorded", random.randrange(args.patients), {"status": "taken"})
+        broker.publish(event)
+        published_at[event.id] = event.published_at
+        await asyncio.sleep(args.interval_ms / 1000)
+    await asyncio.sleep(0.05)
+
+    for task in consumers:
+        task.cancel()
+    await asyncio.gather(*consumers, return_exceptions=True)
+    return per_connection, latencies
+
+
+async def run(args):
+    print(f"{'connections':>11} {'deliveries':>10} {'KiB/conn':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9}")
+    for connections in args.connections:
+        per_connection, latencies = await measure(connections, args)
+        if not latencies:
+            print(f"{connections:>11} {0:>10} {per_connection / 1024:>9.2f} {'-':>9} {'-':>9} {'-':>9}")
+            continue
+        print(
+            f"{connections:>11} {len(latencies):>10} {per_connection / 1024:>9.2f} "
+            f"{percentile(latencies, 50) * 1000:>9.2f} {percentile(latencies, 99) * 1000:>9.2f} "
+            f"{max(latencies) * 1000:>9.2f}"
+        )
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connections", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--patients-per-caregiver", type=int, default=5)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--interval-ms", type=float, default=2.0)
+    parser.add_argument("--queue-size", type=int, default=100)
+    args = parser.parse_args()
+
+    # events.py imports database.py, which uses a relative SQLite path
+    sys.path.insert(0, os.getcwd())
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ["EMAIL_ADDRESS"] = ""
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,105 @@
+"""
+Latency of unrelated endpoints while a burst of logins is running.
+
+Logins verify bcrypt hashes; GET /api/me is probed at a fixed rate alongside
+them. "inline" runs bcrypt on the event loop, the way /api/login used to;
+"pool" uses the password worker pool from auth.py.
+
+Run from the backend directory:
+
+    python -m benchmarks.login_load --logins 40 --login-concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time as timer
+from typing import List
+
+import httpx
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def measure(client: httpx.AsyncClient, args, headers: dict):
+    probe_latencies: List[float] = []
+    login_latencies: List[float] = []
+    done = asyncio.Event()
+
+    async def probe():
+        while not done.is_set():
+            started = timer.perf_counter()
+            response = await client.get("/api/me", headers=headers)
+            probe_latencies.append(timer.perf_counter() - started)
+            response.raise_for_status()
+            await asyncio.sleep(args.probe_interval_ms / 1000)
+
+    semaphore = asyncio.Semaphore(args.login_concurrency)
+
+    async def login():
+        async with semaphore:
+            started = timer.perf_counter()
+            response = await client.post("/api/login", data={"username": "patient1", "password": "password123"})
+            login_latencies.append(timer.perf_counter() - started)
+            response.raise_for_status()
+
+    prober = asyncio.create_task(probe())
+    started = timer.perf_counter()
+    await asyncio.gather(*(login() for _ in range(args.logins)))
+    elapsed = timer.perf_counter() - started
+    done.set()
+    await prober
+    return args.logins / elapsed, percentile(login_latencies, 50), percentile(probe_latencies, 50), percentile(probe_latencies, 99)
+
+
+async def run(args):
+    import auth
+    import main
+
+    await main.startup_event()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            login = await client.post("/api/login", data={"username": "patient1", "password": "password123"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+            pooled = auth.run_password_job
+
+            async def inline(fn, *fn_args):
+                return fn(*fn_args)
+
+            print(f"{'variant':>8} {'logins/s':>9} {'login p50 (ms)':>15} {'/api/me p50 (ms)':>17} {'/api/me p99 (ms)':>17}")
+            for name, runner in (("inline", inline), ("pool", pooled)):
+                auth.run_password_job = runner
+                rps, login_p50, p50, p99 = await measure(client, args, headers)
+                print(f"{name:>8} {rps:>9.1f} {login_p50 * 1000:>15.1f} {p50 * 1000:>17.2f} {p99 * 1000:>17.2f}")
+            auth.run_password_job = pooled
+    finally:
+        await main.shutdown_event()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--login-concurrency", type=int, default=8)
+    parser.add_argument("--probe-interval-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    # database.py uses a relative SQLite path, so run against a scratch directory
+    sys.path.insert(0, os.getcwd())
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ["EMAIL_ADDRESS"] = ""
+        # Every login is for patient1 from one client; measure bcrypt, not admission control
+        os.environ["AUTH_IP_RATE_PER_MINUTE"] = "1000000"
+        os.environ["AUTH_USERNAME_RATE_PER_MINUTE"] = "1000000"
+        os.environ["PASSWORD_VERIFY_MAX_IN_FLIGHT"] = str(max(args.login_concurrency, 16))
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    cli()
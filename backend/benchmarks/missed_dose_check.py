@@ -0,0 +1,168 @@
+"""
+Missed-dose check: tick time against the number of active medications.
+
+Compares the original per-dose lookup (one intake, patient and caregiver query
+per due dose, no composite index) with the single set-based query over
+schedule_slots backed by ix_medication_intakes_dose_lookup.
+
+Run from the backend directory:
+
+    python -m benchmarks.missed_dose_check --sizes 1000 5000 20000
+"""
+import argparse
+import os
+import tempfile
+import time as timer
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Medication, MedicationIntake, Role, ScheduleSlot, User
+from dose_timer import DAY_NAMES
+from schedule_slots import slot_rows
+import missed_doses
+
+INDEX_NAME = "ix_medication_intakes_dose_lookup"
+
+
+def seed(db, n_medications: int, history_days: int, now: datetime):
+    """Create caregivers, patients and medications with one dose due right now, half of them taken."""
+    due_at = (now - timedelta(minutes=6)).strftime("%H:%M")
+    other_times = ["08:00", "12:00", "20:00"]
+    schedule = {
+        day: {"enabled": True, "times": other_times + ([due_at] if day == DAY_NAMES[now.weekday()] else [])}
+        for day in DAY_NAMES
+    }
+
+    db.add_all([Role(id=1, name="mantelzorger"), Role(id=2, name="patient")])
+    n_patients = max(1, n_medications // 3)
+    n_caregivers = max(1, n_patients // 5)
+    db.execute(insert(User), [
+        {"id": i + 1, "username": f"caregiver{i}", "email": f"caregiver{i}@example.com",
+         "hashed_password": "x", "role_id": 1}
+        for i in range(n_caregivers)
+    ])
+    db.execute(insert(User), [
+        {"id": n_caregivers + i + 1, "username": f"patient{i}", "hashed_password": "x",
+         "role_id": 2, "caregiver_id": (i % n_caregivers) + 1}
+        for i in range(n_patients)
+    ])
+    db.execute(insert(Medication), [
+        {"id": i + 1, "patient_id": n_caregivers + (i % n_patients) + 1, "name": f"med{i}",
+         "dosage": "10mg", "schedule": schedule, "start_date": now, "is_active": True}
+        for i in range(n_medications)
+    ])
+    db.execute(insert(ScheduleSlot), [row for i in range(n_medications) for row in slot_rows(i + 1, schedule)])
+
+    intakes = []
+    for i in range(n_medications):
+        patient_id = n_caregivers + (i % n_patients) + 1
+        for day in range(1, history_days + 1):
+            for time_str in other_times:
+                hours, minutes = map(int, time_str.split(":"))
+                taken_at = datetime.combine(now.date() - timedelta(days=day), time(hours, minutes))
+                intakes.append({"medication_id": i + 1, "patient_id": patient_id,
+                                "scheduled_time": time_str, "taken_at": taken_at, "status": "taken"})
+        if i % 2 == 0:
+            intakes.append({"medication_id": i + 1, "patient_id": patient_id,
+                            "scheduled_time": due_at, "taken_at": now, "status": "taken"})
+    for start in range(0, len(intakes), 10000):
+        db.execute(insert(MedicationIntake), intakes[start:start + 10000])
+    db.commit()
+
+
+def legacy_tick(db, now: datetime) -> int:
+    """The per-dose loop check_missed_medications used before the anti-join."""
+    today = now.date()
+    today_name = DAY_NAMES[now.weekday()]
+    missed = 0
+    for medication in db.query(Medication).filter(Medication.is_active == True).all():
+        day_schedule = (medication.schedule or {}).get(today_name) or {}
+        if not day_schedule.get("enabled"):
+            continue
+        for time_str in day_schedule.get("times") or []:
+            hours, minutes = map(int, time_str.split(":"))
+            time_diff = now - datetime.combine(today, time(hours, minutes))
+            if not (timedelta(minutes=5) <= time_diff <= timedelta(minutes=10)):
+                continue
+            intake = (
+                db.query(MedicationIntake)
+                .filter(
+                    MedicationIntake.medication_id == medication.id,
+                    MedicationIntake.patient_id == medication.patient_id,
+                    MedicationIntake.scheduled_time == time_str,
+                    MedicationIntake.taken_at >= datetime.combine(today, time(0, 0)),
+                )
+                .first()
+            )
+            if intake:
+                continue
+            patient = db.query(User).filter(User.id == medication.patient_id).first()
+            if patient and patient.caregiver and patient.caregiver.email:
+                missed += 1
+    return missed
+
+
+def set_based_tick(db, now: datetime) -> int:
+    return len(missed_doses.find_missed_doses(
+        db,
+        now - missed_doses.check_missed_medications_max_lateness,
+        now - missed_doses.check_missed_medications_grace_period,
+    ))
+
+
+def timed(fn, db, now, repeat: int):
+    best = None
+    result = None
+    for _ in range(repeat):
+        db.expunge_all()
+        started = timer.perf_counter()
+        result = fn(db, now)
+        elapsed = timer.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(n_medications: int, history_days: int, repeat: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine, autoflush=False)
+        now = datetime.now()
+
+        with Session() as db:
+            seed(db, n_medications, history_days, now)
+
+            db.execute(text(f"DROP INDEX {INDEX_NAME}"))
+            db.commit()
+            before, missed_before = timed(legacy_tick, db, now, repeat)
+
+            db.execute(text(
+                f"CREATE INDEX {INDEX_NAME} ON medication_intakes "
+                "(patient_id, medication_id, scheduled_time, taken_at)"
+            ))
+            db.commit()
+            after, missed_after = timed(set_based_tick, db, now, repeat)
+
+        engine.dispose()
+
+    assert missed_before == missed_after, (missed_before, missed_after)
+    return before, after, missed_after
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--history-days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'active meds':>12} {'missed':>8} {'before (s)':>12} {'after (s)':>12} {'speedup':>9}")
+    for size in args.sizes:
+        before, after, missed = run(size, args.history_days, args.repeat)
+        print(f"{size:>12} {missed:>8} {before:>12.4f} {after:>12.4f} {before / after:>8.1f}x")
+
+
+if __name__ == "__main__":
+    cli()
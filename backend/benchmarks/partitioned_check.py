@@ -0,0 +1,84 @@
+"""
+Partitioned missed-dose check: time to evaluate one tick's due doses against
+the number of partitions checked in parallel.
+
+Every medication has a dose due right now (see benchmarks/missed_dose_check.py),
+so one tick has to evaluate all of them. Each row of the output checks the
+same doses, split into that many patient partitions on a pool with one worker
+per partition; the pool is warmed up first so process start-up isn't counted.
+The checker itself only partitions ticks of at least
+MISSED_DOSE_CHECK_PARTITION_MIN_DOSES due doses, and never on one CPU.
+
+Run from the backend directory:
+
+    python -m benchmarks.partitioned_check --medications 50000 --partitions 1 2 4 8 --pool process
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time as timer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+
+def run(args):
+    import database
+    import missed_doses
+    from benchmarks.missed_dose_check import seed
+
+    database.init_db()
+    now = datetime.now()
+    db = database.SessionLocal()
+    try:
+        seed(db, args.medications, args.history_days, now)
+        due_doses = missed_doses.find_due_doses(db, now)
+    finally:
+        db.close()
+    print(f"{len(due_doses)} due doses, {os.cpu_count()} CPUs, {args.pool} pool")
+    print(f"{'partitions':>10} {'missed':>8} {'tick (s)':>9} {'speedup':>8} {'slowest partition (s)':>22}")
+
+    baseline = None
+    for partitions in args.partitions:
+        if args.pool == "thread":
+            pool = ThreadPoolExecutor(partitions)
+        else:
+            pool = ProcessPoolExecutor(partitions, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            list(pool.map(missed_doses.check_partition, range(partitions), [partitions] * partitions, [[]] * partitions))
+            best = None
+            for _ in range(args.repeat):
+                started = timer.perf_counter()
+                missed, results = missed_doses.find_missed_doses_partitioned(due_doses, partitions, pool)
+                elapsed = timer.perf_counter() - started
+                if best is None or elapsed < best[0]:
+                    best = (elapsed, missed, results)
+        finally:
+            pool.shutdown()
+
+        elapsed, missed, results = best
+        baseline = baseline or elapsed
+        slowest = max(result.seconds for result in results)
+        print(f"{partitions:>10} {len(missed):>8} {elapsed:>9.3f} {baseline / elapsed:>7.2f}x {slowest:>22.3f}")
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--medications", type=int, default=20000)
+    parser.add_argument("--history-days", type=int, default=3)
+    parser.add_argument("--partitions", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--pool", choices=["process", "thread"], default="process")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # database.py uses a relative SQLite path; pool workers open the same scratch database
+    sys.path.insert(0, os.getcwd())
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ["EMAIL_ADDRESS"] = ""
+        run(args)
+
+
+if __name__ == "__main__":
+    cli()
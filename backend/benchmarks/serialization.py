@@ -0,0 +1,135 @@
+"""
+Serialization cost of large list responses.
+
+"models" is how the list endpoints used to respond. Intake history built a
+response model per row, which FastAPI then validated against the
+response_model again and encoded with the stdlib JSON encoder; patient
+medications loaded ORM objects and dumped them through a Pydantic TypeAdapter.
+"rows" is the current path: selected columns straight into fast_json. Both
+bodies are checked to decode to the same data.
+
+Run from the backend directory:
+
+    python -m benchmarks.serialization --rows 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time as timer
+from datetime import datetime, timedelta
+from typing import List
+
+
+async def best_of(repeat: int, fn):
+    best, result = None, None
+    for _ in range(repeat):
+        started = timer.perf_counter()
+        result = await fn()
+        elapsed = timer.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def seed(db, rows: int):
+    from sqlalchemy import insert
+
+    from database import Medication, MedicationIntake, Role, User
+
+    db.add_all([Role(id=1, name="mantelzorger"), Role(id=2, name="patient")])
+    db.add(User(id=1, username="bench_patient", hashed_password="x", role_id=2))
+    schedule = {day: {"enabled": True, "times": ["08:00", "20:00"]} for day in
+                ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")}
+    db.execute(insert(Medication), [
+        {"id": i + 1, "patient_id": 1, "name": f"Medication {i}", "dosage": "10mg", "schedule": schedule,
+         "start_date": datetime(2024, 1, 1), "notes": "Met eten innemen" if i % 2 else None, "is_active": True}
+        for i in range(rows)
+    ])
+    start = datetime(2024, 1, 1, 8, 0, 0, 123456)
+    db.execute(insert(MedicationIntake), [
+        {"medication_id": i % rows + 1, "patient_id": 1, "scheduled_time": "08:00",
+         "taken_at": start + timedelta(minutes=i), "status": "taken", "notes": None if i % 3 else "later"}
+        for i in range(rows)
+    ])
+    db.commit()
+
+
+async def run(args):
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from pydantic import TypeAdapter
+    from sqlalchemy import func, select
+
+    import database
+    import main
+    from database import Medication, MedicationIntake
+    from fast_json import FastJSONResponse, dumps, row_dicts
+
+    medication_list_adapter = TypeAdapter(List[main.MedicationResponse])
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        seed(db, args.rows)
+        response_fields = {route.path: route.response_field for route in main.app.routes if hasattr(route, "response_field")}
+        intake_query = (
+            select(
+                MedicationIntake.id, MedicationIntake.medication_id, MedicationIntake.patient_id,
+                MedicationIntake.scheduled_time, MedicationIntake.taken_at, MedicationIntake.status,
+                MedicationIntake.notes, func.coalesce(Medication.name, "Unknown").label("medication_name"),
+            )
+            .outerjoin(Medication, Medication.id == MedicationIntake.medication_id)
+            .where(MedicationIntake.patient_id == 1)
+            .order_by(MedicationIntake.taken_at.desc(), MedicationIntake.id.desc())
+        )
+
+        async def intakes_models():
+            models = [main.MedicationIntakeResponse(**row._mapping) for row in db.execute(intake_query).all()]
+            content = await serialize_response(
+                field=response_fields["/api/medication_intakes"], response_content=models, is_coroutine=True,
+            )
+            return JSONResponse(content).body
+
+        async def intakes_rows():
+            return FastJSONResponse(row_dicts(db.execute(intake_query).mappings())).body
+
+        async def medications_models():
+            db.expunge_all()
+            medications = db.execute(select(Medication).where(Medication.patient_id == 1)).scalars().all()
+            return medication_list_adapter.dump_json(medications)
+
+        async def medications_rows():
+            query = select(*main.medication_response_columns).where(Medication.patient_id == 1).order_by(Medication.id)
+            return dumps(row_dicts(db.execute(query).mappings()))
+
+        print(f"{args.rows} rows per response")
+        print(f"{'endpoint':>22} {'models (ms)':>12} {'rows (ms)':>10} {'speedup':>8} {'body (KB)':>10}")
+        for name, before_fn, after_fn in (
+            ("intake history", intakes_models, intakes_rows),
+            ("patient medications", medications_models, medications_rows),
+        ):
+            before, before_body = await best_of(args.repeat, before_fn)
+            after, after_body = await best_of(args.repeat, after_fn)
+            assert json.loads(before_body) == json.loads(after_body), f"{name}: bodies differ"
+            print(f"{name:>22} {before * 1000:>12.1f} {after * 1000:>10.1f} {before / after:>7.1f}x {len(after_body) / 1024:>10.0f}")
+    finally:
+        db.close()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # database.py uses a relative SQLite path, so run against a scratch directory
+    sys.path.insert(0, os.getcwd())
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ["EMAIL_ADDRESS"] = ""
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    cli()
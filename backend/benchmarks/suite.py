@@ -0,0 +1,276 @@
+"""
+End-to-end performance suite on a synthetic dataset.
+
+Generates a dataset (benchmarks/dataset.py) in a scratch database, drives the
+ASGI app in-process (login, patient schedule, intake history, medication
+create/update/delete) and times missed-dose checker ticks directly. Prints
+throughput and p50/p95/p99 per scenario and writes them as JSON, so runs on
+different commits can be compared.
+
+Run from the backend directory:
+
+    python -m benchmarks.suite --caregivers 20 --history-days 90
+    python -m benchmarks.suite --compare benchmarks/results/<earlier run>.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time as timer
+from dataclasses import asdict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from sqlalchemy import select
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict[str, float]:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def drive(total: int, concurrency: int, send: Callable[[int], "asyncio.Future"]) -> Dict[str, float]:
+    """Run `send(i)` for i in range(total), `concurrency` at a time; a response status >= 400 counts as an error."""
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            started = timer.perf_counter()
+            response = await send(i)
+            latencies.append(timer.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = timer.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return summarize(latencies, timer.perf_counter() - started, errors)
+
+
+async def run_scenarios(client: httpx.AsyncClient, args, users: Dict[str, list]) -> Dict[str, dict]:
+    from benchmarks.dataset import random_schedule
+
+    caregivers, patients = users["caregivers"], users["patients"]
+    patient_cycle = itertools.cycle(patients)
+    results: Dict[str, dict] = {}
+
+    def bearer(token: str) -> dict:
+        return {"Authorization": f"Bearer {token}"}
+
+    results["login"] = await drive(
+        args.logins, args.concurrency,
+        lambda i: client.post("/api/login", data={"username": patients[i % len(patients)][1], "password": args.password}),
+    )
+    results["patient_schedule"] = await drive(
+        args.requests, args.concurrency,
+        lambda i: client.get("/api/patient_schedule", headers=bearer(next(patient_cycle)[2])),
+    )
+    results["patient_intakes_page"] = await drive(
+        args.requests, args.concurrency,
+        lambda i: client.get("/api/medication_intakes", params={"limit": 50}, headers=bearer(next(patient_cycle)[2])),
+    )
+
+    # Caregivers can only reach their own patients
+    caregiver_by_id = {caregiver[0]: caregiver for caregiver in caregivers}
+    caregiver_patients = [(caregiver_by_id[patient[3]], patient) for patient in patients]
+    results["caregiver_intakes_page"] = await drive(
+        args.requests, args.concurrency,
+        lambda i: client.get(
+            f"/api/patients/{caregiver_patients[i % len(caregiver_patients)][1][0]}/medication_intakes",
+            params={"limit": 100}, headers=bearer(caregiver_patients[i % len(caregiver_patients)][0][2]),
+        ),
+    )
+
+    created: List[tuple] = []
+    rng = random.Random(args.seed)
+
+    async def create(i: int):
+        caregiver, patient = caregiver_patients[i % len(caregiver_patients)]
+        response = await client.post(
+            f"/api/patients/{patient[0]}/medications",
+            json={"name": f"Bench {i}", "dosage": "10mg", "schedule": random_schedule(rng)},
+            headers=bearer(caregiver[2]),
+        )
+        if response.status_code < 400:
+            created.append((response.json()["id"], caregiver[2]))
+        return response
+
+    results["medication_create"] = await drive(args.writes, args.write_concurrency, create)
+    results["medication_update"] = await drive(
+        len(created), args.write_concurrency,
+        lambda i: client.put(
+            f"/api/medications/{created[i][0]}",
+            json={"dosage": "20mg", "schedule": random_schedule(rng)}, headers=bearer(created[i][1]),
+        ),
+    )
+    results["medication_delete"] = await drive(
+        len(created), args.write_concurrency,
+        lambda i: client.delete(f"/api/medications/{created[i][0]}", headers=bearer(created[i][1])),
+    )
+    return results
+
+
+async def time_checker_ticks(ticks: int) -> Dict[str, float]:
+    """Full missed-dose checker ticks. The first one claims (and alerts about) the due-now doses."""
+    import missed_doses
+
+    latencies: List[float] = []
+    started = timer.perf_counter()
+    for _ in range(ticks):
+        tick_started = timer.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            await asyncio.to_thread(missed_doses.check_missed_medications)
+        latencies.append(timer.perf_counter() - tick_started)
+    result = summarize(latencies, timer.perf_counter() - started)
+    result["first_ms"] = latencies[0] * 1000
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(scenarios: Dict[str, dict], baseline: Optional[dict] = None) -> None:
+    header = f"{'scenario':>24} {'req/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'errors':>7}"
+    print(header + (f" {'Δ req/s':>9} {'Δ p95':>8}" if baseline else ""))
+    for name, result in scenarios.items():
+        line = (f"{name:>24} {result['throughput']:>9.1f} {result['p50_ms']:>9.2f} "
+                f"{result['p95_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['errors']:>7}")
+        before = (baseline or {}).get(name)
+        if before and before["throughput"] and before["p95_ms"]:
+            line += (f" {(result['throughput'] / before['throughput'] - 1) * 100:>+8.1f}%"
+                     f" {(result['p95_ms'] / before['p95_ms'] - 1) * 100:>+7.1f}%")
+        print(line)
+
+
+async def run(args) -> dict:
+    import auth
+    import database
+    from benchmarks.dataset import DatasetSpec, generate
+
+    spec = DatasetSpec(
+        caregivers=args.caregivers,
+        patients_per_caregiver=args.patients_per_caregiver,
+        medications_per_patient=args.medications_per_patient,
+        history_days=args.history_days,
+        password=args.password,
+        seed=args.seed,
+    )
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        summary = generate(db, spec)
+        rows = db.execute(
+            select(database.User.id, database.User.username, database.User.caregiver_id)
+            .where(database.User.username.like("synth\\_%", escape="\\"))
+            .order_by(database.User.id)
+        ).all()
+    finally:
+        db.close()
+    print(f"Dataset: {summary.patients} patients, {summary.medications} medications, "
+          f"{summary.intakes} intakes ({summary.seconds:.1f}s)")
+
+    def token(username: str) -> str:
+        return auth.create_access_token({"sub": username})
+
+    users = {
+        "caregivers": [(row.id, row.username, token(row.username), None) for row in rows if "_cg" in row.username],
+        "patients": [(row.id, row.username, token(row.username), row.caregiver_id) for row in rows if "_pt" in row.username],
+    }
+
+    import main
+
+    await main.startup_event()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            scenarios = await run_scenarios(client, args, users)
+        scenarios["missed_dose_check"] = await time_checker_ticks(args.ticks)
+    finally:
+        await main.shutdown_event()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "dataset": {"spec": asdict(spec), "summary": asdict(summary)},
+        "scenarios": scenarios,
+    }
+
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--caregivers", type=int, default=20)
+    parser.add_argument("--patients-per-caregiver", type=int, default=5)
+    parser.add_argument("--medications-per-patient", type=int, default=4)
+    parser.add_argument("--history-days", type=int, default=90)
+    parser.add_argument("--password", default="password123")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--requests", type=int, default=500, help="requests per read scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--writes", type=int, default=200, help="medications created (then updated and deleted)")
+    parser.add_argument("--write-concurrency", type=int, default=4)
+    parser.add_argument("--ticks", type=int, default=5, help="missed-dose checker ticks to time")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<timestamp>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to print deltas against")
+    args = parser.parse_args()
+
+    # Paths are relative to where the suite was started, not the scratch directory
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    results_dir = os.path.abspath(os.path.join("benchmarks", "results"))
+
+    # database.py uses a relative SQLite path, so run against a scratch directory
+    sys.path.insert(0, os.getcwd())
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ["EMAIL_ADDRESS"] = ""
+        # Every login comes from the same client; measure the endpoint, not admission control
+        os.environ["AUTH_IP_RATE_PER_MINUTE"] = "1000000"
+        os.environ["AUTH_USERNAME_RATE_PER_MINUTE"] = "1000000"
+        result = asyncio.run(run(args))
+
+    print_results(result["scenarios"], baseline and baseline["scenarios"])
+    if baseline:
+        print(f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')})")
+
+    if output is None:
+        os.makedirs(results_dir, exist_ok=True)
+        stamp = result["timestamp"].replace(":", "").replace("-", "")
+        output = os.path.join(results_dir, f"{stamp}-{result['commit'] or 'unknown'}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    cli()
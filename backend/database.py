@@ -1,17 +1,39 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Float, Text, Boolean, JSON
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, DateTime, Float, Text, Boolean, JSON, Index, UniqueConstraint
+from sqlalchemy import LargeBinary, inspect, text
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
 from sqlalchemy.dialects.sqlite import JSON
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./app.db"
+import metrics
+import query_budget
+import storage
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+SQLALCHEMY_DATABASE_URL = storage.DATABASE_URL
+ASYNC_SQLALCHEMY_DATABASE_URL = storage.ASYNC_DATABASE_URL or storage.async_url(SQLALCHEMY_DATABASE_URL)
+READ_SQLALCHEMY_DATABASE_URL = storage.DATABASE_READ_URL or SQLALCHEMY_DATABASE_URL
+
+# Sync engine: startup, scheduler jobs and scripts
+engine = storage.build_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine: request handlers, so queries don't block the event loop
+async_engine = storage.build_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# Read-only engines: scheduler scans and reporting queries, kept off the write pool
+read_engine = storage.build_engine(READ_SQLALCHEMY_DATABASE_URL, read_only=True)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+async_read_engine = storage.build_async_engine(storage.async_url(READ_SQLALCHEMY_DATABASE_URL), read_only=True)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+# Query counts and time for /metrics, and query budgets
+for _engine in (engine, async_engine.sync_engine, read_engine, async_read_engine.sync_engine):
+    metrics.instrument_engine(_engine)
+    query_budget.instrument_engine(_engine)
+
 Base = declarative_base()
 
 
@@ -59,6 +81,25 @@ class Medication(Base):
     patient = relationship("User", back_populates="medications")
     intakes = relationship("MedicationIntake", back_populates="medication")
 
+    # Intakes and adherence rows outlive deleted medications; SQLite must not hand their ids out again
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class ScheduleSlot(Base):
+    """One row per weekday and time in a medication's schedule, mirroring Medication.schedule."""
+    __tablename__ = "schedule_slots"
+
+    id = Column(Integer, primary_key=True)
+    medication_id = Column(Integer, ForeignKey("medications.id"), nullable=False, index=True)
+    weekday = Column(Integer, nullable=False)  # 0 = Monday, as date.weekday()
+    minute_of_day = Column(Integer, nullable=False)
+    time_str = Column(String, nullable=False)  # as written in the schedule, e.g. "08:00"
+
+    __table_args__ = (
+        # Due-window lookups: weekday = ? AND minute_of_day BETWEEN ? AND ?
+        Index("ix_schedule_slots_due", "weekday", "minute_of_day"),
+    )
+
 
 class MedicationIntake(Base):
     __tablename__ = "medication_intakes"
@@ -70,10 +111,117 @@ class MedicationIntake(Base):
     taken_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     status = Column(String, default="taken", nullable=False)
     notes = Column(Text, nullable=True)
+    client_key = Column(String, nullable=True)  # idempotency key from offline sync
     
     medication = relationship("Medication", back_populates="intakes")
     patient = relationship("User")
 
+    __table_args__ = (
+        # Covers the missed-dose anti-join: "was this dose taken today?"
+        Index("ix_medication_intakes_dose_lookup", "patient_id", "medication_id", "scheduled_time", "taken_at"),
+        # Keyset pagination of a patient's history on (taken_at, id)
+        Index("ix_medication_intakes_history", "patient_id", "taken_at", "id"),
+        # Replayed sync batches conflict here and are skipped (NULL keys never conflict)
+        Index("uq_medication_intakes_client_key", "patient_id", "client_key", unique=True),
+    )
+
+
+class MedicationIntakeArchive(Base):
+    """Intakes of one patient and calendar month moved out of medication_intakes, as compressed JSON."""
+    __tablename__ = "medication_intake_archives"
+
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    month = Column(Date, nullable=False)  # first day of the month
+    intake_count = Column(Integer, nullable=False)
+    first_taken_at = Column(DateTime, nullable=False)
+    last_taken_at = Column(DateTime, nullable=False)
+    payload = Column(LargeBinary, nullable=False)  # see intake_archive.encode_intakes
+
+    __table_args__ = (
+        # One partition per patient and month; also serves history lookups by patient
+        UniqueConstraint("patient_id", "month", name="uq_medication_intake_archives_month"),
+    )
+
+
+class ArchivedIntakeKey(Base):
+    """Sync idempotency key of an archived intake, so a replayed batch can't record it again."""
+    __tablename__ = "archived_intake_keys"
+
+    patient_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    client_key = Column(String, primary_key=True)
+    intake_id = Column(Integer, nullable=False)  # id in the archive payload
+    taken_at = Column(DateTime, nullable=True)  # NULL for keys archived before it was recorded
+
+    __table_args__ = (
+        # Pruning keys past INTAKE_SYNC_KEY_RETENTION_DAYS is a range delete
+        Index("ix_archived_intake_keys_taken_at", "taken_at"),
+    )
+
+
+class MissedDoseNotification(Base):
+    """One row per missed dose a caregiver has been alerted about."""
+    __tablename__ = "missed_dose_notifications"
+
+    id = Column(Integer, primary_key=True, index=True)
+    scheduled_date = Column(Date, nullable=False)
+    medication_id = Column(Integer, ForeignKey("medications.id"), nullable=False)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    scheduled_time = Column(String, nullable=False)
+    notified_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # scheduled_date leads so expiring old days is an index range delete
+        UniqueConstraint(
+            "scheduled_date", "medication_id", "patient_id", "scheduled_time",
+            name="uq_missed_dose_notifications_dose",
+        ),
+    )
+
+
+class DailyAdherence(Base):
+    """Per patient, medication and day: scheduled, taken and missed dose counts."""
+    __tablename__ = "daily_adherence"
+
+    id = Column(Integer, primary_key=True)
+    patient_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    medication_id = Column(Integer, nullable=False)  # no FK: history outlives deleted medications
+    date = Column(Date, nullable=False)
+    scheduled = Column(Integer, default=0, nullable=False)
+    taken = Column(Integer, default=0, nullable=False)
+    missed = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        # Upsert target; also serves date-range reports per patient
+        UniqueConstraint("patient_id", "date", "medication_id", name="uq_daily_adherence_day"),
+    )
+
+
+class PatientScheduleVersion(Base):
+    """Bumped on every medication write of a patient; backs the schedule ETags."""
+    __tablename__ = "patient_schedule_versions"
+
+    patient_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+
+class MedicationChange(Base):
+    """Change feed of medication writes, polled by the missed-medication scheduler."""
+    __tablename__ = "medication_changes"
+
+    id = Column(Integer, primary_key=True)
+    medication_id = Column(Integer, nullable=False)  # no FK: deleted medications are reported too
+    changed_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class SchedulerLease(Base):
+    """Leader lease: the scheduler process holding an unexpired row runs the checker."""
+    __tablename__ = "scheduler_leases"
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
 
 def get_db():
     db = SessionLocal()
@@ -83,5 +231,54 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_read_db():
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+def add_missing_columns():
+    """Add nullable columns introduced after a table was created (create_all() leaves existing tables alone)."""
+    existing_tables = inspect(engine).get_table_names()
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+def drop_daily_adherence_medication_fk():
+    """
+    One-off migration: daily_adherence.medication_id used to reference medications. Drops that
+    constraint by its PostgreSQL default name; SQLite never enforced it, so it is left alone there.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE daily_adherence DROP CONSTRAINT IF EXISTS daily_adherence_medication_id_fkey"))
+
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns()
+    drop_daily_adherence_medication_fk()
+    # create_all() skips indexes on tables that already exist
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
@@ -0,0 +1,265 @@
+import heapq
+import itertools
+import threading
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+@dataclass(frozen=True)
+class DueDose:
+    """A single scheduled dose whose grace period has run out."""
+    medication_id: int
+    patient_id: int
+    scheduled_time: str  # "HH:MM", as stored on MedicationIntake
+    scheduled_at: datetime
+
+
+# --------------------
+# Schedule helpers
+# --------------------
+def parse_time(time_str: str) -> Optional[time]:
+    """Parse an "HH:MM" schedule entry. Returns None for invalid formats."""
+    try:
+        hours, minutes = map(int, time_str.split(":"))
+        return time(hours, minutes)
+    except (ValueError, AttributeError):
+        return None
+
+
+def day_times(schedule: Optional[dict], day_name: str) -> List[Tuple[time, str]]:
+    """Return the sorted (time, time_str) pairs scheduled on `day_name`."""
+    if not schedule or day_name not in schedule:
+        return []
+
+    day_schedule = schedule[day_name] or {}
+    if not day_schedule.get("enabled"):
+        return []
+
+    result = []
+    for time_str in day_schedule.get("times") or []:
+        parsed = parse_time(time_str)
+        if parsed is not None:
+            result.append((parsed, time_str))
+    result.sort()
+    return result
+
+
+def next_occurrence(schedule: Optional[dict], after: datetime) -> Optional[Tuple[datetime, str]]:
+    """Return the first scheduled (datetime, time_str) strictly after `after`, looking one week ahead."""
+    for offset in range(8):
+        day = after.date() + timedelta(days=offset)
+        for parsed, time_str in day_times(schedule, DAY_NAMES[day.weekday()]):
+            scheduled_at = datetime.combine(day, parsed)
+            if scheduled_at > after:
+                return scheduled_at, time_str
+    return None
+
+
+# --------------------
+# Timer engine
+# --------------------
+class DoseTimerEngine:
+    """
+    Keeps a min-heap with the next dose deadline (scheduled time + grace period)
+    of every active medication and sleeps until the earliest one is due.
+
+    Each medication has at most one live heap entry. Rescheduling gives the
+    medication a new generation so older entries are skipped when popped instead
+    of being searched for and removed.
+
+    When `on_due` raises, its doses are retried with exponential backoff for as
+    long as they are within `max_lateness`.
+    """
+
+    # Re-check the wall clock at least this often (clock changes, suspend/resume)
+    max_sleep_seconds = 60
+    # Backoff between retries of doses whose check failed
+    retry_initial_seconds = 5
+    retry_max_seconds = 60
+
+    def __init__(
+        self,
+        on_due: Callable[[List[DueDose]], None],
+        grace_period: timedelta,
+        max_lateness: timedelta,
+    ):
+        self.on_due = on_due
+        self.grace_period = grace_period
+        self.max_lateness = max_lateness
+
+        # (deadline, seq, medication_id, generation, time_str)
+        self._heap: List[Tuple[datetime, int, int, int, str]] = []
+        self._retries: List[Tuple[datetime, int, DueDose, int]] = []  # (retry_at, seq, dose, attempt)
+        self._entries: Dict[int, Tuple[int, int, dict]] = {}  # medication_id -> (generation, patient_id, schedule)
+        self._seq = itertools.count()
+        self._generations = itertools.count(1)
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    # ---- incremental updates ----
+    def schedule_medication(
+        self,
+        medication_id: int,
+        patient_id: int,
+        schedule: Optional[dict],
+        is_active: bool = True,
+        now: Optional[datetime] = None,
+    ) -> None:
+        """Add or replace the pending deadline of a medication."""
+        if not is_active or not schedule:
+            self.unschedule_medication(medication_id)
+            return
+
+        now = now or datetime.now()
+        with self._cond:
+            self._entries[medication_id] = (next(self._generations), patient_id, schedule)
+            # Doses still inside the alert window are picked up as well, so a
+            # restart or a late reschedule does not skip them.
+            self._push_next(medication_id, now - self.max_lateness)
+            self._cond.notify()
+
+    def unschedule_medication(self, medication_id: int) -> None:
+        """Forget a medication; its pending heap entry becomes stale."""
+        with self._cond:
+            self._entries.pop(medication_id, None)
+
+    def rebuild(self, medications: Iterable[Tuple[int, int, dict]], now: Optional[datetime] = None) -> None:
+        """Replace all state from (medication_id, patient_id, schedule) rows."""
+        now = now or datetime.now()
+        with self._cond:
+            self._heap.clear()
+            self._retries.clear()
+            self._entries.clear()
+            for medication_id, patient_id, schedule in medications:
+                if not schedule:
+                    continue
+                self._entries[medication_id] = (next(self._generations), patient_id, schedule)
+                self._push_next(medication_id, now - self.max_lateness)
+            self._cond.notify()
+
+    def pending_count(self) -> int:
+        with self._cond:
+            return len(self._entries)
+
+    def retry_count(self) -> int:
+        with self._cond:
+            return len(self._retries)
+
+    def next_deadline(self) -> Optional[datetime]:
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    # ---- lifecycle ----
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="dose-timer", daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ---- internals ----
+    def _push_next(self, medication_id: int, after: datetime) -> None:
+        """Push the first deadline after `after`. Caller holds the lock."""
+        generation, _, schedule = self._entries[medication_id]
+        occurrence = next_occurrence(schedule, after)
+        if occurrence is None:
+            return
+        scheduled_at, time_str = occurrence
+        deadline = scheduled_at + self.grace_period
+        heapq.heappush(self._heap, (deadline, next(self._seq), medication_id, generation, time_str))
+
+    def _is_stale(self, medication_id: int, generation: int) -> bool:
+        entry = self._entries.get(medication_id)
+        return entry is None or entry[0] != generation
+
+    def _drop_stale(self) -> None:
+        while self._heap and self._is_stale(self._heap[0][2], self._heap[0][3]):
+            heapq.heappop(self._heap)
+
+    def _pop_due(self, now: datetime) -> List[DueDose]:
+        """Pop every deadline <= now and queue the follow-up occurrence. Caller holds the lock."""
+        due: List[DueDose] = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, medication_id, generation, time_str = heapq.heappop(self._heap)
+            if self._is_stale(medication_id, generation):
+                continue
+
+            patient_id = self._entries[medication_id][1]
+            scheduled_at = deadline - self.grace_period
+            if now - scheduled_at <= self.max_lateness:
+                due.append(DueDose(medication_id, patient_id, time_str, scheduled_at))
+
+            self._push_next(medication_id, scheduled_at)
+        return due
+
+    def _pop_retries(self, now: datetime) -> List[Tuple[DueDose, int]]:
+        """Pop every retry that is due, as (dose, attempt). Caller holds the lock."""
+        due: List[Tuple[DueDose, int]] = []
+        while self._retries and self._retries[0][0] <= now:
+            _, _, dose, attempt = heapq.heappop(self._retries)
+            if dose.medication_id not in self._entries:
+                continue
+            if now - dose.scheduled_at > self.max_lateness:
+                print(f"❌ Gave up on dose of medication {dose.medication_id} at {dose.scheduled_at}: past max lateness")
+                continue
+            due.append((dose, attempt))
+        return due
+
+    def _retry_later(self, doses: List[Tuple[DueDose, int]], now: datetime) -> None:
+        """Queue failed doses again with backoff, or drop those that would be too late by then."""
+        with self._cond:
+            for dose, attempt in doses:
+                backoff = min(self.retry_initial_seconds * 2 ** attempt, self.retry_max_seconds)
+                retry_at = now + timedelta(seconds=backoff)
+                if retry_at - dose.scheduled_at > self.max_lateness:
+                    print(f"❌ Gave up on dose of medication {dose.medication_id} at {dose.scheduled_at} "
+                          f"after {attempt + 1} failed checks")
+                    continue
+                heapq.heappush(self._retries, (retry_at, next(self._seq), dose, attempt + 1))
+
+    def _next_wakeup(self) -> Optional[datetime]:
+        """Earliest deadline or retry. Caller holds the lock."""
+        times = [queue[0][0] for queue in (self._heap, self._retries) if queue]
+        return min(times) if times else None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+
+                self._drop_stale()
+                now = datetime.now()
+                wakeup = self._next_wakeup()
+                if wakeup is None:
+                    self._cond.wait(self.max_sleep_seconds)
+                    continue
+
+                delay = (wakeup - now).total_seconds()
+                if delay > 0:
+                    self._cond.wait(min(delay, self.max_sleep_seconds))
+                    continue
+
+                batch = [(dose, 0) for dose in self._pop_due(now)] + self._pop_retries(now)
+
+            if not batch:
+                continue
+
+            try:
+                self.on_due([dose for dose, _ in batch])
+            except Exception as e:
+                print(f"❌ Missed medication check failed for {len(batch)} doses: {e}")
+                self._retry_later(batch, datetime.now())
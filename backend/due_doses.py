@@ -0,0 +1,146 @@
+"""
+Doses due now, for the patient take-medication screen.
+
+A patient's doses for today are expanded once from their medication schedules
+and cached together with the (medication_id, scheduled_time) pairs already
+recorded today. An entry only answers for the day and schedule version it was
+built for, so medication writes (which bump the version) and midnight retire
+it without any extra bookkeeping; intake writes call `due_cache.invalidate`.
+"""
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from adherence import utc_bounds
+from database import Medication, MedicationIntake
+from dose_timer import DAY_NAMES, day_times
+
+DUE_WINDOW_MINUTES = int(os.getenv("DUE_WINDOW_MINUTES", "5"))
+DUE_CACHE_MAX_PATIENTS = int(os.getenv("DUE_CACHE_MAX_PATIENTS", "10000"))
+
+
+@dataclass(frozen=True)
+class ScheduledDose:
+    medication_id: int
+    name: str
+    dosage: str
+    notes: Optional[str]
+    scheduled_time: str
+    scheduled_at: datetime
+
+
+@dataclass
+class PatientDay:
+    """A patient's expanded doses for one day (sorted by time) and the doses already recorded."""
+    day: date
+    version: int
+    doses: List[ScheduledDose]
+    recorded: Set[Tuple[int, str]] = field(default_factory=set)
+
+    def due(self, now: datetime, window: timedelta) -> List[ScheduledDose]:
+        """Unrecorded doses scheduled within `window` of `now`."""
+        first = bisect_left(self.doses, now - window, key=lambda dose: dose.scheduled_at)
+        last = bisect_right(self.doses, now + window, key=lambda dose: dose.scheduled_at)
+        return [
+            dose for dose in self.doses[first:last]
+            if (dose.medication_id, dose.scheduled_time) not in self.recorded
+        ]
+
+
+async def load_patient_day(db: AsyncSession, patient_id: int, day: date, version: int) -> PatientDay:
+    """Two queries: the patient's active medications and the intakes recorded on the (local) day."""
+    day_name = DAY_NAMES[day.weekday()]
+    medications = (
+        await db.execute(
+            select(Medication.id, Medication.name, Medication.dosage, Medication.notes, Medication.schedule)
+            .where(Medication.patient_id == patient_id, Medication.is_active == True)
+        )
+    ).all()
+    doses = [
+        ScheduledDose(med.id, med.name, med.dosage, med.notes, time_str, datetime.combine(day, scheduled))
+        for med in medications
+        for scheduled, time_str in day_times(med.schedule, day_name)
+    ]
+    doses.sort(key=lambda dose: (dose.scheduled_at, dose.name))
+
+    day_start, day_end = utc_bounds(day)
+    recorded = (
+        await db.execute(
+            select(MedicationIntake.medication_id, MedicationIntake.scheduled_time).where(
+                MedicationIntake.patient_id == patient_id,
+                MedicationIntake.taken_at >= day_start,
+                MedicationIntake.taken_at < day_end,
+            )
+        )
+    ).all()
+    return PatientDay(day, version, doses, {(row.medication_id, row.scheduled_time) for row in recorded})
+
+
+# --------------------
+# Cache
+# --------------------
+class DueDoseCache:
+    """
+    Bounded LRU of PatientDay entries, one per patient.
+
+    `generation(patient_id)` is read before loading an entry and passed to
+    `put`, which drops the entry if an intake was recorded in the meantime.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, PatientDay]" = OrderedDict()
+        self._generations: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, patient_id: int, day: date, version: int) -> Optional[PatientDay]:
+        with self._lock:
+            entry = self._entries.get(patient_id)
+            if entry is None or entry.day != day or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(patient_id)
+            self.hits += 1
+            return entry
+
+    def generation(self, patient_id: int) -> int:
+        with self._lock:
+            return self._generations.get(patient_id, 0)
+
+    def put(self, patient_id: int, entry: PatientDay, generation: int) -> None:
+        with self._lock:
+            if self._generations.get(patient_id, 0) != generation:
+                return
+            self._entries[patient_id] = entry
+            self._entries.move_to_end(patient_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, patient_id: int) -> None:
+        """Call after recording an intake for the patient."""
+        with self._lock:
+            self._generations[patient_id] = self._generations.get(patient_id, 0) + 1
+            if self._entries.pop(patient_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+due_cache = DueDoseCache(DUE_CACHE_MAX_PATIENTS)
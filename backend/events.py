@@ -0,0 +1,310 @@
+"""
+Server-sent events for caregivers.
+
+`EventBroker` fans events out to subscribed connections in this process. Each
+connection has a small bounded queue; a client that falls that far behind is
+sent an `overflow` event and disconnected (EventSource reconnects on its own)
+instead of letting the queue grow.
+
+Events are published directly where they happen (intake recorded in this
+worker, missed dose claimed by an in-process scheduler). `relay_events` polls
+the intake and notification tables so that events raised by other workers or
+by the standalone scheduler process reach this worker's subscribers too;
+events already delivered are recognised by key and not sent twice.
+"""
+import asyncio
+import itertools
+import json
+import os
+import time as timer
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterable, Optional, Set
+
+from sqlalchemy import func, or_, select
+
+from database import AsyncReadSessionLocal, Medication, MedicationIntake, MissedDoseNotification, User
+
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "100"))
+EVENT_KEEPALIVE_SECONDS = float(os.getenv("EVENT_KEEPALIVE_SECONDS", "15"))
+EVENT_RELAY_POLL_SECONDS = float(os.getenv("EVENT_RELAY_POLL_SECONDS", "2"))
+EVENT_RELAY_BATCH_SIZE = 500
+# Ids skipped by the relay are re-read this long, in case their transaction commits late
+EVENT_RELAY_OVERLAP_SECONDS = float(os.getenv("EVENT_RELAY_OVERLAP_SECONDS", "60"))
+RECENT_EVENT_KEYS = 10000
+
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+@dataclass
+class Event:
+    type: str  # intake_recorded | dose_missed
+    patient_id: int
+    data: Dict[str, Any]
+    id: int = 0
+    published_at: float = field(default_factory=timer.perf_counter)
+
+    def encode(self) -> str:
+        """SSE frame."""
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data, default=_json_default)}\n\n"
+
+
+_OVERFLOW = Event("overflow", 0, {"reason": "client too slow, reconnect to resume"})
+
+
+class Subscription:
+    """One connected client: the patients it follows and its bounded event queue."""
+
+    def __init__(self, user_id: int, patient_ids: Iterable[int], max_queue: int):
+        self.user_id = user_id
+        self.patient_ids: Set[int] = set(patient_ids)
+        self.queue: "asyncio.Queue[Event]" = asyncio.Queue(maxsize=max_queue)
+        self.closed = False
+
+
+# --------------------
+# Broker
+# --------------------
+class EventBroker:
+    """In-process pub/sub keyed by patient id. Publish from the event loop or, via publish_threadsafe, any thread."""
+
+    def __init__(self, max_queue: int = EVENT_QUEUE_SIZE):
+        self.max_queue = max_queue
+        self._by_patient: Dict[int, Set[Subscription]] = {}
+        self._subscriptions: Set[Subscription] = set()
+        self._recent: "OrderedDict[tuple, None]" = OrderedDict()  # keys of events already published
+        self._ids = itertools.count(1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._latencies: Deque[float] = deque(maxlen=1000)
+        self._stats = {"events_published": 0, "events_delivered": 0, "duplicates_skipped": 0, "overflows": 0}
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Event loop that owns the subscriber queues (set at startup)."""
+        self._loop = loop
+
+    def subscribe(self, user_id: int, patient_ids: Iterable[int]) -> Subscription:
+        sub = Subscription(user_id, patient_ids, self.max_queue)
+        self._subscriptions.add(sub)
+        for patient_id in sub.patient_ids:
+            self._by_patient.setdefault(patient_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        sub.closed = True
+        self._subscriptions.discard(sub)
+        for patient_id in sub.patient_ids:
+            subs = self._by_patient.get(patient_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._by_patient[patient_id]
+
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def publish(self, event: Event, key: Optional[tuple] = None) -> int:
+        """Deliver to the patient's subscribers; returns the number reached. Must run on the bound loop."""
+        if key is not None:
+            if key in self._recent:
+                self._stats["duplicates_skipped"] += 1
+                return 0
+            self._recent[key] = None
+            while len(self._recent) > RECENT_EVENT_KEYS:
+                self._recent.popitem(last=False)
+
+        event.id = next(self._ids)
+        self._stats["events_published"] += 1
+        delivered = 0
+        for sub in list(self._by_patient.get(event.patient_id, ())):
+            try:
+                sub.queue.put_nowait(event)
+                delivered += 1
+            except asyncio.QueueFull:
+                self._overflow(sub)
+        self._stats["events_delivered"] += delivered
+        return delivered
+
+    def publish_threadsafe(self, event: Event, key: Optional[tuple] = None) -> None:
+        """Publish from a worker thread (e.g. the missed-dose checker)."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return  # no web server in this process, nobody to deliver to
+        loop.call_soon_threadsafe(self.publish, event, key)
+
+    def record_latency(self, event: Event) -> None:
+        self._latencies.append(timer.perf_counter() - event.published_at)
+
+    def stats(self) -> Dict[str, float]:
+        latencies = sorted(self._latencies)
+        stats = dict(self._stats)
+        stats["subscribers"] = len(self._subscriptions)
+        stats["p50_delivery_seconds"] = latencies[len(latencies) // 2] if latencies else 0.0
+        stats["p99_delivery_seconds"] = latencies[int(len(latencies) * 0.99)] if latencies else 0.0
+        return stats
+
+    async def stream(self, sub: Subscription, keepalive: float = EVENT_KEEPALIVE_SECONDS):
+        """SSE body for one subscription; sends a comment line when idle so proxies keep the connection open."""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield event.encode()
+                if event is _OVERFLOW:
+                    return
+                self.record_latency(event)
+        finally:
+            self.unsubscribe(sub)
+
+    def _overflow(self, sub: Subscription) -> None:
+        """Drop a client that can't keep up: clear its backlog and tell it to reconnect."""
+        self._stats["overflows"] += 1
+        self.unsubscribe(sub)
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(_OVERFLOW)
+
+
+broker = EventBroker()
+
+
+# --------------------
+# Event constructors
+# --------------------
+def intake_event(intake_id, patient_id, patient_name, medication_id, medication_name, scheduled_time, status, taken_at):
+    event = Event("intake_recorded", patient_id, {
+        "intake_id": intake_id,
+        "patient_id": patient_id,
+        "patient_name": patient_name,
+        "medication_id": medication_id,
+        "medication_name": medication_name,
+        "scheduled_time": scheduled_time,
+        "status": status,
+        "taken_at": taken_at,
+    })
+    return event, ("intake_recorded", intake_id)
+
+
+def missed_event(scheduled_date, patient_id, patient_name, medication_id, medication_name, scheduled_time):
+    event = Event("dose_missed", patient_id, {
+        "patient_id": patient_id,
+        "patient_name": patient_name,
+        "medication_id": medication_id,
+        "medication_name": medication_name,
+        "scheduled_date": scheduled_date,
+        "scheduled_time": scheduled_time,
+    })
+    return event, ("dose_missed", scheduled_date, medication_id, patient_id, scheduled_time)
+
+
+# --------------------
+# Cross-process relay
+# --------------------
+class FeedCursor:
+    """
+    Position in a table read in id order whose ids can become visible out of
+    order: on PostgreSQL an id is assigned at insert but the row appears at
+    commit. Ids skipped over by the high-water mark are re-read on every poll
+    for EVENT_RELAY_OVERLAP_SECONDS, in case their transaction commits late.
+    """
+
+    # Ids to re-read below a jump of the high-water mark (the most recent ones)
+    max_missing = 1000
+
+    def __init__(self, last_id: int, overlap_seconds: float = EVENT_RELAY_OVERLAP_SECONDS):
+        self.last_id = last_id
+        self.overlap_seconds = overlap_seconds
+        self.missing: Dict[int, float] = {}  # id -> when it was skipped
+
+    def where(self, column):
+        """Rows not seen yet: above the high-water mark, or skipped recently."""
+        if not self.missing:
+            return column > self.last_id
+        return or_(column > self.last_id, column.in_(list(self.missing)))
+
+    def seen(self, row_id: int) -> None:
+        """Record a row read in id order."""
+        if self.missing.pop(row_id, None) is not None or row_id <= self.last_id:
+            return
+        now = timer.monotonic()
+        for skipped in range(max(self.last_id + 1, row_id - self.max_missing), row_id):
+            self.missing[skipped] = now
+        self.last_id = row_id
+
+    def expire(self) -> None:
+        """Forget skipped ids older than the overlap: rolled back, or never committed."""
+        cutoff = timer.monotonic() - self.overlap_seconds
+        for row_id in [row_id for row_id, skipped_at in self.missing.items() if skipped_at < cutoff]:
+            del self.missing[row_id]
+
+
+async def relay_once(
+    intake_cursor: FeedCursor,
+    notification_cursor: FeedCursor,
+    on_intake: Optional[Callable[[int], None]] = None,
+) -> None:
+    """Publish the intakes and notifications that became visible since the last poll."""
+    async with AsyncReadSessionLocal() as db:
+        intakes = (await db.execute(
+            select(
+                MedicationIntake.id, MedicationIntake.patient_id, User.username, MedicationIntake.medication_id,
+                Medication.name, MedicationIntake.scheduled_time, MedicationIntake.status, MedicationIntake.taken_at,
+            )
+            .join(User, User.id == MedicationIntake.patient_id)
+            .outerjoin(Medication, Medication.id == MedicationIntake.medication_id)
+            .where(intake_cursor.where(MedicationIntake.id))
+            .order_by(MedicationIntake.id)
+            .limit(EVENT_RELAY_BATCH_SIZE)
+        )).all()
+        notifications = (await db.execute(
+            select(
+                MissedDoseNotification.id, MissedDoseNotification.scheduled_date, MissedDoseNotification.patient_id,
+                User.username, MissedDoseNotification.medication_id, Medication.name,
+                MissedDoseNotification.scheduled_time,
+            )
+            .join(User, User.id == MissedDoseNotification.patient_id)
+            .outerjoin(Medication, Medication.id == MissedDoseNotification.medication_id)
+            .where(notification_cursor.where(MissedDoseNotification.id))
+            .order_by(MissedDoseNotification.id)
+            .limit(EVENT_RELAY_BATCH_SIZE)
+        )).all()
+
+    for row in intakes:
+        broker.publish(*intake_event(*row))
+        if on_intake:
+            on_intake(row.patient_id)
+        intake_cursor.seen(row[0])
+    for row in notifications:
+        broker.publish(*missed_event(*row[1:]))
+        notification_cursor.seen(row[0])
+    intake_cursor.expire()
+    notification_cursor.expire()
+
+
+async def relay_events(
+    poll_seconds: float = EVENT_RELAY_POLL_SECONDS,
+    on_intake: Optional[Callable[[int], None]] = None,
+) -> None:
+    """
+    Publish intakes and missed-dose notifications written by other processes. Runs until cancelled.
+
+    `on_intake(patient_id)` is called for every new intake, so per-worker caches
+    can drop what other workers made stale.
+    """
+    async with AsyncReadSessionLocal() as db:
+        intake_cursor = FeedCursor((await db.execute(select(func.coalesce(func.max(MedicationIntake.id), 0)))).scalar())
+        notification_cursor = FeedCursor(
+            (await db.execute(select(func.coalesce(func.max(MissedDoseNotification.id), 0)))).scalar()
+        )
+
+    while True:
+        await asyncio.sleep(poll_seconds)
+        try:
+            await relay_once(intake_cursor, notification_cursor, on_intake)
+        except Exception as e:
+            print(f"❌ Event relay poll failed: {e}")
@@ -0,0 +1,41 @@
+"""
+JSON encoding for response bodies.
+
+Uses orjson when it is installed and the stdlib encoder otherwise. Both write
+datetimes as ISO 8601 (naive ones without an offset), the same as Pydantic,
+so a handler can skip its response model and serialize selected rows directly.
+"""
+import json
+from datetime import date, datetime
+from typing import Any, Iterable, List, Mapping
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def row_dicts(rows: Iterable[Mapping]) -> List[dict]:
+    """Plain dicts from SQLAlchemy row mappings (or dicts), ready for `dumps`."""
+    return [dict(row) for row in rows]
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with `dumps`; the app's default response class."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
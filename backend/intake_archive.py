@@ -0,0 +1,316 @@
+"""
+Archival of old medication intakes.
+
+`medication_intakes` only keeps recent history. Intakes older than
+INTAKE_ARCHIVE_AFTER_DAYS are moved into `medication_intake_archives`: one row
+per patient and calendar month holding that month's intakes as zlib-compressed
+JSON. The intake history endpoints read both and merge them, so clients never
+see where the split is.
+
+The scheduler leader archives nightly; to run it by hand:
+
+    python -m intake_archive run [--max-batches N]
+
+Every batch moves at most INTAKE_ARCHIVE_BATCH_SIZE intakes in one transaction
+(archive rows written and hot rows deleted together), so the job can be
+stopped at any point and the next run picks up where it left off. Sync keys of
+archived intakes move to `archived_intake_keys`, where batch sync still finds
+them until the intake is older than INTAKE_SYNC_KEY_RETENTION_DAYS, the
+longest a device is expected to stay offline with a batch it may replay.
+"""
+import argparse
+import json
+import os
+import zlib
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+load_dotenv()
+
+from database import ArchivedIntakeKey, Medication, MedicationIntake, MedicationIntakeArchive, get_db, init_db
+from query_budget import track
+
+INTAKE_ARCHIVE_AFTER_DAYS = int(os.getenv("INTAKE_ARCHIVE_AFTER_DAYS", "180"))  # 0 disables archiving
+INTAKE_ARCHIVE_BATCH_SIZE = int(os.getenv("INTAKE_ARCHIVE_BATCH_SIZE", "2000"))
+INTAKE_ARCHIVE_HOUR = int(os.getenv("INTAKE_ARCHIVE_HOUR", "3"))
+# Longest a device may stay offline; sync keys of intakes taken before that are pruned. 0 keeps them forever
+INTAKE_SYNC_KEY_RETENTION_DAYS = int(os.getenv("INTAKE_SYNC_KEY_RETENTION_DAYS", "730"))
+# The missed-dose checker and the adherence rollup look up today's intakes
+MIN_ARCHIVE_AFTER_DAYS = 2
+
+# Per-intake fields stored in an archive payload (patient_id is on the archive row)
+FIELDS = ("id", "medication_id", "scheduled_time", "taken_at", "status", "notes")
+
+
+def sort_key(intake) -> Tuple[datetime, int]:
+    """History order key; works on archived dicts and on query row mappings."""
+    return intake["taken_at"], intake["id"]
+
+
+def month_of(moment: datetime) -> date:
+    return moment.date().replace(day=1)
+
+
+def archive_cutoff(today: Optional[date] = None, after_days: int = INTAKE_ARCHIVE_AFTER_DAYS) -> datetime:
+    """Intakes taken before this moment (a UTC midnight) belong in the archive."""
+    today = today or datetime.utcnow().date()
+    return datetime.combine(today - timedelta(days=max(after_days, MIN_ARCHIVE_AFTER_DAYS)), time.min)
+
+
+def encode_intakes(intakes: List[dict]) -> bytes:
+    """Compress intakes, oldest first, as a JSON array of FIELDS arrays."""
+    rows = [
+        [intake["id"], intake["medication_id"], intake["scheduled_time"], intake["taken_at"].isoformat(),
+         intake["status"], intake["notes"]]
+        for intake in sorted(intakes, key=sort_key)
+    ]
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode())
+
+
+def decode_intakes(payload: bytes, patient_id: int) -> List[dict]:
+    """Inverse of encode_intakes, oldest first."""
+    intakes = []
+    for intake_id, medication_id, scheduled_time, taken_at, status, notes in json.loads(zlib.decompress(payload)):
+        intakes.append({
+            "id": intake_id,
+            "medication_id": medication_id,
+            "patient_id": patient_id,
+            "scheduled_time": scheduled_time,
+            "taken_at": datetime.fromisoformat(taken_at),
+            "status": status,
+            "notes": notes,
+        })
+    return intakes
+
+
+# --------------------
+# Archive job
+# --------------------
+def archive_batch(db: Session, cutoff: datetime, batch_size: int = INTAKE_ARCHIVE_BATCH_SIZE) -> int:
+    """Move up to batch_size intakes taken before cutoff into the archive; returns how many were moved."""
+    rows = db.execute(
+        select(
+            MedicationIntake.patient_id, MedicationIntake.client_key,
+            *(getattr(MedicationIntake, field) for field in FIELDS),
+        )
+        .where(MedicationIntake.taken_at < cutoff)
+        .order_by(MedicationIntake.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        return 0
+
+    partitions: Dict[Tuple[int, date], List[dict]] = defaultdict(list)
+    for row in rows:
+        partitions[(row.patient_id, month_of(row.taken_at))].append({field: getattr(row, field) for field in FIELDS})
+
+    existing = {
+        (archive.patient_id, archive.month): archive
+        for archive in db.execute(
+            select(MedicationIntakeArchive).where(
+                MedicationIntakeArchive.patient_id.in_({patient_id for patient_id, _ in partitions}),
+                MedicationIntakeArchive.month.in_({month for _, month in partitions}),
+            )
+        ).scalars()
+    }
+    for (patient_id, month), intakes in partitions.items():
+        archive = existing.get((patient_id, month))
+        if archive is None:
+            archive = MedicationIntakeArchive(patient_id=patient_id, month=month)
+            db.add(archive)
+        else:
+            # Keyed by id, so an intake can never end up in a month twice
+            merged = {intake["id"]: intake for intake in decode_intakes(archive.payload, patient_id)}
+            merged.update((intake["id"], intake) for intake in intakes)
+            intakes = list(merged.values())
+        intakes.sort(key=sort_key)
+        archive.payload = encode_intakes(intakes)
+        archive.intake_count = len(intakes)
+        archive.first_taken_at = intakes[0]["taken_at"]
+        archive.last_taken_at = intakes[-1]["taken_at"]
+
+    keys = [
+        {"patient_id": row.patient_id, "client_key": row.client_key, "intake_id": row.id, "taken_at": row.taken_at}
+        for row in rows if row.client_key is not None
+    ]
+    if keys:
+        dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+        db.execute(dialect.insert(ArchivedIntakeKey).on_conflict_do_nothing(), keys)
+    db.execute(delete(MedicationIntake).where(MedicationIntake.id.in_([row.id for row in rows])))
+    db.commit()
+    return len(rows)
+
+
+def run(
+    db: Session,
+    cutoff: Optional[datetime] = None,
+    batch_size: int = INTAKE_ARCHIVE_BATCH_SIZE,
+    max_batches: Optional[int] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> int:
+    """Archive in batches until nothing is left before cutoff, max_batches is reached or should_stop() says so."""
+    cutoff = cutoff or archive_cutoff()
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        if should_stop and should_stop():
+            break
+        count = archive_batch(db, cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+    if moved:
+        print(f"Archived {moved} medication intakes taken before {cutoff.date()}")
+    if not (should_stop and should_stop()):
+        prune_archived_keys(db, cutoff)
+    return moved
+
+
+def prune_archived_keys(db: Session, cutoff: datetime, retention_days: int = INTAKE_SYNC_KEY_RETENTION_DAYS) -> int:
+    """Delete sync keys of intakes taken more than retention_days ago; returns how many were deleted."""
+    if retention_days <= 0:
+        return 0
+    horizon = datetime.utcnow() - timedelta(days=retention_days)
+    # Keys archived before taken_at was recorded: all of those intakes were taken before this cutoff
+    db.execute(update(ArchivedIntakeKey).where(ArchivedIntakeKey.taken_at.is_(None)).values(taken_at=cutoff))
+    pruned = db.execute(delete(ArchivedIntakeKey).where(ArchivedIntakeKey.taken_at < horizon)).rowcount
+    db.commit()
+    if pruned:
+        print(f"Pruned {pruned} sync keys of intakes taken before {horizon.date()}")
+    return pruned
+
+
+@track("archive_old_intakes")
+def archive_old_intakes(should_stop: Optional[Callable[[], bool]] = None) -> None:
+    """Scheduler job."""
+    db = next(get_db())
+    try:
+        run(db, should_stop=should_stop)
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Intake archival failed: {e}")
+    finally:
+        db.close()
+
+
+# --------------------
+# Reading the archive
+# --------------------
+def iter_archived_between(db: Session, start: datetime, end: datetime) -> Iterator[dict]:
+    """Archived intakes of all patients taken in [start, end), one month decompressed at a time."""
+    archives = db.execute(
+        select(MedicationIntakeArchive.id, MedicationIntakeArchive.patient_id)
+        .where(MedicationIntakeArchive.last_taken_at >= start, MedicationIntakeArchive.first_taken_at < end)
+    ).all()
+    for archive_id, patient_id in archives:
+        payload = db.execute(select(MedicationIntakeArchive.payload).where(MedicationIntakeArchive.id == archive_id)).scalar()
+        for intake in decode_intakes(payload, patient_id):
+            if start <= intake["taken_at"] < end:
+                yield intake
+
+
+async def iter_archived_history(
+    db: AsyncSession,
+    patient_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    before: Optional[Tuple[datetime, int]] = None,
+    limit: Optional[int] = None,
+) -> AsyncIterator[dict]:
+    """
+    A patient's archived intakes, newest first, with the same filters as the
+    history endpoints (taken_at in [start, end], sort key below `before`) and
+    `medication_name` filled in. Months outside the range are never read.
+    """
+    query = select(MedicationIntakeArchive.id).where(MedicationIntakeArchive.patient_id == patient_id)
+    if start:
+        query = query.where(MedicationIntakeArchive.last_taken_at >= start)
+    if end:
+        query = query.where(MedicationIntakeArchive.first_taken_at <= end)
+    if before:
+        query = query.where(MedicationIntakeArchive.first_taken_at <= before[0])
+    archive_ids = (await db.execute(query.order_by(MedicationIntakeArchive.month.desc()))).scalars().all()
+
+    names: Dict[int, str] = {}
+    yielded = 0
+    for archive_id in archive_ids:
+        payload = (
+            await db.execute(select(MedicationIntakeArchive.payload).where(MedicationIntakeArchive.id == archive_id))
+        ).scalar()
+        intakes = decode_intakes(payload, patient_id)
+        unknown = {intake["medication_id"] for intake in intakes} - names.keys()
+        if unknown:
+            names.update((await db.execute(select(Medication.id, Medication.name).where(Medication.id.in_(unknown)))).all())
+
+        for intake in reversed(intakes):
+            if (end and intake["taken_at"] > end) or (before and sort_key(intake) >= before):
+                continue
+            if start and intake["taken_at"] < start:
+                return
+            intake["medication_name"] = names.get(intake["medication_id"]) or "Unknown"
+            yield intake
+            yielded += 1
+            if limit is not None and yielded >= limit:
+                return
+
+
+async def archived_intake_ids(db: AsyncSession, patient_id: int, client_keys: Iterable[str]) -> Dict[str, int]:
+    """Archived intake ids of a patient by sync key, for the keys that belong to archived intakes."""
+    client_keys = list(client_keys)
+    if not client_keys:
+        return {}
+    return dict((await db.execute(
+        select(ArchivedIntakeKey.client_key, ArchivedIntakeKey.intake_id).where(
+            ArchivedIntakeKey.patient_id == patient_id,
+            ArchivedIntakeKey.client_key.in_(client_keys),
+        )
+    )).all())
+
+
+async def merge_newest_first(*sources: AsyncIterator) -> AsyncIterator:
+    """Merge history streams that are each sorted newest first."""
+    iterators = [source.__aiter__() for source in sources]
+
+    async def advance(iterator):
+        try:
+            return await iterator.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    heads = [await advance(iterator) for iterator in iterators]
+    while True:
+        live = [i for i, head in enumerate(heads) if head is not None]
+        if not live:
+            return
+        newest = max(live, key=lambda i: sort_key(heads[i]))
+        yield heads[newest]
+        heads[newest] = await advance(iterators[newest])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Medication intake archival")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    run_parser = subcommands.add_parser("run", help="Archive intakes older than INTAKE_ARCHIVE_AFTER_DAYS")
+    run_parser.add_argument("--after-days", type=int, default=INTAKE_ARCHIVE_AFTER_DAYS)
+    run_parser.add_argument("--batch-size", type=int, default=INTAKE_ARCHIVE_BATCH_SIZE)
+    run_parser.add_argument("--max-batches", type=int, default=None)
+    args = parser.parse_args()
+
+    init_db()
+    db = next(get_db())
+    try:
+        moved = run(db, archive_cutoff(after_days=args.after_days), args.batch_size, args.max_batches)
+        print(f"Moved {moved} intakes to the archive")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,74 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from datetime import timedelta, datetime, time
-from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
-from apscheduler.schedulers.background import BackgroundScheduler
-from email.mime.text import MIMEText
-import smtplib
-import os
+from sqlalchemy import and_, delete, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, timedelta, timezone, datetime
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict
 from dotenv import load_dotenv
+import asyncio
+import base64
+import os
 from jose import JWTError
 
 load_dotenv()
 
-from database import init_db, get_db, User, Role, Medication, MedicationIntake
+from database import (
+    init_db,
+    get_db,
+    get_async_db,
+    get_async_read_db,
+    async_engine,
+    async_read_engine,
+    User,
+    Role,
+    Medication,
+    MedicationChange,
+    MedicationIntake,
+    MissedDoseNotification,
+)
+from admission import auth_admission, forwarded_client_ip
+from adherence import adherence_percentage, count_intake, count_intakes, summary_query, utc_bounds, utc_today
+from dose_timer import DAY_NAMES, day_times
+from due_doses import DUE_WINDOW_MINUTES, due_cache, load_patient_day
+from intake_archive import archived_intake_ids, iter_archived_history, merge_newest_first, sort_key as intake_sort_key
+from events import broker, intake_event, relay_events
+from fast_json import FastJSONResponse, dumps as json_dumps, row_dicts
+import metrics
+import query_budget
+from medication_transfer import csv_header, csv_lines, iter_records, ndjson_lines, validate_record
+from missed_doses import alert_queue, check_missed_medications_grace_period, partition_stats
+from schedule_slots import add_slots, backfill_missing as backfill_schedule_slots, delete_slots, replace_slots
+from schedule_versions import bump_version_statement, current_version, etag_matches, schedule_cache, schedule_etag
+from scheduler import MissedDoseScheduler
 from auth import (authenticate_user,
     create_access_token,
     create_2fa_token,      
     verify_2fa_token,     
     generate_totp_secret,
-    get_password_hash,
+    get_password_hash_async,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     get_current_user,
+    get_event_stream_user,
+    load_user,
+    principal_cache,
+    Principal,
     get_totp_provisioning_uri,
     verify_totp_code,
 )
 
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+
+# Run the missed-medication scheduler inside this web process (single-node setups).
+# Otherwise start it separately with `python -m scheduler`.
+RUN_SCHEDULER_IN_PROCESS = os.getenv("RUN_SCHEDULER_IN_PROCESS", "false").lower() in ("1", "true", "yes")
+missed_dose_scheduler = MissedDoseScheduler() if RUN_SCHEDULER_IN_PROCESS else None
+# Optional bearer token Prometheus must send to GET /metrics
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+event_relay_task: Optional[asyncio.Task] = None
 
 # --------------------
 # Pydantic Models
@@ -54,156 +95,30 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(query_budget.QueryBudgetMiddleware)
 
 # --------------------
-# Scheduler + Missed-med notifications
+# App lifecycle
 # --------------------
-scheduler = BackgroundScheduler()
-notified_missed_medications = set()  # Track which missed meds we've already notified about
-
-check_missed_medications_interval = 20  # seconds
-check_missed_medications_grace_period = 5  # minutes
-
-
-def send_alert_email(to_email: str, patient_name: str, medication_name: str) -> bool:
-    """Send an alert email to the caregiver about a missed medication."""
-    subject = f"LET OP: {patient_name} heeft medicatie nog niet ingenomen"
-
-    body = (
-        f"Dag,\n\n"
-        f"Dit is een herinnering voor {patient_name}.\n\n"
-        f"De medicatie '{medication_name}' is nog niet als 'ingenomen' gemeld.\n"
-        f"Controleer of de medicatie alsnog ingenomen kan worden.\n\n"
-        f"Tijdstip melding: {datetime.now().strftime('%H:%M')}"
-    )
-
-    sender = os.getenv("EMAIL_ADDRESS")
-    password = os.getenv("EMAIL_PASSWORD")
-
-    if not sender or not password:
-        print("❌ EMAIL_ADDRESS / EMAIL_PASSWORD missing in environment.")
-        return False
-
-    try:
-        msg = MIMEText(body)
-        msg["Subject"], msg["From"], msg["To"] = subject, sender, to_email
-
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(sender, password)
-            server.send_message(msg)
-
-        print(f"✅ Email successfully sent to {to_email}")
-        return True
-    except Exception as e:
-        print(f"❌ Email failed to {to_email}: {e}")
-        return False
-
-
-def check_missed_medications():
-    """Check for medications that should have been taken but weren't."""
+@app.on_event("startup")
+async def startup_event():
+    """Initialize database + seed roles/users (+ start scheduler in in-process mode)."""
+    global event_relay_task
+    init_db()
     db = next(get_db())
-
     try:
-        now = datetime.now()
-        today = now.date()
-        day_names = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-        today_name = day_names[now.weekday()]
-
-        medications = db.query(Medication).filter(Medication.is_active == True).all()
-
-        for medication in medications:
-            if not medication.schedule:
-                continue
-
-            if today_name not in medication.schedule:
-                continue
-
-            day_schedule = medication.schedule[today_name]
-            if not day_schedule.get("enabled"):
-                continue
-
-            times = day_schedule.get("times") or []
-            for time_str in times:
-                try:
-                    hours, minutes = map(int, time_str.split(":"))
-                    scheduled_dt = datetime.combine(today, time(hours, minutes))
-
-                    time_diff = now - scheduled_dt
-                    if not (timedelta(minutes=check_missed_medications_grace_period) <= time_diff <= timedelta(minutes=10)):
-                        continue
-
-                    intake = (
-                        db.query(MedicationIntake)
-                        .filter(
-                            MedicationIntake.medication_id == medication.id,
-                            MedicationIntake.patient_id == medication.patient_id,
-                            MedicationIntake.scheduled_time == time_str,
-                            MedicationIntake.taken_at >= datetime.combine(today, time(0, 0)),
-                        )
-                        .first()
-                    )
-
-                    notification_key = f"{medication.id}_{medication.patient_id}_{today.isoformat()}_{time_str}"
-
-                    if intake:
-                        continue
-
-                    if notification_key in notified_missed_medications:
-                        continue
-
-                    patient = db.query(User).filter(User.id == medication.patient_id).first()
-                    caregiver = patient.caregiver if patient else None
-
-                    if patient:
-                        print(
-                            f"[MISSED MEDICATION ALERT] Patient: {patient.username}, "
-                            f"Medication: {medication.name} ({medication.dosage}), "
-                            f"Scheduled time: {time_str}, Current time: {now.strftime('%H:%M')}"
-                        )
-
-                    if caregiver and caregiver.email and patient:
-                        print(f"📧 Sending alert email to {caregiver.email}")
-                        send_alert_email(caregiver.email, patient.username, medication.name)
-                    else:
-                        if patient:
-                            print(f"⚠️ No caregiver email found for patient {patient.username}")
-
-                    notified_missed_medications.add(notification_key)
-
-                except ValueError:
-                    # skip invalid time formats
-                    continue
-
-        # Cleanup old notification keys (older than ~24h)
-        yesterday = (now - timedelta(days=1)).date()
-        for key in list(notified_missed_medications):
-            try:
-                parts = key.split("_")
-                # expected: medicationId_patientId_YYYY-MM-DD_HH:MM
-                if len(parts) < 4:
-                    continue
-                key_date = datetime.fromisoformat(parts[2]).date()
-                if key_date < yesterday:
-                    notified_missed_medications.discard(key)
-            except Exception:
-                continue
-
+        created = backfill_schedule_slots(db)
+        if created:
+            print(f"Created {created} schedule slots for existing medications")
     finally:
         db.close()
 
+    broker.bind(asyncio.get_running_loop())
+    event_relay_task = asyncio.create_task(relay_events(on_intake=due_cache.invalidate))
 
-# --------------------
-# App lifecycle
-# --------------------
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database + start scheduler + seed roles/users."""
-    init_db()
-
-    scheduler.add_job(check_missed_medications, "interval", seconds=check_missed_medications_interval)
-    scheduler.start()
-    print("Missed medication checker started")
+    if missed_dose_scheduler:
+        missed_dose_scheduler.start()
 
     db = next(get_db())
     try:
@@ -235,7 +150,7 @@ async def startup_event():
             mantelzorger1 = User(
                 username="mantelzorger1",
                 email="jarne.bouamoud@hotmail.com",
-                hashed_password=get_password_hash("password123"),
+                hashed_password=await get_password_hash_async("password123"),
                 role_id=mantelzorger_role.id,
             )
             db.add(mantelzorger1)
@@ -246,7 +161,7 @@ async def startup_event():
         if not patient1:
             patient1 = User(
                 username="patient1",
-                hashed_password=get_password_hash("password123"),
+                hashed_password=await get_password_hash_async("password123"),
                 role_id=patient_role.id,
                 caregiver_id=mantelzorger1.id,
             )
@@ -257,7 +172,7 @@ async def startup_event():
         if not zorgverlener1:
             zorgverlener1 = User(
                 username="zorgverlener1",
-                hashed_password=get_password_hash("password123"),
+                hashed_password=await get_password_hash_async("password123"),
                 role_id=zorgverlener_role.id,
             )
             db.add(zorgverlener1)
@@ -270,8 +185,12 @@ async def startup_event():
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    scheduler.shutdown()
-    print("Scheduler stopped")
+    if missed_dose_scheduler:
+        missed_dose_scheduler.shutdown()
+    if event_relay_task:
+        event_relay_task.cancel()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
 
 
 # --------------------
@@ -285,10 +204,21 @@ async def root():
 # --------------------
 # Auth endpoints
 # --------------------
+def client_ip(request: Request) -> Optional[str]:
+    peer = request.client.host if request.client else None
+    return forwarded_client_ip(peer, request.headers.get("x-forwarded-for"))
+
+
 @app.post("/api/login")
-async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(
+    request: Request,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AsyncSession = Depends(get_async_db),
+):
     """Login endpoint - returns 2FA token if 2FA is enabled"""
-    user = authenticate_user(db, form_data.username, form_data.password)
+    auth_admission.admit(client_ip(request), form_data.username)
+    async with auth_admission.password_verification():
+        user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -323,50 +253,254 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session =
     }
 
 
+@app.get("/api/diagnostics")
+async def get_diagnostics(current_user: Principal = Depends(get_current_user)):
+    """Internal queue and cache statistics"""
+    if current_user.role_name != "zorgverlener":
+        raise HTTPException(status_code=403, detail="Only healthcare providers can view diagnostics")
+
+    return {
+        "alert_queue": alert_queue.stats(),
+        "principal_cache": principal_cache.stats(),
+        "schedule_cache": schedule_cache.stats(),
+        "due_cache": due_cache.stats(),
+        "auth_admission": auth_admission.stats(),
+        "event_broker": broker.stats(),
+        "missed_dose_partitions": partition_stats(),
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus scrape endpoint"""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/api/me")
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: Principal = Depends(get_current_user)):
     return {
         "id": current_user.id,
         "username": current_user.username,
-        "role": current_user.role.name,
+        "role": current_user.role_name,
         "is_2fa_enabled": current_user.is_2fa_enabled
     }
 
 
+# --------------------
+# Versioned schedule reads
+# --------------------
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+
+def versioned_json(body: bytes, etag: str) -> Response:
+    """Serialized body with its ETag; clients must revalidate before reusing it."""
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": "private, no-cache"},
+    )
+
+
 # --------------------
 # Patient schedule
 # --------------------
 @app.get("/api/patient_schedule")
-async def get_patient_schedule(current_user: User = Depends(get_current_user)):
-    if current_user.role.name != "patient":
+async def get_patient_schedule(
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    if current_user.role_name != "patient":
         raise HTTPException(status_code=403, detail="Only patients can access their medication schedule")
 
-    medications = current_user.medications
-    schedule = []
-    for med in medications:
-        if med.is_active:
-            schedule.append(
-                {
-                    "name": med.name,
-                    "dosage": med.dosage,
-                    "schedule": med.schedule,
-                    "notes": med.notes,
-                }
+    version = await current_version(db, current_user.id)
+    etag = schedule_etag(current_user.id, version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    body = schedule_cache.get("patient_schedule", current_user.id, version)
+    if body is None:
+        schedule = (
+            await db.execute(
+                select(Medication.name, Medication.dosage, Medication.schedule, Medication.notes)
+                .where(Medication.patient_id == current_user.id, Medication.is_active == True)
+                .order_by(Medication.id)
             )
+        ).mappings()
+        body = json_dumps({"medication_schedule": row_dicts(schedule)})
+        schedule_cache.put("patient_schedule", current_user.id, version, body)
+
+    return versioned_json(body, etag)
+
+
+class DueDoseResponse(BaseModel):
+    medication_id: int
+    name: str
+    dosage: str
+    notes: Optional[str] = None
+    scheduled_time: str
+    scheduled_at: datetime
+
+    class Config:
+        from_attributes = True
 
-    return {"medication_schedule": schedule}
+
+class PatientDueDoses(BaseModel):
+    date: date
+    window_minutes: int
+    doses: List[DueDoseResponse]
+
+
+@app.get("/api/patient/due", response_model=PatientDueDoses)
+async def get_patient_due_doses(
+    window_minutes: int = Query(DUE_WINDOW_MINUTES, ge=0, le=720),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Today's doses scheduled within `window_minutes` of now that have no intake recorded yet."""
+    if current_user.role_name != "patient":
+        raise HTTPException(status_code=403, detail="Only patients can view their due medication")
+
+    now = datetime.now()
+    version = await current_version(db, current_user.id)
+    patient_day = due_cache.get(current_user.id, now.date(), version)
+    if patient_day is None:
+        generation = due_cache.generation(current_user.id)
+        patient_day = await load_patient_day(db, current_user.id, now.date(), version)
+        due_cache.put(current_user.id, patient_day, generation)
+
+    return PatientDueDoses(
+        date=now.date(),
+        window_minutes=window_minutes,
+        doses=patient_day.due(now, timedelta(minutes=window_minutes)),
+    )
 
 
 # --------------------
 # Caregiver: patients
 # --------------------
 @app.get("/api/patients")
-async def get_patients(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    if current_user.role.name != "mantelzorger":
+async def get_patients(db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
+    if current_user.role_name != "mantelzorger":
         raise HTTPException(status_code=403, detail="Only caregivers can view patients")
 
-    patients = db.query(User).filter(User.role.has(Role.name == "patient")).all()
-    return [{"id": p.id, "username": p.username} for p in patients]
+    patients = (
+        await db.execute(select(User.id, User.username).where(User.role.has(Role.name == "patient")).order_by(User.id))
+    ).mappings()
+    return FastJSONResponse(row_dicts(patients))
+
+
+class DoseStatus(BaseModel):
+    scheduled_time: str
+    status: str  # taken | pending | missed
+    taken_at: Optional[datetime] = None
+
+
+class OverviewMedication(BaseModel):
+    id: int
+    name: str
+    dosage: str
+    schedule: dict
+    notes: Optional[str] = None
+    is_active: bool = True
+    doses_today: List[DoseStatus]
+
+
+class OverviewPatient(BaseModel):
+    id: int
+    username: str
+    taken: int
+    pending: int
+    missed: int
+    medications: List[OverviewMedication]
+
+
+class CaregiverOverview(BaseModel):
+    date: date
+    patients: List[OverviewPatient]
+
+
+@app.get("/api/caregiver/overview", response_model=CaregiverOverview)
+async def get_caregiver_overview(
+    include_inactive: bool = Query(False),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    The caller's patients with their active medications and today's dose status.
+    With include_inactive, inactive medications are listed too, without doses.
+
+    Runs three queries (patients, medications, today's intakes) however many
+    patients the caregiver has.
+    """
+    if current_user.role_name != "mantelzorger":
+        raise HTTPException(status_code=403, detail="Only caregivers can view the patient overview")
+
+    now = datetime.now()
+    day_start, day_end = utc_bounds(now.date())
+    today_name = DAY_NAMES[now.weekday()]
+
+    patients = (
+        await db.execute(
+            select(User.id, User.username)
+            .where(User.caregiver_id == current_user.id)
+            .order_by(User.username)
+        )
+    ).all()
+    patient_ids = select(User.id).where(User.caregiver_id == current_user.id).scalar_subquery()
+
+    medication_query = select(Medication).where(Medication.patient_id.in_(patient_ids)).order_by(Medication.name)
+    if not include_inactive:
+        medication_query = medication_query.where(Medication.is_active == True)
+    medications = (await db.execute(medication_query)).scalars().all()
+
+    # Latest intake per (medication, scheduled_time) today
+    intakes = {}
+    for row in await db.execute(
+        select(MedicationIntake.medication_id, MedicationIntake.scheduled_time, MedicationIntake.status, MedicationIntake.taken_at)
+        .where(
+            MedicationIntake.patient_id.in_(patient_ids),
+            MedicationIntake.taken_at >= day_start,
+            MedicationIntake.taken_at < day_end,
+        )
+        .order_by(MedicationIntake.taken_at)
+    ):
+        intakes[(row.medication_id, row.scheduled_time)] = row
+
+    by_patient: Dict[int, OverviewPatient] = {
+        p.id: OverviewPatient(id=p.id, username=p.username, taken=0, pending=0, missed=0, medications=[])
+        for p in patients
+    }
+    for med in medications:
+        doses = []
+        # Inactive medications (include_inactive) are listed without doses
+        dose_times = day_times(med.schedule, today_name) if med.is_active else []
+        for scheduled, time_str in dose_times:
+            intake = intakes.get((med.id, time_str))
+            if intake is not None:
+                dose_status = "taken" if intake.status == "taken" else "missed"
+            elif now - datetime.combine(now.date(), scheduled) >= check_missed_medications_grace_period:
+                dose_status = "missed"
+            else:
+                dose_status = "pending"
+            doses.append(DoseStatus(
+                scheduled_time=time_str,
+                status=dose_status,
+                taken_at=intake.taken_at if intake is not None else None,
+            ))
+
+        patient = by_patient[med.patient_id]
+        for dose in doses:
+            setattr(patient, dose.status, getattr(patient, dose.status) + 1)
+        patient.medications.append(OverviewMedication(
+            id=med.id, name=med.name, dosage=med.dosage, schedule=med.schedule, notes=med.notes,
+            is_active=med.is_active, doses_today=doses,
+        ))
+
+    return CaregiverOverview(date=now.date(), patients=list(by_patient.values()))
 
 
 # --------------------
@@ -401,6 +535,172 @@ class MedicationResponse(BaseModel):
         from_attributes = True
 
 
+# MedicationResponse as selected columns, for list endpoints that skip building ORM objects
+medication_response_columns = [getattr(Medication, name) for name in MedicationResponse.model_fields]
+
+
+# --------------------
+# Bulk medication import/export
+# --------------------
+medication_import_chunk_size = 1000
+medication_import_max_errors = 1000  # per-row errors listed in the response
+medication_export_batch_size = 1000
+
+
+class MedicationImportError(BaseModel):
+    line: int
+    error: str
+
+
+class MedicationImportResult(BaseModel):
+    imported: int
+    failed: int
+    errors: List[MedicationImportError]
+    errors_truncated: bool = False
+
+
+async def import_medication_chunk(db: AsyncSession, chunk: list) -> List[MedicationImportError]:
+    """Insert validated (line, row) pairs in one transaction; returns the rows that failed."""
+    ids = {row.patient_id for _, row in chunk if row.patient_id is not None}
+    usernames = {row.patient_username for _, row in chunk if row.patient_id is None}
+    patients = (
+        await db.execute(select(User.id, User.username).where(or_(User.id.in_(ids), User.username.in_(usernames))))
+    ).all()
+    known_ids = {patient.id for patient in patients}
+    id_by_username = {patient.username: patient.id for patient in patients}
+
+    errors, values = [], []
+    now = datetime.utcnow()
+    for line, row in chunk:
+        patient_id = row.patient_id if row.patient_id is not None else id_by_username.get(row.patient_username)
+        if patient_id not in known_ids:
+            errors.append(MedicationImportError(line=line, error="Patient not found"))
+            continue
+        values.append({
+            "patient_id": patient_id,
+            "name": row.name,
+            "dosage": row.dosage,
+            "schedule": row.schedule,
+            "notes": row.notes,
+            "is_active": row.is_active,
+            "start_date": row.start_date or now,
+            "end_date": row.end_date,
+        })
+    if not values:
+        return errors
+
+    try:
+        inserted = (await db.execute(
+            Medication.__table__.insert().returning(Medication.id, Medication.patient_id, sort_by_parameter_order=True),
+            values,
+        )).all()
+        await add_slots(db, [(row.id, value["schedule"]) for row, value in zip(inserted, values)])
+        await db.execute(MedicationChange.__table__.insert(), [{"medication_id": row.id, "changed_at": now} for row in inserted])
+        dialect_name = db.get_bind().dialect.name
+        for patient_id in {row.patient_id for row in inserted}:
+            await db.execute(bump_version_statement(dialect_name, patient_id))
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        rejected = {error.line for error in errors}
+        errors.extend(
+            MedicationImportError(line=line, error=f"Batch rejected by database: {e}")
+            for line, _ in chunk if line not in rejected
+        )
+    return errors
+
+
+@app.post("/api/medications/import", response_model=MedicationImportResult)
+async def import_medications(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """
+    Create medications for any number of patients from an NDJSON or CSV body.
+
+    The body is parsed and validated as it streams in and inserted in chunks,
+    one transaction per chunk. Invalid rows are reported by line number and
+    skipped; they don't abort the rest of the file.
+    """
+    if current_user.role_name != "mantelzorger":
+        raise HTTPException(status_code=403, detail="Only caregivers can import medications")
+
+    imported = 0
+    errors: List[MedicationImportError] = []
+    chunk = []
+    async for line, record, parse_error in iter_records(request.stream(), format):
+        row, error = (None, parse_error) if parse_error else validate_record(record)
+        if error:
+            errors.append(MedicationImportError(line=line, error=error))
+            continue
+        chunk.append((line, row))
+        if len(chunk) >= medication_import_chunk_size:
+            chunk_errors = await import_medication_chunk(db, chunk)
+            imported += len(chunk) - len(chunk_errors)
+            errors.extend(chunk_errors)
+            chunk = []
+    if chunk:
+        chunk_errors = await import_medication_chunk(db, chunk)
+        imported += len(chunk) - len(chunk_errors)
+        errors.extend(chunk_errors)
+
+    errors.sort(key=lambda error: error.line)
+    return MedicationImportResult(
+        imported=imported,
+        failed=len(errors),
+        errors=errors[:medication_import_max_errors],
+        errors_truncated=len(errors) > medication_import_max_errors,
+    )
+
+
+@app.get("/api/medications/export")
+async def export_medications(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    patient_id: Optional[List[int]] = Query(None),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Stream medications of the given patients (default: the caller's patients) as NDJSON or CSV."""
+    if current_user.role_name != "mantelzorger":
+        raise HTTPException(status_code=403, detail="Only caregivers can export medications")
+
+    query = (
+        select(
+            Medication.id,
+            Medication.patient_id,
+            User.username.label("patient_username"),
+            Medication.name,
+            Medication.dosage,
+            Medication.schedule,
+            Medication.notes,
+            Medication.is_active,
+            Medication.start_date,
+            Medication.end_date,
+        )
+        .join(User, User.id == Medication.patient_id)
+        .order_by(Medication.id)
+    )
+    if patient_id:
+        query = query.where(Medication.patient_id.in_(patient_id))
+    else:
+        query = query.where(User.caregiver_id == current_user.id)
+
+    async def stream_rows():
+        if format == "csv":
+            yield csv_header()
+        result = await db.stream(query.execution_options(yield_per=medication_export_batch_size))
+        async for rows in result.partitions():
+            yield csv_lines(rows) if format == "csv" else ndjson_lines(rows)
+
+    return StreamingResponse(
+        stream_rows(),
+        media_type="text/csv" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="medications.{format}"'},
+    )
+
+
 # --------------------
 # Medication endpoints
 # --------------------
@@ -408,13 +708,13 @@ class MedicationResponse(BaseModel):
 async def create_medication(
     patient_id: int,
     medication: MedicationCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    if current_user.role.name != "mantelzorger":
+    if current_user.role_name != "mantelzorger":
         raise HTTPException(status_code=403, detail="Only caregivers can add medications")
 
-    patient = db.query(User).filter(User.id == patient_id).first()
+    patient = await db.get(User, patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
@@ -426,32 +726,48 @@ async def create_medication(
         notes=medication.notes,
     )
     db.add(db_medication)
-    db.commit()
-    db.refresh(db_medication)
+    await db.flush()
+    await add_slots(db, [(db_medication.id, medication.schedule)])
+    db.add(MedicationChange(medication_id=db_medication.id))
+    await db.execute(bump_version_statement(db.get_bind().dialect.name, patient_id))
+    await db.commit()
+    await db.refresh(db_medication)
     return db_medication
 
 
 @app.get("/api/patients/{patient_id}/medications", response_model=List[MedicationResponse])
 async def get_patient_medications(
     patient_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    patient = db.query(User).filter(User.id == patient_id).first()
-    if not patient:
+    version = await current_version(db, patient_id)
+    if version is None:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    medications = db.query(Medication).filter(Medication.patient_id == patient_id).all()
-    return medications
+    etag = schedule_etag(patient_id, version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    body = schedule_cache.get("patient_medications", patient_id, version)
+    if body is None:
+        medications = (
+            await db.execute(select(*medication_response_columns).where(Medication.patient_id == patient_id).order_by(Medication.id))
+        ).mappings()
+        body = json_dumps(row_dicts(medications))
+        schedule_cache.put("patient_medications", patient_id, version, body)
+
+    return versioned_json(body, etag)
 
 
 @app.get("/api/medications/{medication_id}", response_model=MedicationResponse)
 async def get_medication(
     medication_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    medication = db.query(Medication).filter(Medication.id == medication_id).first()
+    medication = await db.get(Medication, medication_id)
     if not medication:
         raise HTTPException(status_code=404, detail="Medication not found")
     return medication
@@ -461,13 +777,13 @@ async def get_medication(
 async def update_medication(
     medication_id: int,
     medication_update: MedicationUpdate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    if current_user.role.name != "mantelzorger":
+    if current_user.role_name != "mantelzorger":
         raise HTTPException(status_code=403, detail="Only caregivers can update medications")
 
-    medication = db.query(Medication).filter(Medication.id == medication_id).first()
+    medication = await db.get(Medication, medication_id)
     if not medication:
         raise HTTPException(status_code=404, detail="Medication not found")
 
@@ -477,37 +793,49 @@ async def update_medication(
         medication.dosage = medication_update.dosage
     if medication_update.schedule is not None:
         medication.schedule = medication_update.schedule
+        await replace_slots(db, medication.id, medication_update.schedule)
     if medication_update.notes is not None:
         medication.notes = medication_update.notes
     if medication_update.is_active is not None:
         medication.is_active = medication_update.is_active
 
-    db.commit()
-    db.refresh(medication)
+    db.add(MedicationChange(medication_id=medication.id))
+    await db.execute(bump_version_statement(db.get_bind().dialect.name, medication.patient_id))
+    await db.commit()
+    await db.refresh(medication)
     return medication
 
 
 @app.delete("/api/medications/{medication_id}")
 async def delete_medication(
     medication_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    if current_user.role.name != "mantelzorger":
+    if current_user.role_name != "mantelzorger":
         raise HTTPException(status_code=403, detail="Only caregivers can delete medications")
 
-    medication = db.query(Medication).filter(Medication.id == medication_id).first()
+    medication = await db.get(Medication, medication_id)
     if not medication:
         raise HTTPException(status_code=404, detail="Medication not found")
 
-    db.delete(medication)
-    db.commit()
+    await delete_slots(db, medication_id)
+    # Sent alerts reference the medication; its adherence history keeps the missed counts
+    await db.execute(delete(MissedDoseNotification).where(MissedDoseNotification.medication_id == medication_id))
+    await db.delete(medication)
+    db.add(MedicationChange(medication_id=medication_id))
+    await db.execute(bump_version_statement(db.get_bind().dialect.name, medication.patient_id))
+    await db.commit()
     return {"message": "Medication deleted successfully"}
 
 
 # --------------------
 # Medication intake endpoints
 # --------------------
+intake_history_max_page_size = 1000
+intake_history_stream_batch_size = 500
+
+
 class MedicationIntakeCreate(BaseModel):
     medication_name: str
     scheduled_time: str
@@ -532,21 +860,21 @@ class MedicationIntakeResponse(BaseModel):
 @app.post("/api/medication_intakes", response_model=MedicationIntakeResponse)
 async def record_medication_intake(
     intake: MedicationIntakeCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    if current_user.role.name != "patient":
+    if current_user.role_name != "patient":
         raise HTTPException(status_code=403, detail="Only patients can record medication intake")
 
     medication = (
-        db.query(Medication)
-        .filter(
-            Medication.patient_id == current_user.id,
-            Medication.name == intake.medication_name,
-            Medication.is_active == True,
+        await db.execute(
+            select(Medication).where(
+                Medication.patient_id == current_user.id,
+                Medication.name == intake.medication_name,
+                Medication.is_active == True,
+            )
         )
-        .first()
-    )
+    ).scalars().first()
     if not medication:
         raise HTTPException(status_code=404, detail="Medication not found")
 
@@ -558,8 +886,18 @@ async def record_medication_intake(
         notes=intake.notes,
     )
     db.add(db_intake)
-    db.commit()
-    db.refresh(db_intake)
+    await db.flush()
+    await count_intake(
+        db, db_intake.id, current_user.id, medication.id, intake.scheduled_time, intake.status, db_intake.taken_at,
+    )
+    await db.commit()
+    await db.refresh(db_intake)
+    due_cache.invalidate(current_user.id)
+
+    broker.publish(*intake_event(
+        db_intake.id, current_user.id, current_user.username, medication.id, medication.name,
+        db_intake.scheduled_time, db_intake.status, db_intake.taken_at,
+    ))
 
     return MedicationIntakeResponse(
         id=db_intake.id,
@@ -573,45 +911,254 @@ async def record_medication_intake(
     )
 
 
-@app.get("/api/medication_intakes", response_model=List[MedicationIntakeResponse])
-async def get_medication_intakes(
-    start_date: Optional[str] = None,
-    end_date: Optional[str] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+intake_sync_max_batch_size = 500
+intake_sync_max_clock_skew = timedelta(minutes=5)  # reject device times further in the future
+
+
+class MedicationIntakeSyncItem(BaseModel):
+    client_key: str = Field(min_length=1, max_length=64)
+    medication_name: str
+    scheduled_time: str
+    taken_at: datetime  # device time; naive values are taken as UTC
+    status: Optional[str] = "taken"
+    notes: Optional[str] = None
+
+
+class MedicationIntakeSyncRequest(BaseModel):
+    intakes: List[MedicationIntakeSyncItem] = Field(max_length=intake_sync_max_batch_size)
+
+
+class MedicationIntakeSyncResult(BaseModel):
+    client_key: str
+    result: str  # created | duplicate | error
+    intake_id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+@app.post("/api/medication_intakes/batch", response_model=List[MedicationIntakeSyncResult])
+async def sync_medication_intakes(
+    batch: MedicationIntakeSyncRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    if current_user.role.name != "patient":
-        raise HTTPException(status_code=403, detail="Only patients can view their intake history")
+    """
+    Record intakes queued on the device, in one transaction.
+
+    Each intake carries a client-generated key; keys already stored for this
+    patient are reported as `duplicate` with the existing intake id, so a
+    retried or replayed batch never records an intake twice.
+    """
+    if current_user.role_name != "patient":
+        raise HTTPException(status_code=403, detail="Only patients can record medication intake")
+
+    names = {item.medication_name for item in batch.intakes}
+    medications = {
+        row.name: row
+        for row in await db.execute(
+            select(Medication.id, Medication.name).where(
+                Medication.patient_id == current_user.id,
+                Medication.name.in_(names),
+                Medication.is_active == True,
+            )
+        )
+    }
 
-    query = db.query(MedicationIntake).filter(MedicationIntake.patient_id == current_user.id)
+    latest_allowed = datetime.utcnow() + intake_sync_max_clock_skew
+    errors: Dict[str, str] = {}
+    rows: Dict[str, dict] = {}
+    for item in batch.intakes:
+        if item.client_key in rows or item.client_key in errors:
+            continue
+        taken_at = item.taken_at
+        if taken_at.tzinfo is not None:
+            taken_at = taken_at.astimezone(timezone.utc).replace(tzinfo=None)
+        medication = medications.get(item.medication_name)
+        if medication is None:
+            errors[item.client_key] = "Medication not found"
+        elif taken_at > latest_allowed:
+            errors[item.client_key] = "taken_at is in the future"
+        else:
+            rows[item.client_key] = {
+                "medication_id": medication.id,
+                "patient_id": current_user.id,
+                "scheduled_time": item.scheduled_time,
+                "taken_at": taken_at,
+                "status": item.status,
+                "notes": item.notes,
+                "client_key": item.client_key,
+            }
+
+    created: Dict[str, int] = {}
+    # Keys of intakes that were archived since they were first synced
+    existing: Dict[str, int] = await archived_intake_ids(db, current_user.id, rows.keys())
+    for key in existing:
+        del rows[key]
+    if rows:
+        dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+        stmt = (
+            dialect.insert(MedicationIntake)
+            .on_conflict_do_nothing(index_elements=["patient_id", "client_key"])
+            .returning(MedicationIntake.id, MedicationIntake.client_key)
+        )
+        created = {row.client_key: row.id for row in await db.execute(stmt, list(rows.values()))}
+
+        replayed = [key for key in rows if key not in created]
+        if replayed:
+            existing.update({
+                row.client_key: row.id
+                for row in await db.execute(
+                    select(MedicationIntake.id, MedicationIntake.client_key).where(
+                        MedicationIntake.patient_id == current_user.id,
+                        MedicationIntake.client_key.in_(replayed),
+                    )
+                )
+            })
+
+        await count_intakes(db, current_user.id, [
+            (intake_id, rows[key]["medication_id"], rows[key]["scheduled_time"], rows[key]["status"], rows[key]["taken_at"])
+            for key, intake_id in created.items()
+        ])
+    await db.commit()
+    if created:
+        due_cache.invalidate(current_user.id)
+
+    medication_names = {row.id: row.name for row in medications.values()}
+    for key, intake_id in created.items():
+        row = rows[key]
+        broker.publish(*intake_event(
+            intake_id, current_user.id, current_user.username, row["medication_id"],
+            medication_names[row["medication_id"]], row["scheduled_time"], row["status"], row["taken_at"],
+        ))
+
+    results = []
+    reported = set()
+    for item in batch.intakes:
+        key = item.client_key
+        if key in errors:
+            results.append(MedicationIntakeSyncResult(client_key=key, result="error", detail=errors[key]))
+        elif key in created and key not in reported:
+            results.append(MedicationIntakeSyncResult(client_key=key, result="created", intake_id=created[key]))
+        else:
+            results.append(MedicationIntakeSyncResult(
+                client_key=key, result="duplicate", intake_id=created.get(key) or existing.get(key),
+            ))
+        reported.add(key)
+    return results
+
+
+def encode_intake_cursor(taken_at: datetime, intake_id: int) -> str:
+    """Opaque keyset cursor for (taken_at, id)."""
+    return base64.urlsafe_b64encode(f"{taken_at.isoformat()}|{intake_id}".encode()).decode()
+
+
+def decode_intake_cursor(cursor: str):
+    try:
+        taken_at, intake_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(taken_at), int(intake_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def intake_history_response(
+    db: AsyncSession,
+    patient_id: int,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    limit: Optional[int],
+    cursor: Optional[str],
+):
+    """
+    Intake history of one patient, newest first, with the medication name joined in.
+
+    With `limit` a single page is returned and the cursor for the next page is
+    sent in the X-Next-Cursor header. Without it the full history is streamed
+    as a JSON array. Archived intakes are merged in wherever the range reaches
+    them.
+    """
+    query = (
+        select(
+            MedicationIntake.id,
+            MedicationIntake.medication_id,
+            MedicationIntake.patient_id,
+            MedicationIntake.scheduled_time,
+            MedicationIntake.taken_at,
+            MedicationIntake.status,
+            MedicationIntake.notes,
+            func.coalesce(Medication.name, "Unknown").label("medication_name"),
+        )
+        .outerjoin(Medication, Medication.id == MedicationIntake.medication_id)
+        .where(MedicationIntake.patient_id == patient_id)
+    )
 
+    start_dt = end_dt = before = None
     if start_date:
         start_dt = datetime.fromisoformat(start_date)
-        query = query.filter(MedicationIntake.taken_at >= start_dt)
+        query = query.where(MedicationIntake.taken_at >= start_dt)
 
     if end_date:
         end_dt = datetime.fromisoformat(end_date)
-        query = query.filter(MedicationIntake.taken_at <= end_dt)
-
-    intakes = query.order_by(MedicationIntake.taken_at.desc()).all()
-
-    response: List[MedicationIntakeResponse] = []
-    for intake in intakes:
-        medication = db.query(Medication).filter(Medication.id == intake.medication_id).first()
-        response.append(
-            MedicationIntakeResponse(
-                id=intake.id,
-                medication_id=intake.medication_id,
-                patient_id=intake.patient_id,
-                scheduled_time=intake.scheduled_time,
-                taken_at=intake.taken_at,
-                status=intake.status,
-                notes=intake.notes,
-                medication_name=medication.name if medication else "Unknown",
+        query = query.where(MedicationIntake.taken_at <= end_dt)
+
+    if cursor:
+        cursor_taken_at, cursor_id = decode_intake_cursor(cursor)
+        before = (cursor_taken_at, cursor_id)
+        query = query.where(
+            or_(
+                MedicationIntake.taken_at < cursor_taken_at,
+                and_(MedicationIntake.taken_at == cursor_taken_at, MedicationIntake.id < cursor_id),
             )
         )
 
-    return response
+    query = query.order_by(MedicationIntake.taken_at.desc(), MedicationIntake.id.desc())
+
+    if limit is None:
+        async def hot_rows():
+            result = await db.stream(query.execution_options(yield_per=intake_history_stream_batch_size))
+            async for row in result:
+                yield row._mapping
+
+        async def stream_rows():
+            yield b"["
+            archived = iter_archived_history(db, patient_id, start_dt, end_dt, before)
+            first = True
+            async for row in merge_newest_first(hot_rows(), archived):
+                yield (b"" if first else b",") + json_dumps(dict(row))
+                first = False
+            yield b"]"
+
+        return StreamingResponse(stream_rows(), media_type="application/json")
+
+    rows = [row._mapping for row in (await db.execute(query.limit(limit + 1))).all()]
+    # A full page of hot rows only leaves room for archived intakes newer than its last row
+    archive_start = start_dt
+    if len(rows) > limit:
+        archive_start = max(start_dt, rows[-1]["taken_at"]) if start_dt else rows[-1]["taken_at"]
+    archived = [row async for row in iter_archived_history(db, patient_id, archive_start, end_dt, before, limit + 1)]
+    if archived:
+        rows = sorted(rows + archived, key=intake_sort_key, reverse=True)[:limit + 1]
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_intake_cursor(rows[-1]["taken_at"], rows[-1]["id"])
+
+    # Rows already have the MedicationIntakeResponse fields; serialize them without building models
+    return FastJSONResponse(row_dicts(rows), headers=headers)
+
+
+@app.get("/api/medication_intakes", response_model=List[MedicationIntakeResponse])
+async def get_medication_intakes(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=intake_history_max_page_size),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    if current_user.role_name != "patient":
+        raise HTTPException(status_code=403, detail="Only patients can view their intake history")
+
+    return await intake_history_response(db, current_user.id, start_date, end_date, limit, cursor)
 
 
 @app.get("/api/patients/{patient_id}/medication_intakes", response_model=List[MedicationIntakeResponse])
@@ -619,52 +1166,128 @@ async def get_patient_medication_intakes(
     patient_id: int,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    limit: Optional[int] = Query(None, ge=1, le=intake_history_max_page_size),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    if current_user.role.name != "mantelzorger":
+    if current_user.role_name != "mantelzorger":
         raise HTTPException(status_code=403, detail="Only caregivers can view patient intake history")
 
-    patient = db.query(User).filter(User.id == patient_id).first()
+    patient = await db.get(User, patient_id)
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
 
-    query = db.query(MedicationIntake).filter(MedicationIntake.patient_id == patient_id)
+    return await intake_history_response(db, patient_id, start_date, end_date, limit, cursor)
 
-    if start_date:
-        start_dt = datetime.fromisoformat(start_date)
-        query = query.filter(MedicationIntake.taken_at >= start_dt)
 
-    if end_date:
-        end_dt = datetime.fromisoformat(end_date)
-        query = query.filter(MedicationIntake.taken_at <= end_dt)
-
-    intakes = query.order_by(MedicationIntake.taken_at.desc()).all()
-
-    response: List[MedicationIntakeResponse] = []
-    for intake in intakes:
-        medication = db.query(Medication).filter(Medication.id == intake.medication_id).first()
-        response.append(
-            MedicationIntakeResponse(
-                id=intake.id,
-                medication_id=intake.medication_id,
-                patient_id=intake.patient_id,
-                scheduled_time=intake.scheduled_time,
-                taken_at=intake.taken_at,
-                status=intake.status,
-                notes=intake.notes,
-                medication_name=medication.name if medication else "Unknown",
-            )
-        )
+# --------------------
+# Live events
+# --------------------
+@app.get("/api/events")
+async def get_event_stream(
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_event_stream_user),
+):
+    """
+    Server-sent events for the caller's patients: `intake_recorded` and `dose_missed`.
+
+    EventSource cannot send an Authorization header, so the token may be passed
+    as ?access_token=. Patients assigned after connecting show up on reconnect.
+    """
+    if current_user.role_name != "mantelzorger":
+        raise HTTPException(status_code=403, detail="Only caregivers can subscribe to patient events")
+
+    patient_ids = (await db.execute(select(User.id).where(User.caregiver_id == current_user.id))).scalars().all()
+    # Don't hold a pooled connection for the lifetime of the stream
+    await db.close()
+
+    sub = broker.subscribe(current_user.id, patient_ids)
+    return StreamingResponse(
+        broker.stream(sub),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --------------------
+# Adherence
+# --------------------
+class MedicationAdherence(BaseModel):
+    medication_id: int
+    medication_name: str
+    scheduled: int
+    taken: int
+    missed: int
+    adherence_pct: Optional[float] = None
+
+
+class AdherenceResponse(BaseModel):
+    patient_id: int
+    start_date: date
+    end_date: date
+    scheduled: int
+    taken: int
+    missed: int
+    adherence_pct: Optional[float] = None
+    medications: List[MedicationAdherence]
 
-    return response
+
+@app.get("/api/patients/{patient_id}/adherence", response_model=AdherenceResponse)
+async def get_patient_adherence(
+    patient_id: int,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Adherence over [start_date, end_date] (default: the last 30 UTC days), read from the daily rollup."""
+    if current_user.role_name == "patient":
+        if current_user.id != patient_id:
+            raise HTTPException(status_code=403, detail="Patients can only view their own adherence")
+    elif current_user.role_name != "mantelzorger":
+        raise HTTPException(status_code=403, detail="Only caregivers can view patient adherence")
+
+    end_date = end_date or utc_today()
+    start_date = start_date or end_date - timedelta(days=29)
+    if start_date > end_date:
+        raise HTTPException(status_code=400, detail="start_date must not be after end_date")
+
+    patient = await db.get(User, patient_id)
+    if not patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+
+    rows = (await db.execute(summary_query(patient_id, start_date, end_date))).all()
+    medications = [
+        MedicationAdherence(
+            medication_id=row.medication_id,
+            medication_name=row.medication_name,
+            scheduled=row.scheduled,
+            taken=row.taken,
+            missed=row.missed,
+            adherence_pct=adherence_percentage(row.scheduled, row.taken),
+        )
+        for row in rows
+    ]
+    scheduled = sum(m.scheduled for m in medications)
+    taken = sum(m.taken for m in medications)
+    return AdherenceResponse(
+        patient_id=patient_id,
+        start_date=start_date,
+        end_date=end_date,
+        scheduled=scheduled,
+        taken=taken,
+        missed=sum(m.missed for m in medications),
+        adherence_pct=adherence_percentage(scheduled, taken),
+        medications=medications,
+    )
 
 
 # --------------------
 # 2FA endpoints (FIXED)
 # --------------------
 @app.get("/api/2fa/enable")
-async def enable_2fa(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def enable_2fa(db: AsyncSession = Depends(get_async_db), current_user: Principal = Depends(get_current_user)):
     """Generate TOTP secret for 2FA setup"""
     if current_user.is_2fa_enabled:
         raise HTTPException(status_code=400, detail="2FA is already enabled")
@@ -679,19 +1302,23 @@ async def enable_2fa(db: Session = Depends(get_db), current_user: User = Depends
 @app.post("/api/2fa/verify-setup")
 async def verify_2fa_setup(
     request: Verify2FASetupRequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user),
 ):
     """Verify TOTP code and enable 2FA"""
+    auth_admission.admit(client_ip(http_request), current_user.username)
     if current_user.is_2fa_enabled:
         raise HTTPException(status_code=400, detail="2FA is already enabled")
 
     if not verify_totp_code(request.secret, request.code):
         raise HTTPException(status_code=400, detail="Invalid code")
 
-    current_user.totp_secret = request.secret
-    current_user.is_2fa_enabled = True
-    db.commit()
+    user = await db.get(User, current_user.id)
+    user.totp_secret = request.secret
+    user.is_2fa_enabled = True
+    await db.commit()
+    principal_cache.invalidate(current_user.username)
 
     return {"message": "2FA enabled successfully"}
 
@@ -699,22 +1326,24 @@ async def verify_2fa_setup(
 @app.post("/api/2fa/disable")
 async def disable_2fa(
     request: Disable2FARequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     """Disable 2FA with verification"""
-    if not current_user.is_2fa_enabled:
+    user = await db.get(User, current_user.id)
+    if not user.is_2fa_enabled:
         raise HTTPException(status_code=400, detail="2FA is not enabled")
 
-    if not current_user.totp_secret:
+    if not user.totp_secret:
         raise HTTPException(status_code=400, detail="2FA secret missing")
 
-    if not verify_totp_code(current_user.totp_secret, request.code):
+    if not verify_totp_code(user.totp_secret, request.code):
         raise HTTPException(status_code=400, detail="Invalid code")
 
-    current_user.is_2fa_enabled = False
-    current_user.totp_secret = None
-    db.commit()
+    user.is_2fa_enabled = False
+    user.totp_secret = None
+    await db.commit()
+    principal_cache.invalidate(current_user.username)
 
     return {"message": "2FA disabled successfully"}
 
@@ -722,7 +1351,8 @@ async def disable_2fa(
 @app.post("/api/2fa/verify-login")
 async def verify_2fa_login(
     request: Verify2FALoginRequest,
-    db: Session = Depends(get_db)
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Complete 2FA login with TOTP code"""
     try:
@@ -734,7 +1364,9 @@ async def verify_2fa_login(
     if not username:
         raise HTTPException(status_code=401, detail="Invalid 2FA token payload")
 
-    user = db.query(User).filter(User.username == username).first()
+    auth_admission.admit(client_ip(http_request), username)
+
+    user = await load_user(db, username)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
@@ -760,25 +1392,27 @@ async def verify_2fa_login(
 @app.post("/api/2fa/remove-old-account")
 async def remove_old_2fa_account(
     request: RemoveOldAccount2FARequest,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user)
 ):
     """Remove old linked account from authenticator app - requires current TOTP code verification"""
-    if not current_user.is_2fa_enabled:
+    user = await db.get(User, current_user.id)
+    if not user.is_2fa_enabled:
         raise HTTPException(status_code=400, detail="2FA is not enabled. No old account to remove.")
 
-    if not current_user.totp_secret:
+    if not user.totp_secret:
         raise HTTPException(status_code=400, detail="2FA secret not found")
 
-    if not verify_totp_code(current_user.totp_secret, request.code):
+    if not verify_totp_code(user.totp_secret, request.code):
         raise HTTPException(status_code=400, detail="Invalid code. Could not verify current 2FA account.")
 
     # Clear the old secret and disable 2FA temporarily to allow re-setup
     # This allows the user to remove the old account from their authenticator app
     # and set up a fresh one for better structure
-    current_user.totp_secret = None
-    current_user.is_2fa_enabled = False
-    db.commit()
+    user.totp_secret = None
+    user.is_2fa_enabled = False
+    await db.commit()
+    principal_cache.invalidate(current_user.username)
 
     return {
         "message": "Old 2FA account has been removed. You can now set up a fresh account.",
@@ -0,0 +1,251 @@
+"""
+Bulk medication import/export as NDJSON or CSV.
+
+One record per medication:
+
+    patient_id | patient_username, name, dosage, schedule, notes, is_active, start_date, end_date
+
+`schedule` is the same JSON object the API uses ({"Monday": {"enabled": true,
+"times": ["08:00"]}, ...}); in CSV it is a JSON string in one cell. Imports
+reference patients by `patient_id` or `patient_username`.
+"""
+import codecs
+import csv
+import io
+import json
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Deque, Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError, field_validator, model_validator
+
+from dose_timer import DAY_NAMES, parse_time
+
+FORMATS = ("ndjson", "csv")
+EXPORT_COLUMNS = [
+    "id", "patient_id", "patient_username", "name", "dosage", "schedule",
+    "notes", "is_active", "start_date", "end_date",
+]
+
+
+class MedicationImportRow(BaseModel):
+    patient_id: Optional[int] = None
+    patient_username: Optional[str] = None
+    name: str
+    dosage: str
+    schedule: dict
+    notes: Optional[str] = None
+    is_active: bool = True
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+
+    @field_validator("name", "dosage")
+    @classmethod
+    def not_blank(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("must not be empty")
+        return value
+
+    @field_validator("schedule", mode="before")
+    @classmethod
+    def parse_schedule(cls, value):
+        if isinstance(value, str):
+            value = json.loads(value)
+        if not isinstance(value, dict):
+            raise ValueError("must be a JSON object")
+        for day_name, day in value.items():
+            if day_name not in DAY_NAMES:
+                raise ValueError(f"unknown day '{day_name}'")
+            if not isinstance(day, dict) or not isinstance(day.get("times", []), list):
+                raise ValueError(f"{day_name} must look like {{\"enabled\": true, \"times\": [\"08:00\"]}}")
+            for time_str in day.get("times", []):
+                if parse_time(time_str) is None:
+                    raise ValueError(f"invalid time '{time_str}' on {day_name}")
+        return value
+
+    @model_validator(mode="after")
+    def has_patient(self):
+        if self.patient_id is None and not self.patient_username:
+            raise ValueError("patient_id or patient_username is required")
+        return self
+
+
+# --------------------
+# Import parsing
+# --------------------
+async def iter_text_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream incrementally and yield its lines, line endings included."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a byte stream into decoded lines without buffering the whole body."""
+    async for line in iter_text_lines(chunks):
+        yield line.rstrip("\r\n")
+
+
+class _LineFeed:
+    """The lines a csv.reader reads from, appended as the body streams in."""
+
+    def __init__(self):
+        self.lines: Deque[str] = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+def _in_quoted_cell(line: str, in_quotes: bool) -> bool:
+    """
+    Whether a record is still inside a quoted cell at the end of `line`, given
+    whether it was at the start. As in the csv module, only a quote opening a
+    cell starts a quoted cell (`1/2" tablet` is plain text) and a doubled quote
+    inside one is a literal quote.
+    """
+    cell_start = not in_quotes
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if in_quotes:
+            if char == '"':
+                if line[i + 1:i + 2] == '"':
+                    i += 1
+                else:
+                    in_quotes = False
+        elif char == ",":
+            cell_start = True
+            i += 1
+            continue
+        elif char == '"' and cell_start:
+            in_quotes = True
+        cell_start = False
+        i += 1
+    return in_quotes
+
+
+async def iter_csv_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[List[str]], Optional[str]]]:
+    """
+    Yield (line_number, cells, error) per CSV record, where line_number is the
+    line the record starts on. Quoted cells may span lines: one csv.reader reads
+    the whole stream and is only asked for a record once all its lines are in.
+    """
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    line_number = 0
+    record_start = 1
+    in_quotes = False
+    async for line in iter_text_lines(chunks):
+        line_number += 1
+        feed.lines.append(line)
+        in_quotes = _in_quoted_cell(line, in_quotes)
+        if in_quotes:
+            continue
+        try:
+            yield record_start, next(reader), None
+        except (csv.Error, StopIteration) as e:
+            feed.lines.clear()
+            yield record_start, None, str(e) or "empty record"
+        record_start = line_number + 1
+    if feed.lines:
+        yield record_start, None, "quoted cell is never closed"
+
+
+def _csv_record(header: List[str], values: List[str]) -> dict:
+    if len(values) != len(header):
+        raise ValueError(f"expected {len(header)} columns, got {len(values)}")
+    # Empty cells mean "not set"
+    return {key: value for key, value in zip(header, values) if value != ""}
+
+
+async def iter_records(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Yield (line_number, record, error) for every non-empty record in the body."""
+    if fmt == "csv":
+        header: Optional[List[str]] = None
+        async for line_number, values, error in iter_csv_rows(chunks):
+            if error:
+                yield line_number, None, f"unparseable line: {error}"
+                continue
+            if not any(value.strip() for value in values):
+                continue
+            if header is None:
+                header = values
+                continue
+            try:
+                yield line_number, _csv_record(header, values), None
+            except ValueError as e:
+                yield line_number, None, f"unparseable line: {e}"
+        return
+
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            yield line_number, None, f"unparseable line: {e}"
+            continue
+        yield line_number, record, None
+
+
+def validate_record(record: dict) -> Tuple[Optional[MedicationImportRow], Optional[str]]:
+    try:
+        return MedicationImportRow.model_validate(record), None
+    except ValidationError as e:
+        return None, "; ".join(
+            f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}" for error in e.errors()
+        )
+
+
+# --------------------
+# Export serialization
+# --------------------
+def _json_default(value):
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+def ndjson_lines(rows: Iterable) -> str:
+    return "".join(
+        json.dumps({column: getattr(row, column) for column in EXPORT_COLUMNS}, default=_json_default) + "\n"
+        for row in rows
+    )
+
+
+def csv_header() -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_COLUMNS)
+    return buffer.getvalue()
+
+
+def _csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, dict):
+        return json.dumps(value)
+    return _json_default(value)
+
+
+def csv_lines(rows: Iterable) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(_csv_value(getattr(row, column)) for column in EXPORT_COLUMNS)
+    return buffer.getvalue()
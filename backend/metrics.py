@@ -0,0 +1,285 @@
+"""
+Prometheus metrics.
+
+A small in-process registry rendered in the Prometheus text format (0.0.4) at
+GET /metrics. Recording is a dict lookup and a few additions under a lock, so
+the instrumentation stays on permanently:
+
+- `MetricsMiddleware` times every request per route template and counts the
+  database queries it ran;
+- `instrument_engine` hooks SQLAlchemy cursor events on an engine;
+- the missed-dose checker, the alert sender and password verification record
+  into the metrics defined at the bottom of this module.
+
+Each process has its own registry. The standalone scheduler serves its
+metrics on SCHEDULER_METRICS_PORT when that is set.
+"""
+import bisect
+import contextvars
+import os
+import threading
+import time as timer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+SCHEDULER_TICK_BUDGET_SECONDS = float(os.getenv("SCHEDULER_TICK_BUDGET_SECONDS", "60"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+# --------------------
+# Metric types
+# --------------------
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[Tuple[str, ...], list] = {}  # labelvalues -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * len(self.buckets) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            series = [(labelvalues, list(values)) for labelvalues, values in self._series.items()]
+        for labelvalues, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(values[-2])}"
+            yield f"{self.name}_count{labels} {values[-1]}"
+
+
+class CallbackMetric:
+    """Counter or gauge read from existing stats at scrape time; `read` returns [(labelvalues, value)]."""
+
+    def __init__(self, name: str, type: str, help: str, read: Callable[[], Iterable[Tuple[Sequence[str], float]]],
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.type = type
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.read = read
+
+    def samples(self) -> Iterable[str]:
+        for labelvalues, value in self.read():
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, type: str, help: str, read, labelnames: Sequence[str] = ()) -> CallbackMetric:
+        return self.register(CallbackMetric(name, type, help, read, labelnames))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                print(f"❌ Collecting metric {metric.name} failed: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# --------------------
+# Metrics
+# --------------------
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route", "status"),
+)
+http_request_db_queries = registry.histogram(
+    "http_request_db_queries", "Database queries per HTTP request.", ("method", "route"), QUERY_COUNT_BUCKETS,
+)
+http_request_db_seconds = registry.histogram(
+    "http_request_db_seconds", "Time spent in database queries per HTTP request.", ("method", "route"),
+)
+db_queries = registry.counter("db_queries_total", "Database queries executed by this process.")
+db_query_seconds = registry.counter("db_query_seconds_total", "Time spent executing database queries.")
+
+missed_dose_check_duration = registry.histogram(
+    "missed_dose_check_duration_seconds", "Duration of one missed-dose checker tick.",
+)
+missed_dose_check_overruns = registry.counter(
+    "missed_dose_check_overruns_total", "Checker ticks that took longer than SCHEDULER_TICK_BUDGET_SECONDS.",
+)
+missed_dose_check_failures = registry.counter("missed_dose_check_failures_total", "Checker ticks that raised.")
+missed_doses_detected = registry.counter("missed_doses_detected_total", "Missed doses claimed and alerted about.")
+
+alert_send_duration = registry.histogram("alert_send_duration_seconds", "SMTP send time per alert email.")
+password_verify_duration = registry.histogram(
+    "password_verify_duration_seconds", "bcrypt verification time (excluding pool wait).",
+)
+
+
+# --------------------
+# Instrumentation
+# --------------------
+_request_db: "contextvars.ContextVar[Optional[list]]" = contextvars.ContextVar("request_db", default=None)
+
+
+def instrument_engine(engine) -> None:
+    """Count queries and their time on a (sync) Engine; pass `async_engine.sync_engine` for async engines."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = timer.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = timer.perf_counter() - context._metrics_started
+        db_queries.inc()
+        db_query_seconds.inc(amount=elapsed)
+        request = _request_db.get()
+        if request is not None:
+            request[0] += 1
+            request[1] += elapsed
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and database work per request, labelled by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = timer.perf_counter()
+        status = [500]
+        request_db = [0, 0.0]
+        token = _request_db.set(request_db)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_db.reset(token)
+            # Set by the router on the shared scope; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            http_request_duration.observe(timer.perf_counter() - started, method, route, str(status[0]))
+            http_request_db_queries.observe(request_db[0], method, route)
+            http_request_db_seconds.observe(request_db[1], method, route)
+
+
+class Timer:
+    """`with Timer(histogram):` observes the block's duration."""
+
+    def __init__(self, histogram: Histogram, *labelvalues: str):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.started = timer.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = timer.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, *self.labelvalues)
+        return False
+
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve GET /metrics from a daemon thread (for processes without a web server)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"Metrics available on http://{host}:{port}/metrics")
+    return server
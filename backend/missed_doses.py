@@ -0,0 +1,439 @@
+import multiprocessing
+import os
+import threading
+import time as timer
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, func, or_, select, union_all
+from sqlalchemy.orm import Session, aliased
+
+from adherence import count_missed_doses, utc_bounds
+from database import (
+    get_db, get_read_db, Medication, MedicationChange, MedicationIntake, MissedDoseNotification, ScheduleSlot, User,
+)
+from dose_timer import DoseTimerEngine, DueDose
+from events import broker, missed_event
+import metrics
+from notification_dedup import claim_notifications, purge_notifications
+from notifications import AlertQueue
+from query_budget import track
+from schedule_slots import minute_ranges, find_scheduled_between
+
+# --------------------
+# Missed-med detection + notifications
+# --------------------
+check_missed_medications_grace_period = timedelta(minutes=5)  # alert once a dose is this late
+check_missed_medications_max_lateness = timedelta(minutes=10)  # don't alert for doses older than this
+notified_retention_days = 1  # keep yesterday's notification records, drop older days
+medication_change_retention_days = 1
+
+# Split each tick's due doses into patient hash partitions checked concurrently; 1 checks them inline
+MISSED_DOSE_CHECK_PARTITIONS = int(os.getenv("MISSED_DOSE_CHECK_PARTITIONS", "1"))
+MISSED_DOSE_CHECK_WORKERS = int(os.getenv("MISSED_DOSE_CHECK_WORKERS", str(MISSED_DOSE_CHECK_PARTITIONS)))
+MISSED_DOSE_CHECK_POOL = os.getenv("MISSED_DOSE_CHECK_POOL", "process")  # "process" or "thread"
+# Below this many due doses one query takes ~0.15s and dispatching to the pool costs more than it saves
+MISSED_DOSE_CHECK_PARTITION_MIN_DOSES = int(os.getenv("MISSED_DOSE_CHECK_PARTITION_MIN_DOSES", "20000"))
+
+# Change ids are assigned at insert but become visible at commit, so on PostgreSQL a lower
+# id can show up after a higher one; every poll re-reads changes this recent
+MEDICATION_CHANGE_POLL_OVERLAP_SECONDS = int(os.getenv("MEDICATION_CHANGE_POLL_OVERLAP_SECONDS", "60"))
+
+alert_queue = AlertQueue.from_env()
+last_medication_change_id = 0  # highest id seen in the medication_changes feed
+applied_medication_changes: Dict[int, datetime] = {}  # change id -> changed_at, for changes inside the overlap
+
+# Alert delivery counters for /metrics, read from the queue at scrape time
+for _stat, _name, _type, _help in (
+    ("alerts_queued", "alerts_queued_total", "counter", "Missed-dose alerts queued for email."),
+    ("alerts_sent", "alerts_sent_total", "counter", "Alerts delivered (a digest email can carry several)."),
+    ("emails_sent", "alert_emails_sent_total", "counter", "Alert emails sent."),
+    ("send_failures", "alert_send_failures_total", "counter", "Failed SMTP send attempts."),
+    ("alerts_dropped", "alerts_dropped_total", "counter", "Alerts given up on after ALERT_MAX_ATTEMPTS."),
+    ("queue_depth", "alert_queue_depth", "gauge", "Alerts waiting to be sent."),
+):
+    metrics.registry.callback(_name, _type, _help, lambda stat=_stat: [((), alert_queue.stats()[stat])])
+
+
+def send_alert_email(to_email: str, patient_name: str, medication_name: str) -> bool:
+    """Queue an alert email to the caregiver about a missed medication."""
+    return alert_queue.enqueue(to_email, patient_name, medication_name)
+
+
+def find_due_doses(db: Session, now: datetime) -> List[DueDose]:
+    """Doses of active medications whose grace period ran out in the alert window, from schedule_slots."""
+    return find_scheduled_between(
+        db,
+        now - check_missed_medications_max_lateness,
+        now - check_missed_medications_grace_period,
+    )
+
+
+class MissedDose(NamedTuple):
+    """A due dose with nothing recorded, as a plain tuple so it can come back from a worker process."""
+    medication_id: int
+    patient_id: int
+    scheduled_time: str
+    scheduled_at: datetime
+    medication_name: str
+    dosage: str
+    patient_name: str
+    caregiver_email: Optional[str]
+
+
+def due_window(due_doses: List[DueDose]) -> Tuple[datetime, datetime]:
+    """The scheduled times spanned by a batch of due doses from the dose timer engine."""
+    return min(dose.scheduled_at for dose in due_doses), max(dose.scheduled_at for dose in due_doses)
+
+
+def find_missed_doses(
+    db: Session, start: datetime, end: datetime, partition: Optional[Tuple[int, int]] = None,
+) -> List[MissedDose]:
+    """
+    Doses of active medications scheduled in [start, end] that have no intake
+    recorded on their day and no alert sent yet.
+
+    One query: schedule_slots joined to the medication, patient and caregiver,
+    filtered on the weekday/minute window (ix_schedule_slots_due) with NOT
+    EXISTS checks against medication_intakes and missed_dose_notifications. A
+    window crossing midnight becomes a UNION ALL of one such select per day.
+    `partition` = (index, count) restricts it to patients with
+    patient_id % count == index.
+    """
+    ranges = minute_ranges(start, end)
+    if not ranges:
+        return []
+
+    patient = aliased(User)
+    caregiver = aliased(User)
+    selects = []
+    for day, first_minute, last_minute in ranges:
+        day_start, day_end = utc_bounds(day.date())
+        intake_recorded = (
+            select(MedicationIntake.id)
+            .where(
+                MedicationIntake.patient_id == Medication.patient_id,
+                MedicationIntake.medication_id == ScheduleSlot.medication_id,
+                MedicationIntake.scheduled_time == ScheduleSlot.time_str,
+                MedicationIntake.taken_at >= day_start,
+                MedicationIntake.taken_at < day_end,
+            )
+            .exists()
+        )
+        already_notified = (
+            select(MissedDoseNotification.id)
+            .where(
+                MissedDoseNotification.scheduled_date == day.date(),
+                MissedDoseNotification.medication_id == ScheduleSlot.medication_id,
+                MissedDoseNotification.patient_id == Medication.patient_id,
+                MissedDoseNotification.scheduled_time == ScheduleSlot.time_str,
+            )
+            .exists()
+        )
+        query = (
+            select(
+                ScheduleSlot.medication_id,
+                Medication.patient_id,
+                ScheduleSlot.time_str,
+                ScheduleSlot.weekday,
+                ScheduleSlot.minute_of_day,
+                Medication.name,
+                Medication.dosage,
+                patient.username,
+                caregiver.email,
+            )
+            .join(Medication, Medication.id == ScheduleSlot.medication_id)
+            .join(patient, patient.id == Medication.patient_id)
+            .outerjoin(caregiver, caregiver.id == patient.caregiver_id)
+            .where(
+                ScheduleSlot.weekday == day.weekday(),
+                ScheduleSlot.minute_of_day.between(first_minute, last_minute),
+                Medication.is_active == True,
+                ~intake_recorded,
+                ~already_notified,
+            )
+        )
+        if partition is not None:
+            index, count = partition
+            query = query.where(Medication.patient_id % count == index)
+        selects.append(query)
+
+    statement = selects[0] if len(selects) == 1 else union_all(*selects)
+    days = {day.weekday(): day for day, _, _ in ranges}
+    missed = [
+        MissedDose(
+            medication_id, patient_id, time_str, days[weekday] + timedelta(minutes=minute_of_day),
+            medication_name, dosage, patient_name, caregiver_email,
+        )
+        for (medication_id, patient_id, time_str, weekday, minute_of_day,
+             medication_name, dosage, patient_name, caregiver_email) in db.execute(statement)
+    ]
+    missed.sort(key=lambda dose: (dose.scheduled_at, dose.patient_id, dose.medication_id))
+    return missed
+
+
+# --------------------
+# Partitioned checking
+# --------------------
+@dataclass
+class PartitionResult:
+    partition: int
+    due: int
+    missed: List[MissedDose]
+    seconds: float
+
+
+missed_dose_partition_duration = metrics.registry.histogram(
+    "missed_dose_partition_duration_seconds", "Time to check one patient partition of a checker tick.", ("partition",),
+)
+last_partition_results: List[PartitionResult] = []  # of the latest partitioned tick, for diagnostics
+_check_pool: Optional[Executor] = None
+_check_pool_lock = threading.Lock()
+
+
+def partition_of(patient_id: int, partitions: int) -> int:
+    """Stable partition of a patient; the same expression find_missed_doses filters on in SQL."""
+    return patient_id % partitions
+
+
+def should_partition(due_count: int) -> bool:
+    """Partition only large ticks, and never on a single CPU where the workers would just take turns."""
+    return (
+        MISSED_DOSE_CHECK_PARTITIONS > 1
+        and (os.cpu_count() or 1) > 1
+        and due_count >= MISSED_DOSE_CHECK_PARTITION_MIN_DOSES
+    )
+
+
+def partition_due_doses(due_doses: List[DueDose], partitions: int) -> Dict[int, List[DueDose]]:
+    grouped: Dict[int, List[DueDose]] = {}
+    for dose in due_doses:
+        grouped.setdefault(partition_of(dose.patient_id, partitions), []).append(dose)
+    return grouped
+
+
+def check_partition(partition: int, partitions: int, due_doses: List[DueDose]) -> PartitionResult:
+    """Find the missed doses of one partition on a session of its own (runs in a pool worker)."""
+    started = timer.perf_counter()
+    missed: List[MissedDose] = []
+    if due_doses:
+        read_db = next(get_read_db())
+        try:
+            start, end = due_window(due_doses)
+            missed = find_missed_doses(read_db, start, end, (partition, partitions))
+        finally:
+            read_db.close()
+    return PartitionResult(partition, len(due_doses), missed, timer.perf_counter() - started)
+
+
+def check_pool() -> Executor:
+    """The worker pool, created on first use. Process workers are spawned so they open their own connections."""
+    global _check_pool
+    with _check_pool_lock:
+        if _check_pool is None:
+            if MISSED_DOSE_CHECK_POOL == "thread":
+                _check_pool = ThreadPoolExecutor(MISSED_DOSE_CHECK_WORKERS, thread_name_prefix="missed-dose-check")
+            else:
+                _check_pool = ProcessPoolExecutor(MISSED_DOSE_CHECK_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _check_pool
+
+
+def partition_stats() -> List[dict]:
+    return [
+        {"partition": result.partition, "due": result.due, "missed": len(result.missed), "seconds": round(result.seconds, 4)}
+        for result in last_partition_results
+    ]
+
+
+def shutdown_check_pool() -> None:
+    global _check_pool
+    with _check_pool_lock:
+        if _check_pool is not None:
+            _check_pool.shutdown(wait=True, cancel_futures=True)
+            _check_pool = None
+
+
+def find_missed_doses_partitioned(
+    due_doses: List[DueDose], partitions: int = MISSED_DOSE_CHECK_PARTITIONS, pool: Optional[Executor] = None,
+) -> Tuple[List[MissedDose], List[PartitionResult]]:
+    """
+    Check the due doses partition by partition on the worker pool (check_pool()
+    unless given) and merge the results, ordered by scheduled time. A partition
+    that fails fails the tick.
+    """
+    grouped = partition_due_doses(due_doses, partitions)
+    if len(grouped) <= 1:
+        results = [check_partition(partition, partitions, doses) for partition, doses in grouped.items()]
+    else:
+        pool = pool or check_pool()
+        futures = [pool.submit(check_partition, partition, partitions, doses) for partition, doses in sorted(grouped.items())]
+        results = [future.result() for future in futures]
+
+    for result in results:
+        missed_dose_partition_duration.observe(result.seconds, str(result.partition))
+    missed = sorted(
+        (dose for result in results for dose in result.missed),
+        key=lambda dose: (dose.scheduled_at, dose.patient_id, dose.medication_id),
+    )
+    return missed, results
+
+
+@track("missed_dose_check")
+def check_missed_medications(due_doses: Optional[List[DueDose]] = None):
+    """
+    Check for medications that should have been taken but weren't.
+
+    The dose timer engine calls this with the doses whose grace period just ran
+    out. Without `due_doses` it falls back to a full scan of active medications.
+    """
+    started = timer.perf_counter()
+    partitioned = False
+    read_db = next(get_read_db())
+    db = next(get_db())
+
+    try:
+        now = datetime.now()
+        if due_doses is None:
+            due_doses = find_due_doses(read_db, now)
+        if not due_doses:
+            return
+        partitioned = should_partition(len(due_doses))
+        if partitioned:
+            missed_doses, partition_results = find_missed_doses_partitioned(due_doses, MISSED_DOSE_CHECK_PARTITIONS)
+            last_partition_results[:] = partition_results
+        else:
+            missed_doses = find_missed_doses(read_db, *due_window(due_doses))
+
+        # Claiming first makes sure only one worker/process alerts per dose
+        claimed = claim_notifications(db, missed_doses)
+        count_missed_doses(db, claimed)
+        metrics.missed_doses_detected.inc(amount=len(claimed))
+        for missed in claimed:
+            broker.publish_threadsafe(*missed_event(
+                missed.scheduled_at.date(), missed.patient_id, missed.patient_name,
+                missed.medication_id, missed.medication_name, missed.scheduled_time,
+            ))
+            print(
+                f"[MISSED MEDICATION ALERT] Patient: {missed.patient_name}, "
+                f"Medication: {missed.medication_name} ({missed.dosage}), "
+                f"Scheduled time: {missed.scheduled_time}, Current time: {now.strftime('%H:%M')}"
+            )
+
+            if missed.caregiver_email:
+                print(f"📧 Queueing alert email to {missed.caregiver_email}")
+                send_alert_email(missed.caregiver_email, missed.patient_name, missed.medication_name)
+            else:
+                print(f"⚠️ No caregiver email found for patient {missed.patient_name}")
+
+    except Exception:
+        metrics.missed_dose_check_failures.inc()
+        raise
+    finally:
+        read_db.close()
+        db.close()
+        elapsed = timer.perf_counter() - started
+        metrics.missed_dose_check_duration.observe(elapsed)
+        if elapsed > metrics.SCHEDULER_TICK_BUDGET_SECONDS:
+            metrics.missed_dose_check_overruns.inc()
+            print(f"⚠️ Missed medication check took {elapsed:.1f}s")
+            if partitioned:
+                print("   per partition: " + ", ".join(
+                    f"#{result.partition} {result.due} due {result.seconds:.1f}s" for result in last_partition_results
+                ))
+
+
+def cleanup_notified_medications():
+    """Drop notification records of days that can no longer be alerted about, and old change-feed rows."""
+    db = next(get_db())
+    try:
+        purge_notifications(db, keep_days=notified_retention_days)
+        cutoff = datetime.utcnow() - timedelta(days=medication_change_retention_days)
+        db.execute(delete(MedicationChange).where(MedicationChange.changed_at < cutoff))
+        db.commit()
+    finally:
+        db.close()
+
+
+dose_engine = DoseTimerEngine(
+    on_due=check_missed_medications,
+    grace_period=check_missed_medications_grace_period,
+    max_lateness=check_missed_medications_max_lateness,
+)
+
+
+def rebuild_dose_engine():
+    """Load every active medication schedule into the dose timer engine."""
+    global last_medication_change_id
+
+    db = next(get_read_db())
+    try:
+        # Read the feed position first: changes racing with the rebuild are replayed, not lost
+        cutoff = datetime.utcnow() - timedelta(seconds=MEDICATION_CHANGE_POLL_OVERLAP_SECONDS)
+        last_medication_change_id = db.query(func.coalesce(func.max(MedicationChange.id), 0)).scalar()
+        applied_medication_changes.clear()
+        applied_medication_changes.update(
+            db.query(MedicationChange.id, MedicationChange.changed_at)
+            .filter(MedicationChange.changed_at >= cutoff, MedicationChange.id <= last_medication_change_id)
+            .all()
+        )
+        rows = (
+            db.query(Medication.id, Medication.patient_id, Medication.schedule)
+            .filter(Medication.is_active == True)
+            .all()
+        )
+        dose_engine.rebuild(rows)
+        print(f"Dose timer engine loaded {dose_engine.pending_count()} medication schedules")
+    finally:
+        db.close()
+
+
+@track("poll_medication_changes")
+def poll_medication_changes():
+    """
+    Apply medication writes recorded in the medication_changes feed since the last poll.
+
+    Besides ids above the highest one seen, every poll re-reads the changes of
+    the last MEDICATION_CHANGE_POLL_OVERLAP_SECONDS, so a change whose
+    transaction committed after a higher id was polled is still applied; ids
+    already applied are skipped.
+    """
+    global last_medication_change_id
+
+    db = next(get_read_db())
+    try:
+        cutoff = datetime.utcnow() - timedelta(seconds=MEDICATION_CHANGE_POLL_OVERLAP_SECONDS)
+        rows = (
+            db.query(MedicationChange.id, MedicationChange.medication_id, MedicationChange.changed_at)
+            .filter(or_(MedicationChange.id > last_medication_change_id, MedicationChange.changed_at >= cutoff))
+            .order_by(MedicationChange.id)
+            .all()
+        )
+        changes = [change for change in rows if change.id not in applied_medication_changes]
+        if rows:
+            last_medication_change_id = max(last_medication_change_id, rows[-1].id)
+        for change in changes:
+            applied_medication_changes[change.id] = change.changed_at
+        # Older changes are no longer re-read, so they can't come up again
+        for change_id, changed_at in list(applied_medication_changes.items()):
+            if changed_at < cutoff:
+                del applied_medication_changes[change_id]
+        if not changes:
+            return
+
+        changed_ids = {change.medication_id for change in changes}
+        current = {
+            row.id: row
+            for row in db.query(Medication.id, Medication.patient_id, Medication.schedule, Medication.is_active)
+            .filter(Medication.id.in_(changed_ids))
+            .all()
+        }
+        for medication_id in changed_ids:
+            row = current.get(medication_id)
+            if row is None:
+                dose_engine.unschedule_medication(medication_id)
+            else:
+                dose_engine.schedule_medication(row.id, row.patient_id, row.schedule, is_active=row.is_active)
+    finally:
+        db.close()
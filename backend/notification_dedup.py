@@ -0,0 +1,72 @@
+from datetime import date, datetime, timedelta
+from typing import Iterable, List
+
+from sqlalchemy import delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from database import MissedDoseNotification
+
+
+# --------------------
+# Missed-dose notification dedup store
+# --------------------
+def _insert_ignore(db: Session):
+    """INSERT ... ON CONFLICT DO NOTHING for the session's dialect."""
+    dialect = postgresql if db.get_bind().dialect.name == "postgresql" else sqlite
+    return dialect.insert(MissedDoseNotification).on_conflict_do_nothing()
+
+
+def claim_notifications(db: Session, doses: Iterable) -> List:
+    """
+    Record that an alert is about to be sent for each dose and return the ones
+    this caller won.
+
+    Every dose (anything with medication_id, patient_id, scheduled_time and
+    scheduled_at) maps to one row guarded by a unique constraint, so when several
+    workers or processes race for the same dose exactly one insert succeeds.
+    Claims are committed before returning so the winner is settled before any
+    email goes out.
+    """
+    doses = list(doses)
+    if not doses:
+        return []
+    now = datetime.utcnow()
+    rows = [
+        {
+            "scheduled_date": dose.scheduled_at.date(),
+            "medication_id": dose.medication_id,
+            "patient_id": dose.patient_id,
+            "scheduled_time": dose.scheduled_time,
+            "notified_at": now,
+        }
+        for dose in doses
+    ]
+    # One statement per batch of rows; conflicting rows return nothing
+    won = set(db.execute(
+        _insert_ignore(db).returning(
+            MissedDoseNotification.scheduled_date,
+            MissedDoseNotification.medication_id,
+            MissedDoseNotification.patient_id,
+            MissedDoseNotification.scheduled_time,
+        ),
+        rows,
+    ).tuples())
+    db.commit()
+    return [
+        dose for dose in doses
+        if (dose.scheduled_at.date(), dose.medication_id, dose.patient_id, dose.scheduled_time) in won
+    ]
+
+
+def purge_notifications(db: Session, keep_days: int = 1, today: date = None) -> int:
+    """
+    Drop whole days of notification records older than `keep_days`.
+
+    Rows are bucketed by scheduled_date, the leading column of the unique index,
+    so this is an index range delete rather than a scan of every key.
+    """
+    cutoff = (today or date.today()) - timedelta(days=keep_days)
+    result = db.execute(delete(MissedDoseNotification).where(MissedDoseNotification.scheduled_date < cutoff))
+    db.commit()
+    return result.rowcount
@@ -0,0 +1,261 @@
+import heapq
+import itertools
+import os
+import smtplib
+import threading
+import time as timer
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.mime.text import MIMEText
+from typing import Dict, List, Optional
+
+import metrics
+
+
+@dataclass
+class Alert:
+    """A missed-medication alert for one caregiver."""
+    to_email: str
+    patient_name: str
+    medication_name: str
+    created_at: datetime = field(default_factory=datetime.now)
+
+
+@dataclass
+class _Batch:
+    to_email: str
+    alerts: List[Alert]
+    attempt: int = 0
+
+
+# --------------------
+# Message composition
+# --------------------
+def compose_alert_message(alerts: List[Alert], sender: str) -> MIMEText:
+    """Build the email for one or more alerts to the same caregiver."""
+    first = alerts[0]
+    if len(alerts) == 1:
+        subject = f"LET OP: {first.patient_name} heeft medicatie nog niet ingenomen"
+        body = (
+            f"Dag,\n\n"
+            f"Dit is een herinnering voor {first.patient_name}.\n\n"
+            f"De medicatie '{first.medication_name}' is nog niet als 'ingenomen' gemeld.\n"
+            f"Controleer of de medicatie alsnog ingenomen kan worden.\n\n"
+            f"Tijdstip melding: {first.created_at.strftime('%H:%M')}"
+        )
+    else:
+        subject = f"LET OP: {len(alerts)} medicaties nog niet ingenomen"
+        lines = "\n".join(
+            f"- {alert.created_at.strftime('%H:%M')} {alert.patient_name}: '{alert.medication_name}'"
+            for alert in alerts
+        )
+        body = (
+            f"Dag,\n\n"
+            f"De volgende medicatie is nog niet als 'ingenomen' gemeld:\n\n"
+            f"{lines}\n\n"
+            f"Controleer of de medicatie alsnog ingenomen kan worden."
+        )
+
+    msg = MIMEText(body)
+    msg["Subject"], msg["From"], msg["To"] = subject, sender, first.to_email
+    return msg
+
+
+# --------------------
+# Outbound alert queue
+# --------------------
+class AlertQueue:
+    """
+    Delivers alert emails from a background thread over one reused SMTP connection.
+
+    Alerts for the same caregiver that arrive within `digest_window` seconds are
+    merged into a single digest email. Failed sends are retried with exponential
+    backoff (`retry_backoff` seconds, doubled per attempt) up to `max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        sender: Optional[str],
+        password: Optional[str],
+        use_starttls: bool = True,
+        digest_window: float = 60.0,
+        max_attempts: int = 5,
+        retry_backoff: float = 2.0,
+        timeout: float = 30.0,
+    ):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.password = password
+        self.use_starttls = use_starttls
+        self.digest_window = digest_window
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+
+        self._outbox: List[tuple] = []  # (ready_at, seq, batch)
+        self._open_batches: Dict[str, _Batch] = {}  # batches still collecting alerts
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._smtp: Optional[smtplib.SMTP] = None
+
+        self._stats = {
+            "alerts_queued": 0,
+            "emails_sent": 0,
+            "alerts_sent": 0,
+            "send_failures": 0,
+            "alerts_dropped": 0,
+            "last_send_seconds": 0.0,
+            "total_send_seconds": 0.0,
+            "max_send_seconds": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "AlertQueue":
+        """Configure from SMTP_* / EMAIL_* / ALERT_* environment variables."""
+        return cls(
+            host=os.getenv("SMTP_HOST", "smtp.gmail.com"),
+            port=int(os.getenv("SMTP_PORT", "587")),
+            sender=os.getenv("EMAIL_ADDRESS"),
+            password=os.getenv("EMAIL_PASSWORD"),
+            use_starttls=os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes"),
+            digest_window=float(os.getenv("ALERT_DIGEST_WINDOW_SECONDS", "60")),
+            max_attempts=int(os.getenv("ALERT_MAX_ATTEMPTS", "5")),
+            retry_backoff=float(os.getenv("ALERT_RETRY_BACKOFF_SECONDS", "2")),
+        )
+
+    # ---- producer side ----
+    def enqueue(self, to_email: str, patient_name: str, medication_name: str) -> bool:
+        """Queue an alert. Returns False when no sender address is configured."""
+        if not self.sender:
+            print("❌ EMAIL_ADDRESS missing in environment.")
+            return False
+
+        alert = Alert(to_email, patient_name, medication_name)
+        with self._cond:
+            self._stats["alerts_queued"] += 1
+            batch = self._open_batches.get(to_email)
+            if batch is not None:
+                batch.alerts.append(alert)
+                return True
+
+            batch = _Batch(to_email, [alert])
+            self._open_batches[to_email] = batch
+            heapq.heappush(self._outbox, (timer.monotonic() + self.digest_window, next(self._seq), batch))
+            self._cond.notify()
+        return True
+
+    def stats(self) -> Dict[str, float]:
+        """Queue depth, delivery counters and send latency (seconds)."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats["queue_depth"] = sum(len(batch.alerts) for _, _, batch in self._outbox)
+            stats["pending_emails"] = len(self._outbox)
+        stats["avg_send_seconds"] = (
+            stats["total_send_seconds"] / stats["emails_sent"] if stats["emails_sent"] else 0.0
+        )
+        return stats
+
+    # ---- lifecycle ----
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="alert-sender", daemon=True)
+        self._thread.start()
+
+    def shutdown(self, timeout: float = 10.0) -> None:
+        """Stop the sender after flushing batches that are still collecting."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self._disconnect()
+
+    # ---- sender side ----
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._outbox:
+                    if self._stopped:
+                        return
+                    self._cond.wait()
+                    continue
+
+                ready_at, _, batch = self._outbox[0]
+                delay = ready_at - timer.monotonic()
+                if delay > 0 and not self._stopped:
+                    self._cond.wait(delay)
+                    continue
+
+                heapq.heappop(self._outbox)
+                # Later alerts for this caregiver start a new batch
+                if self._open_batches.get(batch.to_email) is batch:
+                    del self._open_batches[batch.to_email]
+
+            self._deliver(batch)
+
+    def _deliver(self, batch: _Batch) -> None:
+        started = timer.perf_counter()
+        try:
+            self._send(compose_alert_message(batch.alerts, self.sender))
+        except Exception as e:
+            self._disconnect()
+            batch.attempt += 1
+            with self._cond:
+                self._stats["send_failures"] += 1
+                if batch.attempt >= self.max_attempts or self._stopped:
+                    self._stats["alerts_dropped"] += len(batch.alerts)
+                    print(f"❌ Email failed to {batch.to_email}, giving up after {batch.attempt} attempts: {e}")
+                    return
+                backoff = self.retry_backoff * 2 ** (batch.attempt - 1)
+                heapq.heappush(self._outbox, (timer.monotonic() + backoff, next(self._seq), batch))
+            print(f"❌ Email failed to {batch.to_email}, retrying in {backoff:g}s: {e}")
+            return
+
+        elapsed = timer.perf_counter() - started
+        metrics.alert_send_duration.observe(elapsed)
+        with self._cond:
+            self._stats["emails_sent"] += 1
+            self._stats["alerts_sent"] += len(batch.alerts)
+            self._stats["last_send_seconds"] = elapsed
+            self._stats["total_send_seconds"] += elapsed
+            self._stats["max_send_seconds"] = max(self._stats["max_send_seconds"], elapsed)
+        print(f"✅ Email successfully sent to {batch.to_email} ({len(batch.alerts)} alert(s))")
+
+    def _send(self, msg: MIMEText) -> None:
+        """Send over the pooled connection, reconnecting once if the server dropped it."""
+        try:
+            self._connection().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self._disconnect()
+            self._connection().send_message(msg)
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            try:
+                if self.use_starttls:
+                    smtp.starttls()
+                if self.password:
+                    smtp.login(self.sender, self.password)
+            except Exception:
+                smtp.close()
+                raise
+            self._smtp = smtp
+        return self._smtp
+
+    def _disconnect(self) -> None:
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            self._smtp.close()
+        self._smtp = None
@@ -0,0 +1,261 @@
+"""
+Query budgets and N+1 detection.
+
+Every statement executed on an instrumented engine is handed to the recorders
+active in the current context. A recorder keeps the statements of one request
+or job, grouped by shape (whitespace and IN-list lengths normalized), so a
+statement repeated with different parameters, the N+1 pattern, stands out.
+
+- Tests wrap code in `with query_budget(5):` or declare budgets per endpoint
+  with `with enforce_budgets({"GET /api/patient_schedule": 4}):`; both raise
+  QueryBudgetExceeded listing the statements and where they were issued.
+- With QUERY_DEBUG on, `QueryBudgetMiddleware` and `track()` log every request
+  or job over QUERY_DEBUG_MAX_QUERIES, or repeating one shape at least
+  QUERY_REPEAT_THRESHOLD times, with the call sites of the statements.
+
+Without QUERY_DEBUG or an active budget nothing is recorded.
+"""
+import contextvars
+import os
+import re
+import sys
+import threading
+import time as timer
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+
+QUERY_DEBUG = os.getenv("QUERY_DEBUG", "false").lower() in ("1", "true", "yes")
+QUERY_DEBUG_MAX_QUERIES = int(os.getenv("QUERY_DEBUG_MAX_QUERIES", "20"))
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+_BACKEND_DIR = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_THIS_FILE = os.path.abspath(__file__)
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|\$\d+|:\w+))+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def statement_shape(statement: str) -> str:
+    """The statement with whitespace collapsed and `IN (?, ?, ...)` lists reduced to one placeholder."""
+    return _IN_LIST.sub("(?)", _WHITESPACE.sub(" ", statement).strip())
+
+
+def _app_site(frame) -> Optional[str]:
+    while frame is not None:
+        filename = os.path.abspath(frame.f_code.co_filename)
+        if (filename.startswith(_BACKEND_DIR) and filename != _THIS_FILE
+                and f"{os.sep}site-packages{os.sep}" not in filename and f"{os.sep}.venv{os.sep}" not in filename):
+            return f"{os.path.relpath(filename, _BACKEND_DIR)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def call_site() -> str:
+    """Innermost backend frame that led to the current statement."""
+    site = _app_site(sys._getframe(1))
+    if site is None:
+        # Async sessions run the statement in a greenlet; the awaiting coroutine is on the parent's stack
+        try:
+            import greenlet
+        except ImportError:
+            return "unknown"
+        current = greenlet.getcurrent()
+        while site is None and current.parent is not None:
+            current = current.parent
+            site = _app_site(current.gr_frame)
+    return site or "unknown"
+
+
+# --------------------
+# Recording
+# --------------------
+class QueryRecorder:
+    """Statements executed while this recorder was active."""
+
+    def __init__(self, name: str, capture_sites: bool = True):
+        self.name = name
+        self.capture_sites = capture_sites
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Counter = Counter()
+        self.sites: Dict[str, Counter] = defaultdict(Counter)  # shape -> call site -> count
+
+    def record(self, statement: str, elapsed: float, site: Optional[str]) -> None:
+        shape = statement_shape(statement)
+        self.count += 1
+        self.seconds += elapsed
+        self.shapes[shape] += 1
+        if site:
+            self.sites[shape][site] += 1
+
+    def repeated(self, threshold: int = QUERY_REPEAT_THRESHOLD) -> List[Tuple[str, int]]:
+        """Statement shapes executed at least `threshold` times, most frequent first."""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+    def report(self, max_queries: Optional[int] = None, repeat_threshold: Optional[int] = None) -> str:
+        lines = [f"{self.name}: {self.count} queries in {self.seconds * 1000:.1f} ms"
+                 + (f" (budget {max_queries})" if max_queries is not None else "")]
+        shapes = self.repeated(repeat_threshold) if repeat_threshold else self.shapes.most_common()
+        for shape, count in shapes:
+            lines.append(f"  {count}x {shape[:160]}")
+            for site, site_count in self.sites.get(shape, {}).items():
+                lines.append(f"      {site_count}x {site}")
+        return "\n".join(lines)
+
+
+_recorders: "contextvars.ContextVar[Tuple[QueryRecorder, ...]]" = contextvars.ContextVar("query_recorders", default=())
+
+
+@contextmanager
+def recording(name: str, capture_sites: bool = True) -> Iterator[QueryRecorder]:
+    """Record the statements executed in this block (and in any recorders around it)."""
+    recorder = QueryRecorder(name, capture_sites)
+    token = _recorders.set(_recorders.get() + (recorder,))
+    try:
+        yield recorder
+    finally:
+        _recorders.reset(token)
+
+
+def instrument_engine(engine) -> None:
+    """Feed statements on a (sync) Engine to the active recorders; pass `async_engine.sync_engine` for async engines."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if _recorders.get():
+            context._query_budget_started = timer.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        recorders = _recorders.get()
+        if not recorders:
+            return
+        elapsed = timer.perf_counter() - getattr(context, "_query_budget_started", timer.perf_counter())
+        site = call_site() if any(recorder.capture_sites for recorder in recorders) else None
+        for recorder in recorders:
+            recorder.record(statement, elapsed, site)
+
+
+# --------------------
+# Budgets
+# --------------------
+def check(recorder: QueryRecorder, max_queries: Optional[int], max_repeats: Optional[int]) -> Optional[str]:
+    """A report if the recorder went over either limit, else None."""
+    if max_queries is not None and recorder.count > max_queries:
+        return recorder.report(max_queries)
+    if max_repeats is not None and recorder.repeated(max_repeats + 1):
+        return recorder.report(max_queries, max_repeats + 1)
+    return None
+
+
+@contextmanager
+def query_budget(max_queries: Optional[int] = None, max_repeats: Optional[int] = None, name: str = "block"):
+    """
+    Fail with QueryBudgetExceeded if the block runs more than `max_queries`
+    statements, or any one statement shape more than `max_repeats` times.
+
+    Only sees statements run in this context: code called directly, or an app
+    driven through httpx.ASGITransport. For TestClient use `enforce_budgets`.
+    """
+    with recording(name) as recorder:
+        yield recorder
+    problem = check(recorder, max_queries, max_repeats)
+    if problem:
+        raise QueryBudgetExceeded(problem)
+
+
+class _Budgets:
+    """Budgets per endpoint ("GET /api/patients/{patient_id}/medications") or job ("job missed_dose_check")."""
+
+    def __init__(self):
+        self.limits: Dict[str, Tuple[Optional[int], Optional[int]]] = {}
+        self.violations: List[str] = []
+        self._lock = threading.Lock()
+
+    def limit(self, key: str) -> Optional[Tuple[Optional[int], Optional[int]]]:
+        return self.limits.get(key) or self.limits.get("*")
+
+    def violated(self, report: str) -> None:
+        with self._lock:
+            self.violations.append(report)
+
+
+_budgets: Optional[_Budgets] = None
+
+
+@contextmanager
+def enforce_budgets(limits: Dict[str, object], max_repeats: Optional[int] = None):
+    """
+    Apply budgets to requests and tracked jobs anywhere in this process (any
+    thread, so it works with TestClient) and raise QueryBudgetExceeded at the
+    end of the block if one was exceeded. `limits` maps "METHOD /route/template"
+    or "job name" (or "*" for everything) to a query count or a
+    (max_queries, max_repeats) tuple; `max_repeats` is the default for the latter.
+    """
+    global _budgets
+    budgets = _Budgets()
+    for key, value in limits.items():
+        budgets.limits[key] = value if isinstance(value, tuple) else (value, max_repeats)
+    previous, _budgets = _budgets, budgets
+    try:
+        yield budgets
+    finally:
+        _budgets = previous
+    if budgets.violations:
+        raise QueryBudgetExceeded("\n".join(budgets.violations))
+
+
+def _finish(key: str, recorder: QueryRecorder) -> None:
+    budgets = _budgets
+    limit = budgets.limit(key) if budgets else None
+    if limit is not None:
+        problem = check(recorder, *limit)
+        if problem:
+            budgets.violated(problem)
+    if QUERY_DEBUG:
+        problem = check(recorder, QUERY_DEBUG_MAX_QUERIES, QUERY_REPEAT_THRESHOLD - 1)
+        if problem:
+            print(f"⚠️ Query budget: {problem}")
+
+
+def _active() -> bool:
+    return QUERY_DEBUG or _budgets is not None
+
+
+@contextmanager
+def track(job: str):
+    """Apply budgets (and QUERY_DEBUG logging) to a background job, under the key "job <name>"."""
+    if not _active():
+        yield None
+        return
+    key = f"job {job}"
+    with recording(key) as recorder:
+        yield recorder
+    _finish(key, recorder)
+
+
+class QueryBudgetMiddleware:
+    """ASGI middleware applying budgets per "METHOD /route/template"; a no-op unless QUERY_DEBUG or enforce_budgets is on."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _active():
+            await self.app(scope, receive, send)
+            return
+
+        with recording(f"{scope['method']} {scope['path']}") as recorder:
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                key = f"{scope['method']} {route}"
+                recorder.name = f"{key} ({scope['path']})" if route != scope["path"] else key
+                _finish(key, recorder)
@@ -0,0 +1,143 @@
+"""
+Normalized schedule slots.
+
+`schedule_slots` mirrors every medication's `schedule` JSON as one row per
+(weekday, minute_of_day), so "what is due between 08:00 and 08:15 on Tuesday"
+is an index range scan instead of parsing every schedule in Python. Medication
+writes keep it in sync; existing databases are filled in at startup, or in
+full with:
+
+    python -m schedule_slots rebuild
+"""
+import argparse
+import math
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+load_dotenv()
+
+from database import Medication, ScheduleSlot, get_db, init_db
+from dose_timer import DAY_NAMES, DueDose, day_times
+
+REBUILD_BATCH_SIZE = 1000
+
+
+def slot_rows(medication_id: int, schedule: Optional[dict]) -> List[dict]:
+    """Slot rows for one medication's schedule (duplicate times collapse to one slot)."""
+    rows = {}
+    for weekday, day_name in enumerate(DAY_NAMES):
+        for parsed, time_str in day_times(schedule, day_name):
+            minute_of_day = parsed.hour * 60 + parsed.minute
+            rows.setdefault((weekday, minute_of_day), {
+                "medication_id": medication_id,
+                "weekday": weekday,
+                "minute_of_day": minute_of_day,
+                "time_str": time_str,
+            })
+    return list(rows.values())
+
+
+# --------------------
+# Keeping slots in sync
+# --------------------
+async def replace_slots(db: AsyncSession, medication_id: int, schedule: Optional[dict]) -> None:
+    """Rewrite a medication's slots in the caller's transaction."""
+    await delete_slots(db, medication_id)
+    await add_slots(db, [(medication_id, schedule)])
+
+
+async def add_slots(db: AsyncSession, medications: Iterable[Tuple[int, Optional[dict]]]) -> None:
+    """Insert slots for newly created medications, in the caller's transaction."""
+    rows = [row for medication_id, schedule in medications for row in slot_rows(medication_id, schedule)]
+    if rows:
+        await db.execute(ScheduleSlot.__table__.insert(), rows)
+
+
+async def delete_slots(db: AsyncSession, medication_id: int) -> None:
+    await db.execute(delete(ScheduleSlot).where(ScheduleSlot.medication_id == medication_id))
+
+
+def backfill_missing(db: Session) -> int:
+    """Create slots for medications that have none yet (databases from before schedule_slots)."""
+    has_slots = select(ScheduleSlot.id).where(ScheduleSlot.medication_id == Medication.id).exists()
+    medications = db.execute(select(Medication.id, Medication.schedule).where(~has_slots)).all()
+    rows = [row for medication_id, schedule in medications for row in slot_rows(medication_id, schedule)]
+    for i in range(0, len(rows), REBUILD_BATCH_SIZE):
+        db.execute(ScheduleSlot.__table__.insert(), rows[i:i + REBUILD_BATCH_SIZE])
+    db.commit()
+    return len(rows)
+
+
+def rebuild(db: Session) -> int:
+    """Recreate every slot from Medication.schedule in one transaction."""
+    db.execute(delete(ScheduleSlot))
+    count = 0
+    result = db.execute(select(Medication.id, Medication.schedule).execution_options(yield_per=REBUILD_BATCH_SIZE))
+    for medications in result.partitions():
+        rows = [row for medication_id, schedule in medications for row in slot_rows(medication_id, schedule)]
+        if rows:
+            db.execute(ScheduleSlot.__table__.insert(), rows)
+        count += len(rows)
+    db.commit()
+    return count
+
+
+# --------------------
+# Due-window lookups
+# --------------------
+def minute_ranges(start: datetime, end: datetime) -> List[Tuple[datetime, int, int]]:
+    """Split [start, end] into (midnight, first_minute, last_minute) per calendar day."""
+    ranges = []
+    day = datetime.combine(start.date(), datetime.min.time())
+    while day <= end:
+        first = max(start, day)
+        last = min(end, day + timedelta(days=1) - timedelta(microseconds=1))
+        # Whole minutes inside [first, last]
+        first_minute = math.ceil((first - day).total_seconds() / 60)
+        last_minute = math.floor((last - day).total_seconds() / 60)
+        if first_minute <= last_minute:
+            ranges.append((day, first_minute, last_minute))
+        day += timedelta(days=1)
+    return ranges
+
+
+def find_scheduled_between(db: Session, start: datetime, end: datetime) -> List[DueDose]:
+    """Doses of active medications scheduled in [start, end], as index range queries on schedule_slots."""
+    doses = []
+    for day, first_minute, last_minute in minute_ranges(start, end):
+        rows = db.execute(
+            select(ScheduleSlot.medication_id, Medication.patient_id, ScheduleSlot.time_str, ScheduleSlot.minute_of_day)
+            .join(Medication, Medication.id == ScheduleSlot.medication_id)
+            .where(
+                ScheduleSlot.weekday == day.weekday(),
+                ScheduleSlot.minute_of_day.between(first_minute, last_minute),
+                Medication.is_active == True,
+            )
+            .order_by(ScheduleSlot.minute_of_day, ScheduleSlot.medication_id)
+        )
+        for medication_id, patient_id, time_str, minute_of_day in rows:
+            doses.append(DueDose(medication_id, patient_id, time_str, day + timedelta(minutes=minute_of_day)))
+    return doses
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Schedule slot maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("rebuild", help="Recreate all slots from Medication.schedule")
+    parser.parse_args()
+
+    init_db()
+    db = next(get_db())
+    try:
+        print(f"Rebuilt {rebuild(db)} schedule slots")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import PatientScheduleVersion, User
+
+SCHEDULE_CACHE_MAX_ENTRIES = 5000
+
+
+# --------------------
+# Per-patient schedule versions
+# --------------------
+def bump_version_statement(dialect_name: str, patient_id: int):
+    """Upsert incrementing a patient's schedule version; run it in the medication write's transaction."""
+    dialect = postgresql if dialect_name == "postgresql" else sqlite
+    stmt = dialect.insert(PatientScheduleVersion).values(patient_id=patient_id, version=1)
+    return stmt.on_conflict_do_update(
+        index_elements=["patient_id"],
+        set_={"version": PatientScheduleVersion.version + 1},
+    )
+
+
+async def current_version(db: AsyncSession, patient_id: int) -> Optional[int]:
+    """The patient's schedule version (0 before the first write), or None if the patient doesn't exist."""
+    row = (
+        await db.execute(
+            select(func.coalesce(PatientScheduleVersion.version, 0))
+            .select_from(User)
+            .outerjoin(PatientScheduleVersion, PatientScheduleVersion.patient_id == User.id)
+            .where(User.id == patient_id)
+        )
+    ).first()
+    return row[0] if row else None
+
+
+def schedule_etag(patient_id: int, version: int) -> str:
+    return f'"{patient_id}-{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check (weak comparison, as RFC 9110 prescribes for this header)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+# --------------------
+# Serialized response cache
+# --------------------
+class ResponseCache:
+    """
+    Bounded LRU cache of serialized JSON bodies keyed by (view, patient_id, version).
+
+    A version bump changes the key, so entries never need invalidating; entries
+    of superseded versions simply age out.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, int, int], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, view: str, patient_id: int, version: int) -> Optional[bytes]:
+        key = (view, patient_id, version)
+        with self._lock:
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, view: str, patient_id: int, version: int, body: bytes) -> None:
+        key = (view, patient_id, version)
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+schedule_cache = ResponseCache(SCHEDULE_CACHE_MAX_ENTRIES)
@@ -0,0 +1,182 @@
+"""
+Standalone missed-medication scheduler.
+
+Run one (or more, for failover) next to the web workers:
+
+    python -m scheduler
+
+Every instance competes for a lease row in `scheduler_leases`; only the
+holder runs the dose timer engine, so the checker runs exactly once no matter
+how many schedulers or web workers are started. Set RUN_SCHEDULER_IN_PROCESS=true
+to run the same service inside the web process instead (single-node setups).
+"""
+import os
+import signal
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from dotenv import load_dotenv
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+load_dotenv()
+
+from database import get_db, init_db, SchedulerLease
+import intake_archive
+import metrics
+import missed_doses
+import schedule_slots
+
+LEASE_NAME = "missed-medication-checker"
+LEASE_TTL_SECONDS = int(os.getenv("SCHEDULER_LEASE_TTL_SECONDS", "30"))
+LEASE_RENEW_SECONDS = int(os.getenv("SCHEDULER_LEASE_RENEW_SECONDS", "10"))
+CHANGE_POLL_SECONDS = int(os.getenv("SCHEDULER_CHANGE_POLL_SECONDS", "5"))
+METRICS_PORT = int(os.getenv("SCHEDULER_METRICS_PORT", "0"))  # 0: don't serve /metrics
+NOTIFIED_CLEANUP_MINUTES = 60
+
+
+# --------------------
+# Leader lease
+# --------------------
+def try_acquire_lease(holder: str, name: str = LEASE_NAME, ttl_seconds: int = LEASE_TTL_SECONDS) -> bool:
+    """Take or renew the lease. Succeeds if we hold it already or the previous holder's lease expired."""
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl_seconds)
+
+    db = next(get_db())
+    try:
+        result = db.execute(
+            update(SchedulerLease)
+            .where(
+                SchedulerLease.name == name,
+                (SchedulerLease.holder == holder) | (SchedulerLease.expires_at < now),
+            )
+            .values(holder=holder, expires_at=expires_at)
+        )
+        if result.rowcount == 0:
+            try:
+                db.execute(insert(SchedulerLease).values(name=name, holder=holder, expires_at=expires_at))
+            except IntegrityError:
+                db.rollback()
+                return False
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def release_lease(holder: str, name: str = LEASE_NAME) -> None:
+    db = next(get_db())
+    try:
+        db.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == name, SchedulerLease.holder == holder)
+            .values(expires_at=datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+# --------------------
+# Scheduler service
+# --------------------
+class MissedDoseScheduler:
+    """Runs the missed-medication checker while holding the leader lease."""
+
+    def __init__(self):
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._lease_expires_at = datetime.min
+        self._jobs = BackgroundScheduler()
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        self._jobs.add_job(
+            self._heartbeat, "interval", seconds=LEASE_RENEW_SECONDS, next_run_time=datetime.now(),
+            max_instances=1, coalesce=True,
+        )
+        self._jobs.start()
+        print(f"Missed medication scheduler {self.holder} started")
+
+    def shutdown(self) -> None:
+        self._jobs.shutdown()
+        with self._lock:
+            if self.is_leader:
+                self._demote()
+                release_lease(self.holder)
+        print("Scheduler stopped")
+
+    def _heartbeat(self) -> None:
+        try:
+            leader = try_acquire_lease(self.holder)
+            if leader:
+                self._lease_expires_at = datetime.utcnow() + timedelta(seconds=LEASE_TTL_SECONDS)
+        except Exception as e:
+            print(f"❌ Scheduler lease check failed: {e}")
+            # Keep leading on a transient error until our lease would have expired
+            leader = self.is_leader and datetime.utcnow() < self._lease_expires_at
+
+        with self._lock:
+            if leader and not self.is_leader:
+                self._promote()
+            elif not leader and self.is_leader:
+                print(f"Scheduler {self.holder} lost the lease")
+                self._demote()
+
+    def _promote(self) -> None:
+        print(f"Scheduler {self.holder} is now the leader; missed medication checker started")
+        missed_doses.alert_queue.start()
+        missed_doses.rebuild_dose_engine()
+        missed_doses.dose_engine.start()
+        self._jobs.add_job(
+            missed_doses.poll_medication_changes, "interval", seconds=CHANGE_POLL_SECONDS,
+            id="poll_medication_changes", max_instances=1, coalesce=True,
+        )
+        self._jobs.add_job(
+            missed_doses.cleanup_notified_medications, "interval", minutes=NOTIFIED_CLEANUP_MINUTES,
+            id="cleanup_notified_medications",
+        )
+        if intake_archive.INTAKE_ARCHIVE_AFTER_DAYS > 0:
+            self._jobs.add_job(
+                intake_archive.archive_old_intakes, "cron", hour=intake_archive.INTAKE_ARCHIVE_HOUR,
+                kwargs={"should_stop": lambda: not self.is_leader},
+                id="archive_old_intakes", max_instances=1, coalesce=True,
+            )
+        self.is_leader = True
+
+    def _demote(self) -> None:
+        print(f"Scheduler {self.holder} stepped down; missed medication checker stopped")
+        for job_id in ("poll_medication_changes", "cleanup_notified_medications", "archive_old_intakes"):
+            if self._jobs.get_job(job_id):
+                self._jobs.remove_job(job_id)
+        missed_doses.dose_engine.shutdown()
+        missed_doses.shutdown_check_pool()
+        missed_doses.alert_queue.shutdown()
+        self.is_leader = False
+
+
+def main() -> None:
+    init_db()
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT)
+    db = next(get_db())
+    try:
+        schedule_slots.backfill_missing(db)
+    finally:
+        db.close()
+    service = MissedDoseScheduler()
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    service.start()
+    stop.wait()
+    service.shutdown()
+
+
+if __name__ == "__main__":
+    main()
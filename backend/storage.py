@@ -0,0 +1,114 @@
+import os
+from typing import Any, Dict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+# --------------------
+# Storage configuration (environment)
+# --------------------
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+# Optional async driver URL; derived from DATABASE_URL when empty
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "")
+# Optional replica for scheduler/reporting reads; defaults to DATABASE_URL
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 disables
+
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+
+# Async drivers used when ASYNC_DATABASE_URL is not set
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+def async_url(url: str) -> str:
+    """Return the async-driver variant of a sync database URL."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if parsed.get_driver_name() in ASYNC_DRIVERS.values():
+        return url
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver known for '{backend}', set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+def engine_options(url: str, is_async: bool = False) -> Dict[str, Any]:
+    """Pool and connect arguments for `url`."""
+    parsed = make_url(url)
+    options: Dict[str, Any] = {}
+
+    if parsed.get_backend_name() == "sqlite":
+        if not is_async:
+            options["connect_args"] = {"check_same_thread": False}
+        if parsed.database in (None, "", ":memory:"):
+            # In-memory databases live in a single connection; keep SQLAlchemy's default pool
+            return options
+
+    options.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=parsed.get_backend_name() != "sqlite",
+    )
+    return options
+
+
+def _sqlite_pragmas(read_only: bool):
+    pragmas = [
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}",
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",  # negative = KiB
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only=ON")
+    return pragmas
+
+
+def configure_connections(engine: Engine, url: str, read_only: bool = False) -> None:
+    """Apply per-connection settings: SQLite pragmas, or a read-only session on server databases."""
+    backend = make_url(url).get_backend_name()
+
+    if backend == "sqlite":
+        pragmas = _sqlite_pragmas(read_only)
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, _record):
+            cursor = dbapi_connection.cursor()
+            for pragma in pragmas:
+                cursor.execute(pragma)
+            cursor.close()
+
+    elif read_only and backend == "postgresql":
+        @event.listens_for(engine, "connect")
+        def set_read_only(dbapi_connection, _record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+            cursor.close()
+            dbapi_connection.commit()
+
+
+def build_engine(url: str, read_only: bool = False) -> Engine:
+    engine = create_engine(url, **engine_options(url))
+    configure_connections(engine, url, read_only=read_only)
+    return engine
+
+
+def build_async_engine(url: str, read_only: bool = False) -> AsyncEngine:
+    engine = create_async_engine(url, **engine_options(url, is_async=True))
+    configure_connections(engine.sync_engine, url, read_only=read_only)
+    return engine
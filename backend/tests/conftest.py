@@ -0,0 +1,73 @@
+"""
+Shared fixtures: the app on a scratch SQLite database, with the seeded users.
+
+The environment is set before anything from the backend is imported, so the
+engines point at the scratch database and no email is ever sent.
+"""
+import os
+import sys
+import tempfile
+import time
+
+_scratch = tempfile.mkdtemp(prefix="medication-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_scratch}/test.db"
+os.environ["EMAIL_ADDRESS"] = ""
+os.environ["EMAIL_PASSWORD"] = ""
+os.environ["RUN_SCHEDULER_IN_PROCESS"] = "false"
+os.environ["BCRYPT_ROUNDS"] = "4"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+import auth
+import main
+from database import SessionLocal, User
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def bearer(username: str) -> dict:
+    return {"Authorization": f"Bearer {auth.create_access_token({'sub': username})}"}
+
+
+@pytest.fixture(scope="session")
+def caregiver_headers(client) -> dict:
+    return bearer("mantelzorger1")
+
+
+@pytest.fixture(scope="session")
+def patient_headers(client) -> dict:
+    return bearer("patient1")
+
+
+@pytest.fixture(scope="session")
+def patient_id(client) -> int:
+    session = SessionLocal()
+    try:
+        return session.query(User.id).filter(User.username == "patient1").scalar()
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def far_east(monkeypatch):
+    """Run with local time 14 hours ahead of UTC, so local and UTC dates differ for most of the day."""
+    monkeypatch.setenv("TZ", "Pacific/Kiritimati")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
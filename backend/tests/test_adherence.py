@@ -0,0 +1,106 @@
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+import adherence
+from database import DailyAdherence, Medication, MissedDoseNotification
+
+EVERY_DAY = {
+    day: {"enabled": True, "times": ["08:00", "20:00"]}
+    for day in ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+}
+
+
+def add_medication(db, patient_id: int, name: str, **fields) -> int:
+    medication = Medication(
+        patient_id=patient_id, name=name, dosage="1mg", schedule=fields.pop("schedule", EVERY_DAY),
+        start_date=fields.pop("start_date", datetime(2020, 1, 1)), **fields,
+    )
+    db.add(medication)
+    db.commit()
+    return medication.id
+
+
+def test_backfill_counts_active_medications_within_their_dates(client, db, patient_id):
+    start, end = date(2024, 3, 4), date(2024, 3, 10)
+    active = add_medication(db, patient_id, "Backfill active")
+    inactive = add_medication(db, patient_id, "Backfill inactive", is_active=False)
+    later = add_medication(db, patient_id, "Backfill later", start_date=datetime(2024, 3, 8, 9, 30))
+    ended = add_medication(db, patient_id, "Backfill ended", end_date=datetime(2024, 3, 5))
+
+    adherence.backfill(db, start, end, today=date(2024, 6, 1))
+
+    scheduled = {}
+    for row in db.query(DailyAdherence).filter(DailyAdherence.date >= start, DailyAdherence.date <= end):
+        scheduled[row.medication_id] = scheduled.get(row.medication_id, 0) + row.scheduled
+    assert scheduled.get(active) == 14
+    assert inactive not in scheduled
+    assert scheduled.get(later) == 6
+    assert scheduled.get(ended) == 4
+
+
+def test_deleting_a_medication_keeps_its_adherence_history(client, db, caregiver_headers, patient_id):
+    medication_id = add_medication(db, patient_id, "Deleted later")
+    day = date(2024, 4, 2)
+    db.execute(adherence.increment_statement(
+        db.get_bind().dialect.name, patient_id, medication_id, day, scheduled=2, taken=1, missed=1,
+    ))
+    db.commit()
+
+    response = client.delete(f"/api/medications/{medication_id}", headers=caregiver_headers)
+    assert response.status_code == 200
+
+    report = client.get(
+        f"/api/patients/{patient_id}/adherence",
+        params={"start_date": day.isoformat(), "end_date": day.isoformat()},
+        headers=caregiver_headers,
+    ).json()
+    assert report["scheduled"] == 2 and report["taken"] == 1
+    assert [m["medication_name"] for m in report["medications"] if m["medication_id"] == medication_id] == ["Unknown"]
+
+
+def test_deleting_a_medication_drops_its_missed_dose_notifications(client, db, caregiver_headers, patient_id):
+    medication_id = add_medication(db, patient_id, "Deleted after alert")
+    db.add(MissedDoseNotification(
+        scheduled_date=date(2024, 4, 2), medication_id=medication_id, patient_id=patient_id, scheduled_time="08:00",
+    ))
+    db.commit()
+
+    assert client.delete(f"/api/medications/{medication_id}", headers=caregiver_headers).status_code == 200
+
+    db.expire_all()
+    assert db.query(MissedDoseNotification).filter_by(medication_id=medication_id).count() == 0
+    # SQLite doesn't enforce foreign keys, but reports rows that would violate them
+    assert db.execute(text("PRAGMA foreign_key_check(missed_dose_notifications)")).all() == []
+
+
+def test_deleted_medication_ids_are_not_reused(client, db, caregiver_headers, patient_id):
+    deleted = add_medication(db, patient_id, "Deleted last")
+    assert client.delete(f"/api/medications/{deleted}", headers=caregiver_headers).status_code == 200
+    assert add_medication(db, patient_id, "Created after") > deleted
+
+
+def test_intakes_count_on_their_utc_day(client, db, patient_headers, patient_id, far_east):
+    medication_id = add_medication(db, patient_id, "UTC day")
+    response = client.post(
+        "/api/medication_intakes", json={"medication_name": "UTC day", "scheduled_time": "08:00"}, headers=patient_headers,
+    )
+    assert response.status_code == 200, response.text
+
+    taken_day = datetime.fromisoformat(response.json()["taken_at"]).date()
+    rows = db.query(DailyAdherence.date, DailyAdherence.taken).filter(DailyAdherence.medication_id == medication_id)
+    assert [tuple(row) for row in rows] == [(taken_day, 1)]
+
+
+def test_backfill_counts_scheduled_doses_on_their_utc_day(client, db, patient_id, far_east):
+    # Monday 08:00 and 20:00 in UTC+14 are Sunday 18:00 and Monday 06:00 UTC
+    mondays = {"Monday": {"enabled": True, "times": ["08:00", "20:00"]}}
+    medication_id = add_medication(db, patient_id, "UTC backfill", schedule=mondays)
+    adherence.backfill(db, date(2024, 5, 4), date(2024, 5, 8), today=date(2024, 6, 1))
+
+    rows = dict(
+        db.query(DailyAdherence.date, DailyAdherence.scheduled)
+        .filter(DailyAdherence.medication_id == medication_id)
+        .all()
+    )
+    assert rows == {date(2024, 5, 5): 1, date(2024, 5, 6): 1}
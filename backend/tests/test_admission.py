@@ -0,0 +1,34 @@
+import admission
+from admission import forwarded_client_ip
+
+PROXIES = ["10.0.0.0/8", "192.168.1.5"]
+
+
+def test_forwarded_for_is_ignored_from_untrusted_peers():
+    assert forwarded_client_ip("203.0.113.7", "198.51.100.1", PROXIES) == "203.0.113.7"
+    assert forwarded_client_ip("10.0.0.2", "198.51.100.1", []) == "10.0.0.2"
+    assert forwarded_client_ip("testclient", "198.51.100.1", PROXIES) == "testclient"
+
+
+def test_client_is_the_rightmost_untrusted_hop():
+    # The client prepended a spoofed entry; the proxies appended the real address
+    assert forwarded_client_ip("10.0.0.2", "1.2.3.4, 198.51.100.1, 192.168.1.5", PROXIES) == "198.51.100.1"
+    assert forwarded_client_ip("10.0.0.2", "10.1.1.1, 10.0.0.3", PROXIES) == "10.1.1.1"
+    assert forwarded_client_ip("10.0.0.2", " , ", PROXIES) == "10.0.0.2"
+    assert forwarded_client_ip("10.0.0.2", None, PROXIES) == "10.0.0.2"
+
+
+def test_login_attempts_are_limited_per_forwarded_client(client, monkeypatch):
+    monkeypatch.setattr(admission, "FORWARDED_ALLOW_IPS", ["*"])
+    limiter = admission.auth_admission.by_ip
+    monkeypatch.setattr(limiter, "capacity", 1.0)
+    monkeypatch.setattr(limiter, "rate", 0.0)
+
+    def login(forwarded_for: str) -> int:
+        return client.post(
+            "/api/login", data={"username": "nobody", "password": "wrong"}, headers={"X-Forwarded-For": forwarded_for},
+        ).status_code
+
+    assert login("198.51.100.10") == 401
+    assert login("198.51.100.10") == 429
+    assert login("198.51.100.11") == 401
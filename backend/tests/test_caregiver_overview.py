@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+
+from adherence import utc_bounds
+from database import Medication, MedicationIntake
+
+EVERY_DAY = {
+    day: {"enabled": True, "times": ["08:00"]}
+    for day in ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+}
+
+
+def add_medication(db, patient_id: int, name: str, **fields) -> int:
+    medication = Medication(
+        patient_id=patient_id, name=name, dosage="1mg", schedule=fields.pop("schedule", EVERY_DAY),
+        start_date=datetime(2020, 1, 1), **fields,
+    )
+    db.add(medication)
+    db.commit()
+    return medication.id
+
+
+def overview_medications(client, headers, patient_id: int, **params) -> dict:
+    response = client.get("/api/caregiver/overview", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    [patient] = [patient for patient in response.json()["patients"] if patient["id"] == patient_id]
+    return {medication["id"]: medication for medication in patient["medications"]}
+
+
+def test_inactive_medications_are_listed_on_request_without_doses(client, db, caregiver_headers, patient_id):
+    active = add_medication(db, patient_id, "Overview active")
+    inactive = add_medication(db, patient_id, "Overview inactive", is_active=False)
+
+    medications = overview_medications(client, caregiver_headers, patient_id)
+    assert active in medications and inactive not in medications
+
+    medications = overview_medications(client, caregiver_headers, patient_id, include_inactive="true")
+    assert medications[active]["is_active"] and len(medications[active]["doses_today"]) == 1
+    assert not medications[inactive]["is_active"] and medications[inactive]["doses_today"] == []
+
+
+def test_intakes_since_local_midnight_count_as_taken_today(client, db, caregiver_headers, patient_id, far_east):
+    now = datetime.now()
+    dose_time = now.strftime("%H:%M")
+    every_day_now = {day: {"enabled": True, "times": [dose_time]} for day in EVERY_DAY}
+    medication_id = add_medication(db, patient_id, "Overview local day", schedule=every_day_now)
+    # taken_at is naive UTC; local midnight is 14 hours after UTC midnight here
+    day_start, _ = utc_bounds(now.date())
+    db.add(MedicationIntake(
+        medication_id=medication_id, patient_id=patient_id, scheduled_time=dose_time,
+        taken_at=day_start + timedelta(minutes=1), status="taken",
+    ))
+    db.commit()
+
+    [dose] = overview_medications(client, caregiver_headers, patient_id)[medication_id]["doses_today"]
+    assert dose["status"] == "taken"
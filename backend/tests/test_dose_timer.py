@@ -0,0 +1,61 @@
+import threading
+import time as timer
+from datetime import datetime, timedelta
+
+from dose_timer import DAY_NAMES, DoseTimerEngine
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = timer.monotonic() + timeout
+    while timer.monotonic() < deadline:
+        if condition():
+            return True
+        timer.sleep(0.01)
+    return condition()
+
+
+def overdue_schedule(minutes_ago: int) -> dict:
+    scheduled_at = datetime.now() - timedelta(minutes=minutes_ago)
+    return {DAY_NAMES[scheduled_at.weekday()]: {"enabled": True, "times": [scheduled_at.strftime("%H:%M")]}}
+
+
+class FlakyCheck:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, due):
+        with self.lock:
+            self.calls.append([dose.medication_id for dose in due])
+            if len(self.calls) <= self.failures:
+                raise RuntimeError("database is locked")
+
+
+def test_failed_check_is_retried_with_backoff():
+    check = FlakyCheck(failures=2)
+    engine = DoseTimerEngine(check, grace_period=timedelta(minutes=1), max_lateness=timedelta(minutes=30))
+    engine.retry_initial_seconds = 0.05
+    engine.schedule_medication(1, 10, overdue_schedule(minutes_ago=2))
+    engine.start()
+    try:
+        assert wait_for(lambda: len(check.calls) == 3)
+        assert check.calls == [[1], [1], [1]]
+        assert engine.retry_count() == 0
+    finally:
+        engine.shutdown()
+
+
+def test_dose_is_dropped_once_retry_would_be_too_late(capsys):
+    check = FlakyCheck(failures=1)
+    engine = DoseTimerEngine(check, grace_period=timedelta(minutes=1), max_lateness=timedelta(minutes=5))
+    engine.retry_initial_seconds = engine.retry_max_seconds = 600
+    engine.schedule_medication(1, 10, overdue_schedule(minutes_ago=2))
+    engine.start()
+    output = []
+    try:
+        assert wait_for(lambda: output.append(capsys.readouterr().out) or "Gave up" in "".join(output))
+        assert engine.retry_count() == 0
+        assert check.calls == [[1]]
+    finally:
+        engine.shutdown()
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from adherence import utc_bounds
+from database import Medication, MedicationIntake
+from due_doses import due_cache
+
+
+def add_dose_now(db, patient_id: int, name: str):
+    """A medication scheduled every day at the current local minute."""
+    dose_time = datetime.now().strftime("%H:%M")
+    schedule = {
+        day: {"enabled": True, "times": [dose_time]}
+        for day in ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+    }
+    medication = Medication(patient_id=patient_id, name=name, dosage="1mg", schedule=schedule, start_date=datetime(2020, 1, 1))
+    db.add(medication)
+    db.commit()
+    return medication.id, dose_time
+
+
+def due_medication_ids(client, headers) -> set:
+    response = client.get("/api/patient/due", params={"window_minutes": 720}, headers=headers)
+    assert response.status_code == 200, response.text
+    return {dose["medication_id"] for dose in response.json()["doses"]}
+
+
+def test_intakes_are_matched_to_the_local_day(client, db, patient_headers, patient_id, far_east):
+    # taken_at is naive UTC; local midnight is 14 hours after UTC midnight here
+    day_start, _ = utc_bounds(datetime.now().date())
+    taken_today, dose_time = add_dose_now(db, patient_id, "Due taken today")
+    taken_yesterday, _ = add_dose_now(db, patient_id, "Due taken yesterday")
+    db.add_all([
+        MedicationIntake(
+            medication_id=taken_today, patient_id=patient_id, scheduled_time=dose_time,
+            taken_at=day_start + timedelta(minutes=1), status="taken",
+        ),
+        MedicationIntake(
+            medication_id=taken_yesterday, patient_id=patient_id, scheduled_time=dose_time,
+            taken_at=day_start - timedelta(minutes=1), status="taken",
+        ),
+    ])
+    db.commit()
+    due_cache.invalidate(patient_id)
+
+    due = due_medication_ids(client, patient_headers)
+    assert taken_today not in due
+    assert taken_yesterday in due
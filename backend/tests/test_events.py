@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime
+
+from database import MedicationIntake, MissedDoseNotification
+from events import FeedCursor, relay_once
+
+
+def test_relay_publishes_rows_committed_out_of_id_order(client, db, patient_id):
+    last_intake = db.query(MedicationIntake.id).order_by(MedicationIntake.id.desc()).limit(1).scalar() or 0
+    last_notification = (
+        db.query(MissedDoseNotification.id).order_by(MissedDoseNotification.id.desc()).limit(1).scalar() or 0
+    )
+    intake_cursor, notification_cursor = FeedCursor(last_intake), FeedCursor(last_notification)
+    relayed = []
+
+    def intake(intake_id: int) -> MedicationIntake:
+        return MedicationIntake(
+            id=intake_id, medication_id=1, patient_id=patient_id, scheduled_time="08:00", taken_at=datetime.utcnow(),
+        )
+
+    # The transaction holding last_intake + 1 commits after the one holding last_intake + 2
+    db.add(intake(last_intake + 2))
+    db.add(MissedDoseNotification(
+        id=last_notification + 2, scheduled_date=datetime.utcnow().date(), medication_id=1,
+        patient_id=patient_id, scheduled_time="08:00",
+    ))
+    db.commit()
+    asyncio.run(relay_once(intake_cursor, notification_cursor, on_intake=relayed.append))
+    assert relayed == [patient_id]
+    assert intake_cursor.last_id == last_intake + 2 and last_intake + 1 in intake_cursor.missing
+
+    db.add(intake(last_intake + 1))
+    db.commit()
+    asyncio.run(relay_once(intake_cursor, notification_cursor, on_intake=relayed.append))
+    assert relayed == [patient_id, patient_id]
+    assert not intake_cursor.missing
+
+    # Nothing new: nothing is published again
+    asyncio.run(relay_once(intake_cursor, notification_cursor, on_intake=relayed.append))
+    assert relayed == [patient_id, patient_id]
+
+
+def test_skipped_ids_are_forgotten_after_the_overlap():
+    cursor = FeedCursor(10, overlap_seconds=0)
+    cursor.seen(13)
+    assert set(cursor.missing) == {11, 12}
+    cursor.expire()
+    assert cursor.missing == {} and cursor.last_id == 13
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import intake_archive
+from database import ArchivedIntakeKey, Medication, MedicationIntake
+
+
+def test_replayed_batch_does_not_record_archived_intakes_again(client, db, patient_headers, patient_id):
+    db.add(Medication(patient_id=patient_id, name="Archived sync", dosage="1mg", schedule={}))
+    db.commit()
+    taken_at = datetime.utcnow() - timedelta(days=400)
+    batch = {"intakes": [
+        {"client_key": f"archived-{i}", "medication_name": "Archived sync", "scheduled_time": "08:00",
+         "taken_at": (taken_at + timedelta(days=i)).isoformat()}
+        for i in range(3)
+    ]}
+
+    first = client.post("/api/medication_intakes/batch", json=batch, headers=patient_headers).json()
+    assert [result["result"] for result in first] == ["created"] * 3
+
+    intake_archive.run(db, cutoff=datetime.utcnow() - timedelta(days=200))
+    assert db.query(MedicationIntake).filter(MedicationIntake.client_key.like("archived-%")).count() == 0
+    assert db.query(ArchivedIntakeKey).filter(ArchivedIntakeKey.client_key.like("archived-%")).count() == 3
+
+    replayed = client.post("/api/medication_intakes/batch", json=batch, headers=patient_headers).json()
+    assert [(result["result"], result["intake_id"]) for result in replayed] == [
+        ("duplicate", result["intake_id"]) for result in first
+    ]
+    assert db.query(MedicationIntake).filter(MedicationIntake.client_key.like("archived-%")).count() == 0
+
+
+def test_archive_run_prunes_keys_past_the_retention_period(db, patient_id):
+    now = datetime.utcnow()
+    retention = timedelta(days=intake_archive.INTAKE_SYNC_KEY_RETENTION_DAYS)
+    db.add_all([
+        ArchivedIntakeKey(patient_id=patient_id, client_key="pruned-old", intake_id=1, taken_at=now - retention - timedelta(days=1)),
+        ArchivedIntakeKey(patient_id=patient_id, client_key="pruned-recent", intake_id=2, taken_at=now - retention + timedelta(days=1)),
+        ArchivedIntakeKey(patient_id=patient_id, client_key="pruned-legacy", intake_id=3, taken_at=None),
+    ])
+    db.commit()
+
+    cutoff = now - timedelta(days=200)
+    intake_archive.run(db, cutoff=cutoff)
+    kept = dict(db.query(ArchivedIntakeKey.client_key, ArchivedIntakeKey.taken_at).filter(
+        ArchivedIntakeKey.client_key.like("pruned-%"),
+    ).all())
+    # Keys archived without taken_at are dated at the cutoff, which bounds them from above
+    assert kept.keys() == {"pruned-recent", "pruned-legacy"}
+    assert kept["pruned-legacy"] == cutoff
@@ -0,0 +1,54 @@
+from datetime import date, datetime, timedelta
+
+from database import DailyAdherence, Medication, MissedDoseNotification
+from query_budget import enforce_budgets
+
+EVERY_DAY = {
+    day: {"enabled": True, "times": ["08:00", "20:00"]}
+    for day in ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+}
+
+
+def test_batch_sync_counts_adherence_per_medication_and_day(client, db, patient_headers, patient_id):
+    medications = []
+    for name in ("Sync A", "Sync B"):
+        medication = Medication(patient_id=patient_id, name=name, dosage="1mg", schedule=EVERY_DAY)
+        db.add(medication)
+        db.commit()
+        medications.append(medication.id)
+    first_day = date(2024, 2, 5)
+    db.add(MissedDoseNotification(
+        scheduled_date=first_day, medication_id=medications[0], patient_id=patient_id, scheduled_time="08:00",
+    ))
+    db.commit()
+
+    intakes = []
+    for offset in range(5):
+        day = datetime.combine(first_day + timedelta(days=offset), datetime.min.time())
+        for name in ("Sync A", "Sync B"):
+            for scheduled_time in ("08:00", "20:00"):
+                hour = int(scheduled_time[:2])
+                intakes.append({
+                    "client_key": f"{name}-{offset}-{scheduled_time}", "medication_name": name,
+                    "scheduled_time": scheduled_time, "taken_at": (day + timedelta(hours=hour, minutes=5)).isoformat(),
+                    "status": "taken" if offset or scheduled_time == "08:00" else "skipped",
+                })
+    # A second intake for a dose already recorded in the batch doesn't count again
+    intakes.append({**intakes[0], "client_key": "again", "taken_at": intakes[0]["taken_at"].replace("08:05", "09:00")})
+
+    # Two reads and one upsert for the rollup, no matter the batch size
+    with enforce_budgets({"POST /api/medication_intakes/batch": (6, 1)}):
+        response = client.post("/api/medication_intakes/batch", json={"intakes": intakes}, headers=patient_headers)
+    assert response.status_code == 200, response.text
+    assert all(result["result"] == "created" for result in response.json())
+
+    rows = {
+        (row.medication_id, row.date): (row.scheduled, row.taken, row.missed)
+        for row in db.query(DailyAdherence).filter(DailyAdherence.medication_id.in_(medications))
+    }
+    # Sync A on the first day: 08:00 was reported missed (moves to taken), 20:00 was skipped
+    assert rows[(medications[0], first_day)] == (1, 1, 0)
+    assert rows[(medications[1], first_day)] == (2, 1, 1)
+    for offset in range(1, 5):
+        for medication_id in medications:
+            assert rows[(medication_id, first_day + timedelta(days=offset))] == (2, 2, 0)
@@ -0,0 +1,53 @@
+from datetime import datetime
+
+import missed_doses
+from database import Medication, MedicationChange
+
+SCHEDULE = {"Monday": {"enabled": True, "times": ["08:00"]}}
+
+
+def add_medication(db, patient_id: int, name: str) -> int:
+    medication = Medication(patient_id=patient_id, name=name, dosage="1mg", schedule=SCHEDULE)
+    db.add(medication)
+    db.commit()
+    return medication.id
+
+
+def test_poll_applies_changes_that_commit_out_of_order(client, db, patient_id):
+    missed_doses.rebuild_dose_engine()
+    first = add_medication(db, patient_id, "Feed first")
+    late = add_medication(db, patient_id, "Feed late")
+
+    # Reserve an id for the "late" change, then commit a higher one before it
+    late_change = MedicationChange(medication_id=late, changed_at=datetime.utcnow())
+    db.add(late_change)
+    db.flush()
+    late_id = late_change.id
+    db.rollback()
+    db.add(MedicationChange(id=late_id + 1, medication_id=first, changed_at=datetime.utcnow()))
+    db.commit()
+
+    missed_doses.poll_medication_changes()
+    assert missed_doses.last_medication_change_id == late_id + 1
+    assert first in missed_doses.dose_engine._entries
+    assert late not in missed_doses.dose_engine._entries
+
+    db.add(MedicationChange(id=late_id, medication_id=late, changed_at=datetime.utcnow()))
+    db.commit()
+    missed_doses.poll_medication_changes()
+    assert late in missed_doses.dose_engine._entries
+
+
+def test_poll_applies_each_change_once(client, db, patient_id, monkeypatch):
+    missed_doses.rebuild_dose_engine()
+    medication_id = add_medication(db, patient_id, "Feed once")
+    db.add(MedicationChange(medication_id=medication_id))
+    db.commit()
+
+    applied = []
+    monkeypatch.setattr(
+        missed_doses.dose_engine, "schedule_medication", lambda medication_id, *args, **kwargs: applied.append(medication_id),
+    )
+    for _ in range(3):
+        missed_doses.poll_medication_changes()
+    assert applied == [medication_id]
@@ -0,0 +1,75 @@
+import asyncio
+
+from medication_transfer import iter_records
+
+NOTES = 'Met eten innemen.\nBij "misselijkheid" halve dosis, zie ""bijsluiter"".\r\nLaatste regel'
+
+
+def parse(body: bytes, fmt: str, chunk_size: int):
+    async def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    async def collect():
+        return [item async for item in iter_records(chunks(), fmt)]
+
+    return asyncio.run(collect())
+
+
+def test_csv_quoted_cells_span_lines_and_chunks():
+    body = (
+        'name,dosage,notes\n'
+        '"Paracetamol","500mg","eerste\nregel, ""tweede"""\n'
+        '\n'
+        'Ibuprofen,200mg,\n'
+    ).encode()
+    for chunk_size in (1, 3, 7, len(body)):
+        assert parse(body, "csv", chunk_size) == [
+            (2, {"name": "Paracetamol", "dosage": "500mg", "notes": 'eerste\nregel, "tweede"'}, None),
+            (5, {"name": "Ibuprofen", "dosage": "200mg"}, None),
+        ]
+
+
+def test_csv_reports_bad_rows_by_starting_line():
+    body = b'name,dosage\nA,1mg,extra\nB,2mg\n"C,3mg\n'
+    records = parse(body, "csv", 4)
+    assert records[0][0] == 2 and records[0][2].startswith("unparseable line")
+    assert records[1] == (3, {"name": "B", "dosage": "2mg"}, None)
+    assert records[2][0] == 4 and "never closed" in records[2][2]
+
+
+def test_csv_export_import_round_trip(client, caregiver_headers, patient_id):
+    schedule = {"Monday": {"enabled": True, "times": ["08:00"]}}
+    created = client.post(
+        f"/api/patients/{patient_id}/medications",
+        json={"name": "Round trip", "dosage": "5mg", "schedule": schedule, "notes": NOTES},
+        headers=caregiver_headers,
+    )
+    assert created.status_code == 200, created.text
+
+    exported = client.get("/api/medications/export", params={"format": "csv"}, headers=caregiver_headers)
+    assert exported.status_code == 200
+    rows = [line for line in exported.content.split(b"\n") if b"Round trip" in line]
+    assert rows, exported.text
+
+    imported = client.post(
+        "/api/medications/import", params={"format": "csv"}, content=exported.content, headers=caregiver_headers,
+    )
+    assert imported.status_code == 200, imported.text
+    assert imported.json()["failed"] == 0, imported.json()
+
+    medications = client.get(f"/api/patients/{patient_id}/medications", headers=caregiver_headers).json()
+    copies = [medication for medication in medications if medication["name"] == "Round trip"]
+    assert len(copies) == 2
+    assert all(medication["notes"] == NOTES for medication in copies)
+    assert all(medication["schedule"] == schedule for medication in copies)
+
+
+def test_csv_stray_quote_in_unquoted_cell_does_not_swallow_later_rows():
+    body = b'name,dosage,notes\nHalf tablet,1/2" tablet,\nParacetamol,500mg,"met ""water""\ninnemen"\nIbuprofen,200mg,\n'
+    for chunk_size in (1, 5, len(body)):
+        assert parse(body, "csv", chunk_size) == [
+            (2, {"name": "Half tablet", "dosage": '1/2" tablet'}, None),
+            (3, {"name": "Paracetamol", "dosage": "500mg", "notes": 'met "water"\ninnemen'}, None),
+            (5, {"name": "Ibuprofen", "dosage": "200mg"}, None),
+        ]
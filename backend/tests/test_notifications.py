@@ -0,0 +1,114 @@
+import email
+import socket
+import threading
+import time as timer
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from notifications import AlertQueue
+
+
+class Mailbox:
+    """aiosmtpd handler keeping delivered messages; the first `failures` deliveries get a 451."""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.attempts = []
+        self.messages = []
+        self.lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.lock:
+            self.attempts.append(timer.monotonic())
+            if len(self.attempts) <= self.failures:
+                return "451 Requested action aborted: try again later"
+            self.messages.append(email.message_from_bytes(envelope.content))
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server():
+    servers = []
+
+    def start(failures: int = 0) -> Controller:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        controller = Controller(Mailbox(failures), hostname="127.0.0.1", port=port)
+        controller.start()
+        servers.append(controller)
+        return controller
+
+    yield start
+    for controller in servers:
+        controller.stop()
+
+
+def alert_queue(controller: Controller, **options) -> AlertQueue:
+    queue = AlertQueue(
+        host=controller.hostname, port=controller.port,
+        sender="alerts@example.test", password=None, use_starttls=False, **options,
+    )
+    queue.start()
+    return queue
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = timer.monotonic() + timeout
+    while timer.monotonic() < deadline:
+        if condition():
+            return True
+        timer.sleep(0.01)
+    return condition()
+
+
+def test_alerts_within_the_digest_window_share_one_email(smtp_server):
+    controller = smtp_server()
+    queue = alert_queue(controller, digest_window=0.3)
+    try:
+        queue.enqueue("carer@example.test", "patient1", "Paracetamol")
+        queue.enqueue("carer@example.test", "patient2", "Ibuprofen")
+        queue.enqueue("other@example.test", "patient3", "Metformine")
+        assert wait_for(lambda: queue.stats()["emails_sent"] == 2)
+    finally:
+        queue.shutdown()
+
+    by_recipient = {message["To"]: message for message in controller.handler.messages}
+    assert set(by_recipient) == {"carer@example.test", "other@example.test"}
+    digest = by_recipient["carer@example.test"]
+    assert digest["Subject"] == "LET OP: 2 medicaties nog niet ingenomen"
+    assert "patient1: 'Paracetamol'" in digest.get_payload() and "patient2: 'Ibuprofen'" in digest.get_payload()
+    assert "patient3" in by_recipient["other@example.test"]["Subject"]
+    assert queue.stats()["alerts_sent"] == 3
+
+
+def test_failed_send_is_retried_with_backoff(smtp_server):
+    controller = smtp_server(failures=2)
+    queue = alert_queue(controller, digest_window=0, retry_backoff=0.1, max_attempts=5)
+    try:
+        queue.enqueue("carer@example.test", "patient1", "Paracetamol")
+        assert wait_for(lambda: queue.stats()["emails_sent"] == 1)
+    finally:
+        queue.shutdown()
+
+    attempts = controller.handler.attempts
+    assert len(attempts) == 3 and len(controller.handler.messages) == 1
+    # Backoff doubles: 0.1s before the second attempt, 0.2s before the third
+    assert attempts[1] - attempts[0] >= 0.1
+    assert attempts[2] - attempts[1] >= 0.2
+    stats = queue.stats()
+    assert stats["send_failures"] == 2 and stats["alerts_dropped"] == 0
+
+
+def test_alerts_are_dropped_after_max_attempts(smtp_server):
+    controller = smtp_server(failures=10)
+    queue = alert_queue(controller, digest_window=0, retry_backoff=0.01, max_attempts=3)
+    try:
+        queue.enqueue("carer@example.test", "patient1", "Paracetamol")
+        assert wait_for(lambda: queue.stats()["alerts_dropped"] == 1)
+    finally:
+        queue.shutdown()
+
+    assert len(controller.handler.attempts) == 3
+    assert controller.handler.messages == []
@@ -0,0 +1,121 @@
+"""
+Query budgets for the hot read paths and the missed-dose checker.
+
+The dataset is big enough that an N+1 pattern (a query per patient, medication
+or intake) blows the budget: each budget is the fixed number of statements the
+path needs, and no statement shape may repeat.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert
+
+import auth
+import missed_doses
+from database import (
+    DailyAdherence, Medication, MedicationIntake, MissedDoseNotification, Role, ScheduleSlot, SessionLocal, User,
+)
+from query_budget import enforce_budgets
+from schedule_slots import slot_rows
+
+PATIENTS = 6
+MEDICATIONS_PER_PATIENT = 3
+INTAKES_PER_MEDICATION = 20
+
+BUDGETS = {
+    # Principal lookup (cold token), patient check, hot intakes, archived months
+    "GET /api/patients/{patient_id}/medication_intakes": (4, 1),
+    "GET /api/medication_intakes": (3, 1),
+    # Principal lookup, then patients, medications and today's intakes
+    "GET /api/caregiver/overview": (4, 1),
+    # Principal lookup, schedule version, the patient's day
+    "GET /api/patient/due": (4, 1),
+    # Due doses, missed doses, one claim insert and one adherence upsert for all of them
+    "job missed_dose_check": (4, 1),
+}
+
+
+@pytest.fixture(scope="module")
+def dataset(client):
+    """A caregiver with patients whose doses of 7 minutes ago are all unrecorded."""
+    now = datetime.now()
+    scheduled_at = (now - timedelta(minutes=7)).replace(second=0, microsecond=0)
+    day_name = scheduled_at.strftime("%A")
+    schedule = {day_name: {"enabled": True, "times": ["07:00", scheduled_at.strftime("%H:%M")]}}
+
+    db = SessionLocal()
+    try:
+        caregiver_role = db.query(Role.id).filter(Role.name == "mantelzorger").scalar()
+        patient_role = db.query(Role.id).filter(Role.name == "patient").scalar()
+        caregiver = User(username="budget_caregiver", hashed_password="x", role_id=caregiver_role)
+        db.add(caregiver)
+        db.flush()
+        patients = [
+            User(username=f"budget_patient{i}", hashed_password="x", role_id=patient_role, caregiver_id=caregiver.id)
+            for i in range(PATIENTS)
+        ]
+        db.add_all(patients)
+        db.flush()
+        medications = [
+            Medication(patient_id=patient.id, name=f"Budget {i}", dosage="1mg", schedule=schedule)
+            for patient in patients for i in range(MEDICATIONS_PER_PATIENT)
+        ]
+        db.add_all(medications)
+        db.flush()
+        db.execute(insert(ScheduleSlot), [row for m in medications for row in slot_rows(m.id, schedule)])
+        db.execute(insert(MedicationIntake), [
+            {"medication_id": m.id, "patient_id": m.patient_id, "scheduled_time": "07:00",
+             "taken_at": datetime.utcnow() - timedelta(days=day), "status": "taken"}
+            for m in medications for day in range(INTAKES_PER_MEDICATION)
+        ])
+        db.commit()
+        return {"caregiver": caregiver.username, "patients": [(p.id, p.username) for p in patients]}
+    finally:
+        db.close()
+
+
+def headers(username: str) -> dict:
+    return {"Authorization": f"Bearer {auth.create_access_token({'sub': username})}"}
+
+
+def get_twice(client, path: str, username: str):
+    """Cold (principal not cached yet) and warm request; both must stay within budget."""
+    request_headers = headers(username)
+    for _ in range(2):
+        response = client.get(path, headers=request_headers)
+        assert response.status_code == 200, response.text
+    return response
+
+
+def test_intake_history_budget(client, dataset):
+    patient_id, username = dataset["patients"][0]
+    with enforce_budgets(BUDGETS):
+        response = get_twice(client, f"/api/patients/{patient_id}/medication_intakes", dataset["caregiver"])
+        get_twice(client, "/api/medication_intakes", username)
+    assert len(response.json()) == MEDICATIONS_PER_PATIENT * INTAKES_PER_MEDICATION
+
+
+def test_caregiver_overview_budget(client, dataset):
+    with enforce_budgets(BUDGETS):
+        response = get_twice(client, "/api/caregiver/overview", dataset["caregiver"])
+    patients = response.json()["patients"]
+    assert len(patients) == PATIENTS
+    assert all(len(patient["medications"]) == MEDICATIONS_PER_PATIENT for patient in patients)
+
+
+def test_patient_due_budget(client, dataset):
+    _, username = dataset["patients"][1]
+    with enforce_budgets(BUDGETS):
+        get_twice(client, "/api/patient/due?window_minutes=30", username)
+
+
+def test_missed_dose_check_budget(client, db, dataset):
+    with enforce_budgets(BUDGETS):
+        missed_doses.check_missed_medications()
+        # The same tick again finds everything claimed already
+        missed_doses.check_missed_medications()
+
+    patient_ids = [patient_id for patient_id, _ in dataset["patients"]]
+    claimed = db.query(MissedDoseNotification).filter(MissedDoseNotification.patient_id.in_(patient_ids)).count()
+    counted = sum(row.missed for row in db.query(DailyAdherence).filter(DailyAdherence.patient_id.in_(patient_ids)))
+    assert claimed == counted == PATIENTS * MEDICATIONS_PER_PATIENT
@@ -0,0 +1,80 @@
+import { defineStore, acceptHMRUpdate } from 'pinia'
+import { api } from 'boot/axios'
+
+const STORAGE_KEY = 'pendingIntakes'
+const MAX_BATCH_SIZE = 500
+
+// crypto.randomUUID only exists in secure contexts (HTTPS or localhost);
+// getRandomValues is available everywhere, so build a v4 UUID from it there
+const newClientKey = () => {
+  if (typeof crypto.randomUUID === 'function') {
+    return crypto.randomUUID()
+  }
+  const bytes = crypto.getRandomValues(new Uint8Array(16))
+  bytes[6] = (bytes[6] & 0x0f) | 0x40
+  bytes[8] = (bytes[8] & 0x3f) | 0x80
+  const hex = Array.from(bytes, (byte) => byte.toString(16).padStart(2, '0')).join('')
+  return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`
+}
+
+// Intakes are queued on the device and synced in batches, so an offline
+// period or a retried request never loses or duplicates an intake.
+export const useIntakeQueueStore = defineStore('intakeQueue', {
+  state: () => ({
+    pending: JSON.parse(localStorage.getItem(STORAGE_KEY) || '[]'),
+    syncing: false,
+  }),
+
+  actions: {
+    // Throws, leaving the queue unchanged, if the intake can't be stored on the device
+    enqueue(intake) {
+      const pending = [
+        ...this.pending,
+        { client_key: newClientKey(), taken_at: new Date().toISOString(), ...intake },
+      ]
+      localStorage.setItem(STORAGE_KEY, JSON.stringify(pending))
+      this.pending = pending
+    },
+
+    persist() {
+      localStorage.setItem(STORAGE_KEY, JSON.stringify(this.pending))
+    },
+
+    async sync() {
+      if (this.syncing) {
+        // The running sync keeps sending batches until nothing is pending, including these
+        return []
+      }
+
+      this.syncing = true
+      const results = []
+      try {
+        // Stop when the queue is empty or a batch settled nothing (a failed request throws)
+        let progressed = true
+        while (this.pending.length > 0 && progressed) {
+          const batch = this.pending.slice(0, MAX_BATCH_SIZE)
+          const response = await api.post('/api/medication_intakes/batch', { intakes: batch })
+
+          // created, duplicate and error results are all final; keep only unsent items
+          const done = new Set(response.data.map((result) => result.client_key))
+          const before = this.pending.length
+          this.pending = this.pending.filter((intake) => !done.has(intake.client_key))
+          this.persist()
+          progressed = this.pending.length < before
+
+          response.data
+            .filter((result) => result.result === 'error')
+            .forEach((result) => console.log(`Intake ${result.client_key} rejected: ${result.detail}`))
+          results.push(...response.data)
+        }
+        return results
+      } finally {
+        this.syncing = false
+      }
+    },
+  },
+})
+
+if (import.meta.hot) {
+  import.meta.hot.accept(acceptHMRUpdate(useIntakeQueueStore, import.meta.hot))
+}